@@ -0,0 +1,93 @@
+# benchmarks/bench_get_or_create_user.py
+# So sánh độ trễ của get_or_create_user hiện tại với cách cũ (SELECT/INSERT/commit/SELECT +
+# gán toàn bộ thành tựu, mỗi lần gọi mở một kết nối mới).
+#
+# Chạy từ thư mục gốc của repo:  python benchmarks/bench_get_or_create_user.py [số_người_dùng]
+# Benchmark dùng một file DB tạm, không đụng tới bot_data.db.
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import aiosqlite
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database as db  # noqa: E402
+
+GUILD_ID = 1
+
+
+# --- Cách cũ, giữ nguyên logic để làm mốc so sánh ---
+
+async def legacy_assign_all_achievements_to_user(user_id, guild_id):
+    async with aiosqlite.connect(db.DB_NAME) as conn:
+        conn.row_factory = aiosqlite.Row
+        async with conn.execute("SELECT achievement_id FROM achievements") as cursor:
+            all_achievement_ids = [row['achievement_id'] for row in await cursor.fetchall()]
+        await conn.executemany("INSERT OR IGNORE INTO user_achievements (user_id, guild_id, achievement_id) VALUES (?, ?, ?)",
+                               [(user_id, guild_id, ach_id) for ach_id in all_achievement_ids])
+        await conn.commit()
+
+
+async def legacy_get_or_create_user(user_id, guild_id):
+    async with aiosqlite.connect(db.DB_NAME) as conn:
+        conn.row_factory = aiosqlite.Row
+        async with conn.execute("SELECT * FROM users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
+            user = await cursor.fetchone()
+        if not user:
+            await conn.execute("INSERT INTO users (user_id, guild_id, coins) VALUES (?, ?, ?)", (user_id, guild_id, 500))
+            await conn.commit()
+            async with conn.execute("SELECT * FROM users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
+                user = await cursor.fetchone()
+            await legacy_assign_all_achievements_to_user(user_id, guild_id)
+            async with conn.execute("SELECT * FROM users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
+                user = await cursor.fetchone()
+        return dict(user)
+
+
+# --- Đo đạc ---
+
+async def measure(func, user_ids):
+    timings = []
+    for user_id in user_ids:
+        start = time.perf_counter()
+        await func(user_id, GUILD_ID)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(label, timings):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"{label:<28} trung bình {statistics.mean(timings):7.3f} ms | p50 {statistics.median(timings):7.3f} ms | p95 {p95:7.3f} ms")
+
+
+async def main(n_users):
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_NAME = os.path.join(tmp, 'bench.db')
+        db.init_db()
+        await db.init_pool()
+        try:
+            legacy_ids = range(1, n_users + 1)
+            current_ids = range(n_users + 1, 2 * n_users + 1)
+
+            print(f"\n=== {n_users} người dùng, guild {GUILD_ID} ===")
+            report("Cũ - lần đầu (tạo mới)", await measure(legacy_get_or_create_user, legacy_ids))
+            report("Mới - lần đầu (tạo mới)", await measure(db.get_or_create_user, current_ids))
+            report("Cũ - đường nóng (đã có)", await measure(legacy_get_or_create_user, legacy_ids))
+            report("Mới - đường nóng (đã có)", await measure(db.get_or_create_user, current_ids))
+
+            async with db.reader() as conn:
+                async with conn.execute("SELECT COUNT(*) FROM user_achievements WHERE user_id <= ?", (n_users,)) as cursor:
+                    legacy_rows = (await cursor.fetchone())[0]
+                async with conn.execute("SELECT COUNT(*) FROM user_achievements WHERE user_id > ?", (n_users,)) as cursor:
+                    current_rows = (await cursor.fetchone())[0]
+            print(f"Dòng user_achievements được tạo: cũ {legacy_rows} | mới {current_rows}")
+        finally:
+            await db.close_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 500))
@@ -6,10 +6,12 @@ import asyncio
 import datetime
 from dotenv import load_dotenv
 import database as db
+from cogs.utils.activity import activity
 
 # --- CẤU HÌNH BAN ĐẦU ---
 load_dotenv()
 BOT_TOKEN = os.getenv('COMMUNITY_BOT_TOKEN')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', db.DB_POOL_SIZE))
 
 if not BOT_TOKEN:
     print("Lỗi: Không tìm thấy biến COMMUNITY_BOT_TOKEN trong file .env của bạn.")
@@ -21,11 +23,17 @@ if not BOT_TOKEN:
 class CommunityBot(commands.Bot):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        # on_ready chạy lại mỗi lần gateway kết nối lại, cờ này giúp chỉ khởi tạo một lần
+        self.startup_complete = False
 
     async def setup_hook(self):
         # Đây là nơi hoàn hảo để tải cogs và đồng bộ lệnh.
         # Nó sẽ chạy sau khi bot đăng nhập nhưng trước on_ready.
 
+        # 0. Đưa schema database lên phiên bản mới nhất, rồi mở pool kết nối dùng chung
+        db.init_db()
+        await db.init_pool(size=DB_POOL_SIZE)
+
         # 1. Tải tất cả các cogs
         print("--- Bắt đầu tải Cogs ---")
         for filename in os.listdir('./cogs'):
@@ -48,6 +56,13 @@ class CommunityBot(commands.Bot):
                 print(f"Lỗi khi đồng bộ lệnh cho server {guild.name}: {e}")
         print("--- Đồng bộ lệnh hoàn tất ---")
 
+    async def close(self):
+        # Gỡ cogs và ngắt kết nối Discord trước, sau đó mới đóng pool database
+        await super().close()
+        # Ghi nốt tiến trình nhiệm vụ/thành tựu còn trong hàng đợi trước khi đóng pool
+        await activity.close()
+        await db.close_pool()
+
 
 # --- THIẾT LẬP BOT ---
 intents = discord.Intents.all()
@@ -60,8 +75,11 @@ bot = CommunityBot(command_prefix='?', intents=intents, help_command=None)
 @bot.event
 async def on_ready():
     """Sự kiện được kích hoạt sau khi setup_hook đã chạy xong."""
+    if bot.startup_complete:
+        # Kết nối lại sau khi mất mạng: mọi thứ đã được khởi tạo, không làm gì thêm
+        return
+    bot.startup_complete = True
     print(f'Bot đã đăng nhập với tên: {bot.user}')
-    db.init_db()
     await bot.change_presence(activity=discord.Game(name="/help để xem mọi thứ"))
     print("Bot đã sẵn sàng!")
 
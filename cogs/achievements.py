@@ -22,11 +22,7 @@ class Achievements(commands.Cog):
         user_achievements = await db.get_user_achievements(target.id, ctx.guild.id)
 
         if not user_achievements:
-            await db.assign_all_achievements_to_user(target.id, ctx.guild.id)
-            user_achievements = await db.get_user_achievements(
-                target.id, ctx.guild.id)
-            if not user_achievements:
-                return await ctx.send("Không thể tải dữ liệu thành tựu cho người dùng này.", delete_after=10, ephemeral=True)
+            return await ctx.send("Không thể tải dữ liệu thành tựu cho người dùng này.", delete_after=10, ephemeral=True)
 
         embed = discord.Embed(
             title=f"Bảng Thành Tựu của {target.display_name}", color=target.color)
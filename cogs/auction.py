@@ -1,11 +1,14 @@
 # cogs/auction.py
 import discord
-from discord.ext import commands, tasks
+from discord.ext import commands
 import datetime
 import re
 from typing import Union
 import database as db
-from .utils import checks
+from .utils import checks, members
+from .utils.activity import activity
+from .utils.reward_roles import reward_roles
+from .utils.scheduler import scheduler
 from discord import app_commands
 
 
@@ -30,19 +33,17 @@ class Auction(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
-        self.check_finished_auctions.start()
+        # Phiên đấu giá được kết thúc đúng hạn bởi bộ hẹn giờ, không quét bảng mỗi phút
+        scheduler.add_handler('auction', self.finish_auction)
 
     def cog_unload(self):
-        self.check_finished_auctions.cancel()
+        scheduler.remove_handler('auction', self.finish_auction)
 
     async def cog_check(self, ctx: commands.Context):
         """Kiểm tra chung cho tất cả các lệnh trong Cog này."""
-        config = await db.get_or_create_config(ctx.guild.id)
-        if debtor_role_id := config.get('debtor_role_id'):
-            if debtor_role := ctx.guild.get_role(debtor_role_id):
-                if debtor_role in ctx.author.roles:
-                    await ctx.send("Bạn đang trong tình trạng vỡ nợ và không thể sử dụng lệnh này! Dùng `?trano` để trả nợ.", delete_after=10, ephemeral=True)
-                    return False
+        if (await reward_roles.get(ctx.guild.id)).is_debtor(ctx.author):
+            await ctx.send("Bạn đang trong tình trạng vỡ nợ và không thể sử dụng lệnh này! Dùng `?trano` để trả nợ.", delete_after=10, ephemeral=True)
+            return False
         return True
 
     # BỎ DECORATOR QUYỀN Ở ĐÂY
@@ -179,18 +180,8 @@ class Auction(commands.Cog):
             await db.update_coins(highest_bidder_id, ctx.guild.id, auction['current_bid'])
 
         await db.update_coins(ctx.author.id, ctx.guild.id, -amount)
-        await db.update_quest_progress(ctx.author.id, ctx.guild.id, 'BID_AUCTION')
-        await db.update_quest_progress(ctx.author.id, ctx.guild.id, 'COIN_SPEND', value_to_add=amount)
-
-        unlocked_bid = await db.update_achievement_progress(ctx.author.id, ctx.guild.id, 'BID_AUCTION')
-        if unlocked_bid:
-            for ach in unlocked_bid:
-                await ctx.channel.send(f"🏆 {ctx.author.mention} vừa mở khóa thành tựu mới: **{ach['name']}**! (+{ach['reward_coin']:,} coin, +{ach['reward_xp']} XP)", delete_after=30)
-
-        unlocked_spend = await db.update_achievement_progress(ctx.author.id, ctx.guild.id, 'COIN_SPEND', value_to_add=amount)
-        if unlocked_spend:
-            for ach in unlocked_spend:
-                await ctx.channel.send(f"🏆 {ctx.author.mention} vừa mở khóa thành tựu mới: **{ach['name']}**! (+{ach['reward_coin']:,} coin, +{ach['reward_xp']} XP)", delete_after=30)
+        activity.emit(ctx.author.id, ctx.guild.id, 'BID_AUCTION', channel=ctx.channel)
+        activity.emit(ctx.author.id, ctx.guild.id, 'COIN_SPEND', amount, channel=ctx.channel)
 
         await db.update_bid(auction['message_id'], amount, ctx.author.id)
 
@@ -209,91 +200,82 @@ class Auction(commands.Cog):
 
     # cogs/auction.py
 
-    @tasks.loop(minutes=1)
-    async def check_finished_auctions(self):
-        now = datetime.datetime.now(datetime.timezone.utc)
-        active_auctions = await db.get_active_auctions()
-        for auction in active_auctions:
-            end_time = datetime.datetime.fromisoformat(
-                auction['end_timestamp'])
-            if now < end_time:
-                continue
-
-            await db.end_auction(auction['message_id'])
-
-            guild = self.bot.get_guild(auction['guild_id'])
-            if not guild:
-                continue
-            # 'channel' ở đây chính là kênh đấu giá gốc
-            channel = guild.get_channel(auction['channel_id'])
-            if not channel:
-                continue
-
-            winner_id, final_price = auction.get(
-                'highest_bidder_id'), auction['current_bid']
-            item_name_display = auction['item_name']
-
-            if winner_id:
-                try:
-                    winner = await guild.fetch_member(winner_id)
-                    seller = await guild.fetch_member(auction['seller_id'])
-                except discord.NotFound:
-                    await db.update_coins(winner_id, guild.id, final_price)
-                    await channel.send(f"⚠️ Phiên đấu giá cho **{auction['item_name']}** đã kết thúc nhưng người thắng/người bán không còn trong server. Giao dịch đã được hoàn lại.")
-                    continue
-
-                if seller:
-                    await db.update_coins(seller.id, guild.id, final_price)
-
-                if auction['item_type'] == 'ROLE':
-                    if role_to_award := guild.get_role(auction['item_id']):
-                        try:
-                            await winner.add_roles(role_to_award, reason=f"Thắng đấu giá vật phẩm {item_name_display}")
-                            item_name_display = role_to_award.mention
-                        except discord.Forbidden:
-                            await channel.send(f"⚠️ Bot không có quyền để trao role **{role_to_award.name}** cho người thắng cuộc.")
-
-                # --- PHẦN THÔNG BÁO (ĐÃ CẬP NHẬT ĐỂ GỬI TẠI KÊNH GỐC) ---
-                result_embed = discord.Embed(
-                    title="🔨 KẾT THÚC PHIÊN ĐẤU GIÁ 🔨",
-                    description=f"Một vật phẩm đã tìm thấy chủ nhân mới!",
-                    color=discord.Color.green(),
-                    timestamp=datetime.datetime.now(datetime.timezone.utc)
-                )
-                result_embed.add_field(
-                    name="✨ Người Chiến Thắng", value=f"**{winner.mention}**", inline=True)
-                result_embed.add_field(
-                    name="🏆 Vật Phẩm", value=f"**{item_name_display}**", inline=True)
-                result_embed.add_field(
-                    name="💰 Giá Cuối Cùng", value=f"### {final_price:,} coin", inline=False)
-                result_embed.set_thumbnail(url=winner.display_avatar.url)
-                result_embed.set_footer(
-                    text=f"Người bán: {seller.display_name}", icon_url=seller.display_avatar.url)
-
-                # Gửi thông báo trực tiếp vào kênh 'channel' (kênh đấu giá)
-                await channel.send(embed=result_embed)
-
-                try:
-                    await winner.send(f"Chúc mừng! Bạn đã thắng đấu giá và nhận được **{item_name_display}** với giá **{final_price:,}** coin tại server **{guild.name}**.")
-                except discord.Forbidden:
-                    pass
-            else:
-                await channel.send(f"⚠️ Phiên đấu giá cho **{auction['item_name']}** đã kết thúc mà không có ai tham gia.")
+    async def finish_auction(self, message_id: int):
+        """Handler của bộ hẹn giờ, được gọi khi phiên đấu giá `message_id` hết giờ."""
+        auction = await db.get_auction(message_id)
+        if not auction or not auction['is_active']:
+            return
+
+        await db.end_auction(auction['message_id'])
+
+        guild = self.bot.get_guild(auction['guild_id'])
+        if not guild:
+            return
+        # 'channel' ở đây chính là kênh đấu giá gốc
+        channel = guild.get_channel(auction['channel_id'])
+        if not channel:
+            return
+
+        winner_id, final_price = auction.get(
+            'highest_bidder_id'), auction['current_bid']
+        item_name_display = auction['item_name']
+
+        if winner_id:
+            found = await members.resolver('auction').get_many(guild, [winner_id, auction['seller_id']])
+            winner, seller = found.get(winner_id), found.get(auction['seller_id'])
+            if not winner or not seller:
+                await db.update_coins(winner_id, guild.id, final_price)
+                await channel.send(f"⚠️ Phiên đấu giá cho **{auction['item_name']}** đã kết thúc nhưng người thắng/người bán không còn trong server. Giao dịch đã được hoàn lại.")
+                return
+
+            if seller:
+                await db.update_coins(seller.id, guild.id, final_price)
+
+            if auction['item_type'] == 'ROLE':
+                if role_to_award := guild.get_role(auction['item_id']):
+                    try:
+                        await winner.add_roles(role_to_award, reason=f"Thắng đấu giá vật phẩm {item_name_display}")
+                        item_name_display = role_to_award.mention
+                    except discord.Forbidden:
+                        await channel.send(f"⚠️ Bot không có quyền để trao role **{role_to_award.name}** cho người thắng cuộc.")
+
+            # --- PHẦN THÔNG BÁO (ĐÃ CẬP NHẬT ĐỂ GỬI TẠI KÊNH GỐC) ---
+            result_embed = discord.Embed(
+                title="🔨 KẾT THÚC PHIÊN ĐẤU GIÁ 🔨",
+                description=f"Một vật phẩm đã tìm thấy chủ nhân mới!",
+                color=discord.Color.green(),
+                timestamp=datetime.datetime.now(datetime.timezone.utc)
+            )
+            result_embed.add_field(
+                name="✨ Người Chiến Thắng", value=f"**{winner.mention}**", inline=True)
+            result_embed.add_field(
+                name="🏆 Vật Phẩm", value=f"**{item_name_display}**", inline=True)
+            result_embed.add_field(
+                name="💰 Giá Cuối Cùng", value=f"### {final_price:,} coin", inline=False)
+            result_embed.set_thumbnail(url=winner.display_avatar.url)
+            result_embed.set_footer(
+                text=f"Người bán: {seller.display_name}", icon_url=seller.display_avatar.url)
+
+            # Gửi thông báo trực tiếp vào kênh 'channel' (kênh đấu giá)
+            await channel.send(embed=result_embed)
 
             try:
-                auction_msg = await channel.fetch_message(auction['message_id'])
-                original_embed = auction_msg.embeds[0]
-                original_embed.title = f"[ĐÃ KẾT THÚC] PHIÊN ĐẤU GIÁ"
-                original_embed.color = discord.Color.dark_grey()
-                original_embed.set_thumbnail(url=None)
-                # Chỉnh sửa tin nhắn gốc và xóa các nút bấm
-                await auction_msg.edit(embed=original_embed, view=None)
-            except (discord.NotFound, discord.HTTPException):
+                await winner.send(f"Chúc mừng! Bạn đã thắng đấu giá và nhận được **{item_name_display}** với giá **{final_price:,}** coin tại server **{guild.name}**.")
+            except discord.Forbidden:
                 pass
+        else:
+            await channel.send(f"⚠️ Phiên đấu giá cho **{auction['item_name']}** đã kết thúc mà không có ai tham gia.")
 
-    @check_finished_auctions.before_loop
-    async def before_check_auctions(self):
-        await self.bot.wait_until_ready()
+        try:
+            auction_msg = await channel.fetch_message(auction['message_id'])
+            original_embed = auction_msg.embeds[0]
+            original_embed.title = f"[ĐÃ KẾT THÚC] PHIÊN ĐẤU GIÁ"
+            original_embed.color = discord.Color.dark_grey()
+            original_embed.set_thumbnail(url=None)
+            # Chỉnh sửa tin nhắn gốc và xóa các nút bấm
+            await auction_msg.edit(embed=original_embed, view=None)
+        except (discord.NotFound, discord.HTTPException):
+            pass
 
 
 async def setup(bot):
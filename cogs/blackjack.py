@@ -5,6 +5,8 @@ import random
 import asyncio
 import database as db
 from .utils import checks  # Thêm import này nếu chưa có
+from .utils.activity import activity
+from .utils.reward_roles import reward_roles
 from discord import app_commands
 
 # =============================================================
@@ -207,14 +209,7 @@ class BlackjackGameView(discord.ui.View):
         await self.message.edit(embed=final_embed, view=new_lobby_view)
 
     async def update_win_stats(self, member: discord.Member):
-        await db.update_quest_progress(member.id, member.guild.id, 'BLACKJACK_WIN')
-        unlocked_ach = await db.update_achievement_progress(member.id, member.guild.id, 'BLACKJACK_WIN')
-        if unlocked_ach:
-            for ach in unlocked_ach:
-                try:
-                    await self.message.channel.send(f"🏆 {member.mention} mở khóa thành tựu: **{ach['name']}**! (+{ach['reward_coin']:,} coin, +{ach['reward_xp']} XP)", delete_after=30)
-                except:
-                    pass
+        activity.emit(member.id, member.guild.id, 'BLACKJACK_WIN', channel=self.message.channel)
 
     @discord.ui.button(label="Rút Bài", style=discord.ButtonStyle.green, emoji="➕")
     async def hit(self, i: discord.Interaction, b: discord.ui.Button):
@@ -302,8 +297,7 @@ class Blackjack(commands.Cog):
     def __init__(self, bot): self.bot = bot
 
     async def cog_check(self, ctx: commands.Context):
-        config = await db.get_or_create_config(ctx.guild.id)
-        if (debtor_role_id := config.get('debtor_role_id')) and (debtor_role := ctx.guild.get_role(debtor_role_id)) and debtor_role in ctx.author.roles:
+        if (await reward_roles.get(ctx.guild.id)).is_debtor(ctx.author):
             await ctx.send("Bạn đang trong tình trạng vỡ nợ!", ephemeral=True, delete_after=10)
             return False
         return True
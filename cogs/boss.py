@@ -255,8 +255,9 @@ class Boss(commands.Cog):
                 attackers = await db.get_all_attackers(guild.id)
                 total_damage = sum(p['total_damage'] for p in attackers)
                 if total_damage == 0:
-                    await db.delete_boss(guild.id)
-                    await db.clear_attackers(guild.id)
+                    async with db.transaction() as tx:
+                        await db.delete_boss(guild.id, tx=tx)
+                        await db.clear_attackers(guild.id, tx=tx)
                     return
 
                 last_hitter = author
@@ -276,42 +277,47 @@ class Boss(commands.Cog):
                 last_hit_bonus_coin = int(reward_pot * 0.05)
 
                 special_rewards_text = ""
-                if mvp:
-                    await db.update_coins(mvp.id, guild.id, mvp_bonus_coin)
-                    special_rewards_text += f"👑 **MVP:** {mvp.mention} `(+{mvp_bonus_coin:,} 🪙)`\n"
-                if last_hitter:
-                    await db.update_coins(last_hitter.id, guild.id, last_hit_bonus_coin)
-                    special_rewards_text += f"💥 **Đòn kết liễu:** {last_hitter.mention} `(+{last_hit_bonus_coin:,} 🪙)`"
+                all_reward_lines = []
+                # Toàn bộ phần thưởng và việc dọn boss được ghi trong MỘT giao dịch
+                async with db.transaction() as tx:
+                    if mvp:
+                        await db.update_coins(mvp.id, guild.id, mvp_bonus_coin, tx=tx)
+                        special_rewards_text += f"👑 **MVP:** {mvp.mention} `(+{mvp_bonus_coin:,} 🪙)`\n"
+                    if last_hitter:
+                        await db.update_coins(last_hitter.id, guild.id, last_hit_bonus_coin, tx=tx)
+                        special_rewards_text += f"💥 **Đòn kết liễu:** {last_hitter.mention} `(+{last_hit_bonus_coin:,} 🪙)`"
+
+                    for i, attacker in enumerate(attackers):
+                        member = guild.get_member(attacker['user_id'])
+                        if not member:
+                            continue
+
+                        share = attacker['total_damage'] / total_damage
+                        coin_reward = int(reward_pot * share)
+                        await db.update_coins(attacker['user_id'], guild.id, coin_reward, tx=tx)
+                        xp_reward = int(attacker['total_damage'] / 5)
+                        await db.update_user_xp(attacker['user_id'], guild.id, xp_reward, tx=tx)
+
+                        item_reward_text = ""
+                        if random.random() < 0.20:
+                            droppable_items = {
+                                k: v for k, v in SHOP_ITEMS.items() if k not in ['lottery_ticket', 'perm_damage_upgrade']}
+                            if droppable_items:
+                                dropped_item_id = random.choice(
+                                    list(droppable_items.keys()))
+                                await db.add_item_to_inventory(attacker['user_id'], guild.id, dropped_item_id, tx=tx)
+                                item_reward_text = f" • 🎁 `{SHOP_ITEMS[dropped_item_id]['name']}`"
+
+                        rank_emoji = {0: '🥇', 1: '🥈', 2: '🥉'}.get(i, f"`#{i+1}`")
+                        all_reward_lines.append(
+                            f"{rank_emoji} {member.mention}: **{coin_reward:,}** 🪙, **{xp_reward:,}** ⭐{item_reward_text}")
+
+                    await db.delete_boss(guild.id, tx=tx)
+                    await db.clear_attackers(guild.id, tx=tx)
 
                 victory_embed.add_field(
                     name="✨─── VINH DANH ANH HÙNG ───✨", value=special_rewards_text, inline=False)
 
-                all_reward_lines = []
-                for i, attacker in enumerate(attackers):
-                    member = guild.get_member(attacker['user_id'])
-                    if not member:
-                        continue
-
-                    share = attacker['total_damage'] / total_damage
-                    coin_reward = int(reward_pot * share)
-                    await db.update_coins(attacker['user_id'], guild.id, coin_reward)
-                    xp_reward = int(attacker['total_damage'] / 5)
-                    await db.update_user_xp(attacker['user_id'], guild.id, xp_reward)
-
-                    item_reward_text = ""
-                    if random.random() < 0.20:
-                        droppable_items = {
-                            k: v for k, v in SHOP_ITEMS.items() if k not in ['lottery_ticket', 'perm_damage_upgrade']}
-                        if droppable_items:
-                            dropped_item_id = random.choice(
-                                list(droppable_items.keys()))
-                            await db.add_item_to_inventory(attacker['user_id'], guild.id, dropped_item_id)
-                            item_reward_text = f" • 🎁 `{SHOP_ITEMS[dropped_item_id]['name']}`"
-
-                    rank_emoji = {0: '🥇', 1: '🥈', 2: '🥉'}.get(i, f"`#{i+1}`")
-                    all_reward_lines.append(
-                        f"{rank_emoji} {member.mention}: **{coin_reward:,}** 🪙, **{xp_reward:,}** ⭐{item_reward_text}")
-
                 per_page = 10
                 initial_page_content = "\n".join(all_reward_lines[:per_page])
                 victory_embed.add_field(
@@ -327,9 +333,6 @@ class Boss(commands.Cog):
                 except (discord.Forbidden, discord.HTTPException) as e:
                     print(f"Lỗi khi gửi tin nhắn chiến thắng boss: {e}")
 
-                await db.delete_boss(guild.id)
-                await db.clear_attackers(guild.id)
-
             else:
                 attackers = await db.get_all_attackers(guild.id)
                 new_embed = create_boss_embed(
@@ -3,10 +3,11 @@ import discord
 from discord.ext import commands
 import random
 import datetime
-from typing import Union
 import re
 import database as db
 from .utils import checks
+from .utils.activity import activity
+from .utils.reward_roles import reward_roles
 from discord import app_commands
 
 # --- HÀM HELPER ---
@@ -287,9 +288,27 @@ class ShopView(discord.ui.View):
         # Bước 1: Defer để có thời gian xử lý
         await interaction.response.defer()
 
-        # Bước 2: Kiểm tra lại số dư coin một lần nữa
-        current_user_data = await db.get_or_create_user(interaction.user.id, interaction.guild.id)
-        if current_user_data['coins'] < total_cost:
+        # Bước 2: Kiểm tra lại số dư và ghi mọi thay đổi trong CÙNG một giao dịch
+        item_id = item_to_buy.get('id')
+        async with db.transaction() as tx:
+            current_user_data = await db.get_or_create_user(interaction.user.id, interaction.guild.id, tx=tx)
+            has_enough_coins = current_user_data['coins'] >= total_cost
+            if has_enough_coins:
+                await db.update_coins(interaction.user.id, interaction.guild.id, -total_cost, tx=tx)
+                if item_id == 'perm_damage_upgrade':
+                    await db.update_perm_damage_bonus(interaction.user.id, interaction.guild.id, 0.05, tx=tx)
+                elif 'role_id' in item_to_buy:
+                    duration_seconds = item_to_buy['duration_seconds']
+                    if duration_seconds > 0:
+                        expiry = datetime.datetime.now(
+                            datetime.timezone.utc) + datetime.timedelta(seconds=duration_seconds)
+                        await db.add_temporary_role(interaction.user.id, interaction.guild.id, item_to_buy['role_id'], expiry.isoformat(), tx=tx)
+                else:
+                    await db.add_item_to_inventory(interaction.user.id, interaction.guild.id, item_id, quantity, tx=tx)
+                    if item_id == 'lottery_ticket':
+                        await db.add_lottery_tickets(interaction.guild.id, interaction.user.id, quantity, tx=tx)
+
+        if not has_enough_coins:
             # Nếu không đủ tiền, chỉ cập nhật lại view và thông báo lỗi qua followup
             self.user_coins = current_user_data['coins']
             await self.update_components()
@@ -297,30 +316,18 @@ class ShopView(discord.ui.View):
             await interaction.edit_original_response(embed=embed, view=self)
             return await interaction.followup.send("Bạn không đủ coin để thực hiện giao dịch này.", ephemeral=True)
 
-        # Bước 3: Thực hiện giao dịch
-        await db.update_coins(interaction.user.id, interaction.guild.id, -total_cost)
-        await self.cog.update_shop_achievements(interaction, total_cost)
-
-        item_id = item_to_buy.get('id')
+        # Bước 3: Nhiệm vụ/thành tựu được ghi ở nền, không làm chậm phản hồi
+        self.cog.record_shop_purchase(interaction.user.id, interaction.guild.id, total_cost, interaction.channel)
 
         # Bước 4: Tạo tin nhắn thông báo thành công
         success_message = ""
         if item_id == 'perm_damage_upgrade':
-            await db.update_perm_damage_bonus(interaction.user.id, interaction.guild.id, 0.05)
             success_message = f"✅ Bạn đã mua **{item_to_buy['name']}**! Sát thương vĩnh viễn lên Boss tăng 5%."
         elif 'role_id' in item_to_buy:
             role = interaction.guild.get_role(item_to_buy['role_id'])
             await interaction.user.add_roles(role, reason="Mua từ shop")
-            duration_seconds = item_to_buy['duration_seconds']
-            if duration_seconds > 0:
-                expiry = datetime.datetime.now(
-                    datetime.timezone.utc) + datetime.timedelta(seconds=duration_seconds)
-                await db.add_temporary_role(interaction.user.id, interaction.guild.id, role.id, expiry.isoformat())
             success_message = f"✅ Bạn đã mua thành công role **{role.mention}**!"
         else:
-            await db.add_item_to_inventory(interaction.user.id, interaction.guild.id, item_id, quantity)
-            if item_id == 'lottery_ticket':
-                await db.add_lottery_tickets(interaction.guild.id, interaction.user.id, quantity)
             success_message = f"✅ Bạn đã mua thành công **x{quantity} {item_to_buy['name']}**!"
 
         # Bước 5: Cập nhật giao diện với thông báo tạm thời
@@ -361,28 +368,15 @@ class Economy(commands.Cog):
     async def cog_check(self, ctx: commands.Context):
         if ctx.command.name == 'balance':
             return True
-        config = await db.get_or_create_config(ctx.guild.id)
-        if debtor_role_id := config.get('debtor_role_id'):
-            if debtor_role := ctx.guild.get_role(debtor_role_id):
-                if debtor_role in ctx.author.roles:
-                    await ctx.send("Bạn đang trong tình trạng vỡ nợ và không thể sử dụng lệnh này! Dùng `/trano` để trả nợ.", ephemeral=True, delete_after=10)
-                    return False
+        if (await reward_roles.get(ctx.guild.id)).is_debtor(ctx.author):
+            await ctx.send("Bạn đang trong tình trạng vỡ nợ và không thể sử dụng lệnh này! Dùng `/trano` để trả nợ.", ephemeral=True, delete_after=10)
+            return False
         return True
 
-    async def update_shop_achievements(self, source: Union[commands.Context, discord.Interaction], price: int):
-        user = source.author if isinstance(
-            source, commands.Context) else source.user
-        guild = source.guild
-        await db.update_quest_progress(user.id, guild.id, 'SHOP_BUY')
-        await db.update_quest_progress(user.id, guild.id, 'COIN_SPEND', value_to_add=price)
-        unlocked_buy = await db.update_achievement_progress(user.id, guild.id, 'SHOP_BUY')
-        if unlocked_buy:
-            for ach in unlocked_buy:
-                await source.channel.send(f"🏆 {user.mention} vừa mở khóa thành tựu mới: **{ach['name']}**! (+{ach['reward_coin']:,} coin, +{ach['reward_xp']} XP)", delete_after=30)
-        unlocked_spend = await db.update_achievement_progress(user.id, guild.id, 'COIN_SPEND', value_to_add=price)
-        if unlocked_spend:
-            for ach in unlocked_spend:
-                await source.channel.send(f"🏆 {user.mention} vừa mở khóa thành tựu mới: **{ach['name']}**! (+{ach['reward_coin']:,} coin, +{ach['reward_xp']} XP)", delete_after=30)
+    def record_shop_purchase(self, user_id: int, guild_id: int, price: int, channel):
+        """Đưa hoạt động mua sắm vào hàng đợi nhiệm vụ/thành tựu, gọi sau khi giao dịch mua đã commit."""
+        activity.emit(user_id, guild_id, 'SHOP_BUY', channel=channel)
+        activity.emit(user_id, guild_id, 'COIN_SPEND', price, channel=channel)
 
     async def create_inventory_embed(self, member: discord.Member) -> discord.Embed:
         inv_items = await db.get_user_inventory(member.id, member.guild.id)
@@ -437,7 +431,6 @@ class Economy(commands.Cog):
     @commands.hybrid_command(name="buy", description="Mua nhanh một vật phẩm hoặc role từ shop.")
     @app_commands.rename(item_or_role_name="tên_vật_phẩm_hoặc_role")
     async def buy(self, ctx: commands.Context, *, item_or_role_name: str):
-        user_data = await db.get_or_create_user(ctx.author.id, ctx.guild.id)
         item_to_buy, price, is_role, item_id, item_or_role_obj = None, 0, False, None, None
 
         try:
@@ -466,27 +459,37 @@ class Economy(commands.Cog):
             if not item_to_buy:
                 return await ctx.send(f"Không tìm thấy vật phẩm hoặc role có tên `{item_name_str}`.", delete_after=10, ephemeral=True)
 
-        if user_data['coins'] < price:
+        expiry = None
+        if is_role and item_to_buy['duration_seconds'] > 0:
+            expiry = datetime.datetime.now(
+                datetime.timezone.utc) + datetime.timedelta(seconds=item_to_buy['duration_seconds'])
+
+        async with db.transaction() as tx:
+            # Đọc lại số dư trong giao dịch để không bị trừ tiền hai lần khi mua dồn dập
+            user_data = await db.get_or_create_user(ctx.author.id, ctx.guild.id, tx=tx)
+            has_enough_coins = user_data['coins'] >= price
+            if has_enough_coins:
+                await db.update_coins(ctx.author.id, ctx.guild.id, -price, tx=tx)
+                if is_role:
+                    if expiry:
+                        await db.add_temporary_role(ctx.author.id, ctx.guild.id, item_or_role_obj.id, expiry.isoformat(), tx=tx)
+                else:
+                    await db.add_item_to_inventory(ctx.author.id, ctx.guild.id, item_id, 1, tx=tx)
+                    if item_id == 'lottery_ticket':
+                        await db.add_lottery_tickets(ctx.guild.id, ctx.author.id, 1, tx=tx)
+
+        if not has_enough_coins:
             return await ctx.send(f"Bạn không đủ **{price:,}** coin để mua.", delete_after=10, ephemeral=True)
 
-        await db.update_coins(ctx.author.id, ctx.guild.id, -price)
-        await self.update_shop_achievements(ctx, price)
+        self.record_shop_purchase(ctx.author.id, ctx.guild.id, price, ctx.channel)
 
         if is_role:
             await ctx.author.add_roles(item_or_role_obj, reason="Mua từ shop")
-            duration_seconds = item_to_buy['duration_seconds']
-            if duration_seconds > 0:
-                expiry = datetime.datetime.now(
-                    datetime.timezone.utc) + datetime.timedelta(seconds=duration_seconds)
-                await db.add_temporary_role(ctx.author.id, ctx.guild.id, item_or_role_obj.id, expiry.isoformat())
-            await ctx.send(f"🛍️ {ctx.author.mention} đã mua thành công role {item_or_role_obj.mention} (Thời hạn: **{format_duration(duration_seconds)}**).")
+            await ctx.send(f"🛍️ {ctx.author.mention} đã mua thành công role {item_or_role_obj.mention} (Thời hạn: **{format_duration(item_to_buy['duration_seconds'])}**).")
+        elif item_id == 'lottery_ticket':
+            await ctx.send(f"✅ Bạn đã mua thành công 1 vé xổ số!")
         else:
-            await db.add_item_to_inventory(ctx.author.id, ctx.guild.id, item_id, 1)
-            if item_id == 'lottery_ticket':
-                await db.add_lottery_tickets(ctx.guild.id, ctx.author.id, 1)
-                await ctx.send(f"✅ Bạn đã mua thành công 1 vé xổ số!")
-            else:
-                await ctx.send(f"🛍️ Bạn đã mua **{item_to_buy['name']}** và cất vào kho đồ (`/inventory`).")
+            await ctx.send(f"🛍️ Bạn đã mua **{item_to_buy['name']}** và cất vào kho đồ (`/inventory`).")
 
     @commands.hybrid_group(name="shopadmin", description="Các lệnh quản lý cửa hàng (Admin).", hidden=True)
     async def shopadmin(self, ctx: commands.Context):
@@ -532,7 +535,7 @@ class Economy(commands.Cog):
         embed.set_thumbnail(url=target_member.display_avatar.url)
         await ctx.send(embed=embed)
         if target_member == ctx.author:
-            await db.update_quest_progress(ctx.author.id, ctx.guild.id, 'CHECK_BALANCE')
+            activity.emit(ctx.author.id, ctx.guild.id, 'CHECK_BALANCE', channel=ctx.channel)
 
     @commands.hybrid_command(name="daily", description="Nhận thưởng coin hàng ngày của bạn.")
     async def daily(self, ctx: commands.Context):
@@ -547,21 +550,15 @@ class Economy(commands.Cog):
                 h, rem = divmod(int(remaining.total_seconds()), 3600)
                 m, _ = divmod(rem, 60)
                 return await ctx.send(f"❌ Bạn đã nhận thưởng rồi, quay lại sau **{h} giờ {m} phút**.", delete_after=10, ephemeral=True)
-        config, author_roles = await db.get_or_create_config(ctx.guild.id), ctx.author.roles
-        luck_role, vip_role = ctx.guild.get_role(config.get(
-            'luck_role_id', 0)), ctx.guild.get_role(config.get('vip_role_id', 0))
-        min_r, max_r, footer_text = (
-            500, 1500, "Hãy quay lại vào ngày mai nhé!")
-        if luck_role and luck_role in author_roles:
-            min_r, max_r, footer_text = (
-                700, 1800, "Thiên Mệnh hộ thể, vận may gia tăng!")
-        elif vip_role and vip_role in author_roles:
-            min_r, max_r, footer_text = (
-                600, 1600, "Đặc quyền VIP, nhận thêm tài lộc!")
-        amount = random.randint(min_r, max_r)
+        profile = (await reward_roles.get(ctx.guild.id)).profile_for(ctx.author)
+        footer_text = {
+            'luck': "Thiên Mệnh hộ thể, vận may gia tăng!",
+            'vip': "Đặc quyền VIP, nhận thêm tài lộc!",
+        }.get(profile.tier, "Hãy quay lại vào ngày mai nhé!")
+        amount = random.randint(*profile.daily_range)
         await db.update_coins(ctx.author.id, ctx.guild.id, amount)
         await db.update_daily_timestamp(ctx.author.id, ctx.guild.id, datetime.datetime.now(datetime.timezone.utc).isoformat())
-        await db.update_quest_progress(ctx.author.id, ctx.guild.id, 'DAILY_COMMAND')
+        activity.emit(ctx.author.id, ctx.guild.id, 'DAILY_COMMAND', channel=ctx.channel)
         embed = discord.Embed(title="🎁 Quà Điểm Danh Hàng Ngày 🎁",
                               description=f"Chúc mừng {ctx.author.mention}, bạn nhận được **{amount:,}** coin!", color=discord.Color.gold())
         embed.set_footer(text=footer_text)
@@ -574,12 +571,17 @@ class Economy(commands.Cog):
             return await ctx.send("Số tiền phải lớn hơn 0.", delete_after=10, ephemeral=True)
         if member == ctx.author or member.bot:
             return await ctx.send("Không thể tự chuyển cho mình hoặc bot.", delete_after=10, ephemeral=True)
-        author_data = await db.get_or_create_user(ctx.author.id, ctx.guild.id)
-        if author_data['coins'] < amount:
+        async with db.transaction() as tx:
+            author_data = await db.get_or_create_user(ctx.author.id, ctx.guild.id, tx=tx)
+            has_enough_coins = author_data['coins'] >= amount
+            if has_enough_coins:
+                # Người nhận có thể chưa có hồ sơ: tạo trước để khoản cộng không bị rơi mất
+                await db.get_or_create_user(member.id, ctx.guild.id, tx=tx)
+                await db.update_coins(ctx.author.id, ctx.guild.id, -amount, tx=tx)
+                await db.update_coins(member.id, ctx.guild.id, amount, tx=tx)
+        if not has_enough_coins:
             return await ctx.send(f"Không đủ **{amount:,}** coin.", delete_after=10, ephemeral=True)
-        await db.update_coins(ctx.author.id, ctx.guild.id, -amount)
-        await db.update_coins(member.id, ctx.guild.id, amount)
-        await db.update_quest_progress(ctx.author.id, ctx.guild.id, 'GIVE_COIN', value_to_add=amount)
+        activity.emit(ctx.author.id, ctx.guild.id, 'GIVE_COIN', amount, channel=ctx.channel)
         embed = discord.Embed(
             title="💸 Giao Dịch Chuyển Tiền Thành Công 💸",
             description=f"**{ctx.author.mention}** đã chuyển **{amount:,} coin** cho **{member.mention}**.",
@@ -628,9 +630,10 @@ class Economy(commands.Cog):
             return await ctx.send(f"⚠️ Người thắng cuộc (ID: `{winner_id}`) không còn tồn tại! Giải thưởng **{pot:,}** coin sẽ được bảo toàn.", ephemeral=True)
 
         # Cập nhật tiền và dọn dẹp database
-        await db.update_coins(winner_id, ctx.guild.id, pot)
-        await db.clear_lottery(ctx.guild.id)
-        await db.remove_item_from_all_inventories(ctx.guild.id, 'lottery_ticket')
+        async with db.transaction() as tx:
+            await db.update_coins(winner_id, ctx.guild.id, pot, tx=tx)
+            await db.clear_lottery(ctx.guild.id, tx=tx)
+            await db.remove_item_from_all_inventories(ctx.guild.id, 'lottery_ticket', tx=tx)
 
         # --- PHẦN NÂNG CẤP THÔNG BÁO MỚI ---
 
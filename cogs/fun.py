@@ -5,6 +5,8 @@ import random
 import asyncio
 import database as db
 from .utils import checks
+from .utils.activity import activity
+from .utils.reward_roles import reward_roles
 import math
 from discord import app_commands
 
@@ -376,7 +378,7 @@ class CoinflipGameView(discord.ui.View):
                 name=f"🎉 Phe {result} thắng! 🎉", value=f"{', '.join(w.mention for w in winners)} nhận **{winnings:,}** coin mỗi người.")
             for winner in winners:
                 await db.update_coins(winner.id, interaction.guild.id, winnings)
-                await db.update_quest_progress(winner.id, interaction.guild.id, 'FLIP_WIN')
+                activity.emit(winner.id, interaction.guild.id, 'FLIP_WIN', channel=interaction.channel, achievements=False)
 
         new_lobby_view = CreateNewLobbyView(
             self.cog, self.original_ctx, 'flip', self.bet_amount)
@@ -860,8 +862,7 @@ class Fun(commands.Cog):
     def __init__(self, bot): self.bot = bot
 
     async def cog_check(self, ctx: commands.Context):
-        config = await db.get_or_create_config(ctx.guild.id)
-        if (debtor_role_id := config.get('debtor_role_id')) and (debtor_role := ctx.guild.get_role(debtor_role_id)) and debtor_role in ctx.author.roles:
+        if (await reward_roles.get(ctx.guild.id)).is_debtor(ctx.author):
             await ctx.send("Bạn đang trong tình trạng vỡ nợ!", ephemeral=True, delete_after=10)
             return False
         return True
@@ -973,7 +974,7 @@ class Fun(commands.Cog):
                     await db.update_coins(winner.id, ctx.guild.id, bet_amount)
                     await db.update_coins(loser.id, ctx.guild.id, -bet_amount)
                     embed.description += f"\n**{winner.mention}** thắng **{bet_amount:,}** coin!"
-                await db.update_quest_progress(winner.id, ctx.guild.id, 'RPS_WIN')
+                activity.emit(winner.id, ctx.guild.id, 'RPS_WIN', channel=ctx.channel, achievements=False)
 
             # =============================================================
             # <<< PHẦN CẬP NHẬT CHÍNH NẰM Ở ĐÂY >>>
@@ -1,29 +1,63 @@
 # cogs/level_system.py
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
+import asyncio
 import random
 import datetime
 import database as db
-import math
-from .utils import checks
+import time
+from .utils import checks, xp_curve
+from .utils.activity import activity
+from .utils.announcer import announcer
+from .utils.chat_cooldown import ChatCooldown
+from .utils.reward_roles import reward_roles
 from discord import app_commands
 
 
+LEADERBOARD_PAGE_TTL_SECONDS = 30  # Thời gian giữ embed của một trang bảng xếp hạng đã dựng
+
+
 class LeaderboardView(discord.ui.View):
-    def __init__(self, author, guild, full_data, per_page=10):
+    # Embed đã dựng, dùng chung giữa mọi người xem: (guild_id, số trang, khóa bắt đầu) -> (hết hạn lúc, embed, khóa trang sau)
+    _page_cache = {}
+
+    def __init__(self, author, guild, per_page=10):
         super().__init__(timeout=180.0)
         self.author = author
         self.guild = guild
-        self.full_data = full_data
         self.per_page = per_page
         self.current_page = 0
-        self.max_pages = math.ceil(len(self.full_data) / self.per_page)
+        # Khóa keyset bắt đầu của từng trang đã mở; trang đầu bắt đầu từ None
+        self.page_starts = [None]
+
+    async def load_page(self) -> discord.Embed | None:
+        """Lấy (hoặc dựng) embed của trang hiện tại và cập nhật nút bấm. None nếu trang trống."""
+        after = self.page_starts[self.current_page]
+        cache_key = (self.guild.id, self.current_page, after)
+        now = time.monotonic()
+        cached = self._page_cache.get(cache_key)
+        if cached and cached[0] > now:
+            _, embed, next_start = cached
+        else:
+            embed, next_start = await self.build_page(after)
+            if embed is None:
+                return None
+            for key in [k for k, v in self._page_cache.items() if v[0] <= now]:
+                del self._page_cache[key]
+            self._page_cache[cache_key] = (now + LEADERBOARD_PAGE_TTL_SECONDS, embed, next_start)
+
+        del self.page_starts[self.current_page + 1:]
+        if next_start is not None:
+            self.page_starts.append(next_start)
         self.update_buttons()
+        return embed
 
-    def create_embed(self) -> discord.Embed:
-        start_index = self.current_page * self.per_page
-        end_index = start_index + self.per_page
-        page_data = self.full_data[start_index:end_index]
+    async def build_page(self, after):
+        # Người đã rời server bị bỏ qua ngay khi lấy trang, nên trang nào cũng đủ số dòng
+        page_data, next_start = await db.get_leaderboard_page(
+            self.guild.id, after, self.per_page, keep=lambda user_id: self.guild.get_member(user_id) is not None)
+        if not page_data:
+            return None, None
 
         embed = discord.Embed(
             title=f"🏆 Bảng Xếp Hạng tại {self.guild.name}", color=discord.Color.gold())
@@ -32,37 +66,37 @@ class LeaderboardView(discord.ui.View):
 
         lines = []
         medals = ['🥇', '🥈', '🥉']
+        start_index = self.current_page * self.per_page
         for i, user_data in enumerate(page_data):
             rank = start_index + i + 1
             member = self.guild.get_member(user_data['user_id'])
-            if member:
-                medal = medals[rank -
-                               1] if rank <= 3 and self.current_page == 0 else f"**`{rank}.`**"
-                top_role = f"| {member.top_role.mention}" if member.top_role.name != "@everyone" else ""
-                line1 = f"{medal} {member.mention} {top_role}"
+            if not member:
+                continue
+            medal = medals[rank - 1] if rank <= 3 else f"**`{rank}.`**"
+            top_role = f"| {member.top_role.mention}" if member.top_role.name != "@everyone" else ""
+            line1 = f"{medal} {member.mention} {top_role}"
 
-                xp, level, coins = user_data['xp'], user_data['level'], user_data['coins']
-                xp_needed = 5 * (level ** 2) + 50 * level + 100
+            xp, level, coins = user_data['xp'], user_data['level'], user_data['coins']
+            xp_needed = xp_curve.xp_needed(level)
 
-                fill_char = '🟩'
-                empty_char = '⬛'
-                bar_length = 5
+            fill_char = '🟩'
+            empty_char = '⬛'
+            bar_length = 5
 
-                percent = (xp / xp_needed) if xp_needed > 0 else 0
-                progress = int(percent * bar_length)
-                progress_bar = f"`{fill_char * progress}{empty_char * (bar_length - progress)}`"
+            percent = (xp / xp_needed) if xp_needed > 0 else 0
+            progress = int(percent * bar_length)
+            progress_bar = f"`{fill_char * progress}{empty_char * (bar_length - progress)}`"
 
-                line2 = f"> **Level {level}** • {progress_bar} ({int(xp):,}/{int(xp_needed):,} XP) • **{coins:,}** 💰"
-                lines.append(f"{line1}\n{line2}")
+            line2 = f"> **Level {level}** • {progress_bar} ({int(xp):,}/{int(xp_needed):,} XP) • **{coins:,}** 💰"
+            lines.append(f"{line1}\n{line2}")
 
         embed.description = "\n\n".join(lines)
-        embed.set_footer(
-            text=f"Trang {self.current_page + 1}/{self.max_pages}")
-        return embed
+        embed.set_footer(text=f"Trang {self.current_page + 1}")
+        return embed, next_start
 
     def update_buttons(self):
         self.children[0].disabled = self.current_page == 0
-        self.children[1].disabled = self.current_page >= self.max_pages - 1
+        self.children[1].disabled = len(self.page_starts) <= self.current_page + 1
 
     async def interaction_check(self, interaction: discord.Interaction) -> bool:
         if interaction.user.id != self.author.id:
@@ -73,14 +107,12 @@ class LeaderboardView(discord.ui.View):
     @discord.ui.button(label="⬅️ Trước", style=discord.ButtonStyle.secondary)
     async def previous_button(self, interaction: discord.Interaction, button: discord.ui.Button):
         self.current_page -= 1
-        self.update_buttons()
-        await interaction.response.edit_message(embed=self.create_embed(), view=self)
+        await interaction.response.edit_message(embed=await self.load_page(), view=self)
 
     @discord.ui.button(label="Sau ➡️", style=discord.ButtonStyle.secondary)
     async def next_button(self, interaction: discord.Interaction, button: discord.ui.Button):
         self.current_page += 1
-        self.update_buttons()
-        await interaction.response.edit_message(embed=self.create_embed(), view=self)
+        await interaction.response.edit_message(embed=await self.load_page(), view=self)
 
 
 class LevelSystem(commands.Cog):
@@ -90,20 +122,42 @@ class LevelSystem(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.xp_multiplier = 1
+        # Kênh của tin nhắn vừa làm lên cấp, dùng khi server chưa đặt kênh thông báo
+        self.level_up_channels = {}
+        self.chat_cooldown = ChatCooldown()
+        db.add_level_up_listener(self.on_level_up)
+        activity.add_unlock_listener(self.on_achievements_unlocked)
+        self.flush_chat_rewards.start()
+
+    async def cog_unload(self):
+        db.remove_level_up_listener(self.on_level_up)
+        activity.remove_unlock_listener(self.on_achievements_unlocked)
+        self.flush_chat_rewards.cancel()
+        # Ghi nốt phần XP/coin còn trong bộ đệm trước khi cog bị gỡ
+        await db.flush_chat_rewards()
+
+    @tasks.loop(seconds=db.CHAT_FLUSH_INTERVAL_SECONDS)
+    async def flush_chat_rewards(self):
+        try:
+            await db.flush_chat_rewards()
+            self.chat_cooldown.prune()
+        except Exception as e:
+            print(f"[CRITICAL TASK ERROR] Lỗi khi ghi bộ đệm XP/coin chat: {e}")
 
-    # cogs/level_system.py
+    @flush_chat_rewards.before_loop
+    async def before_flush_chat_rewards(self):
+        await self.bot.wait_until_ready()
+
+    async def on_achievements_unlocked(self, user_id: int, guild_id: int, channel, unlocked: list):
+        # Unlock listener của hàng đợi hoạt động: thông báo thành tựu mở khóa từ mọi cog
+        guild = self.bot.get_guild(guild_id)
+        if guild and (member := guild.get_member(user_id)):
+            await self.check_and_notify_achievements(channel, member, unlocked)
 
     async def check_and_notify_achievements(self, channel: discord.TextChannel, member: discord.Member, unlocked_list: list):
         if not unlocked_list:
             return
 
-        # Lấy kênh thông báo của server
-        config = await db.get_or_create_config(member.guild.id)
-        announcement_channel_id = config.get('announcement_channel_id')
-        # Mặc định gửi ở kênh gốc nếu kênh thông báo chưa được set
-        target_channel = self.bot.get_channel(
-            announcement_channel_id) or channel
-
         for ach in unlocked_list:
             embed = discord.Embed(
                 title="🏆 MỞ KHÓA THÀNH TỰU MỚI! 🏆",
@@ -133,30 +187,15 @@ class LevelSystem(commands.Cog):
             embed.set_footer(
                 text="Hãy tiếp tục phấn đấu cho những thành tựu cao hơn!")
 
-            try:
-                await target_channel.send(embed=embed)
-            except discord.Forbidden:
-                # Nếu bot không có quyền gửi ở kênh thông báo, thử gửi ở kênh gốc
-                if target_channel != channel:
-                    try:
-                        await channel.send(embed=embed)
-                    except discord.Forbidden:
-                        pass  # Bỏ qua nếu cũng không có quyền ở kênh gốc
+            # Gửi ở kênh thông báo (mặc định là kênh gốc nếu chưa set), gom chung với các thông báo khác
+            await announcer.announce(member.guild, embed=embed, origin=channel)
 
     async def update_level_role(self, member: discord.Member, new_level: int):
         if not member or not member.guild or member.bot:
             return
 
-        server_level_roles = await db.get_level_roles(member.guild.id)
-        if not server_level_roles:
-            return
-
-        target_role_id = None
-        for level_milestone, role_id in sorted(server_level_roles.items(), key=lambda item: item[0], reverse=True):
-            if new_level >= level_milestone:
-                target_role_id = role_id
-                break
-
+        guild_roles = await reward_roles.get(member.guild.id)
+        target_role_id = guild_roles.level_role_for(new_level)
         if not target_role_id:
             return
 
@@ -164,8 +203,7 @@ class LevelSystem(commands.Cog):
         if not target_role:
             return
 
-        roles_to_remove = [r for r in member.roles if r.id in server_level_roles.values(
-        ) and r.id != target_role_id]
+        roles_to_remove = [r for r in member.roles if r.id in guild_roles.level_role_ids and r.id != target_role_id]
 
         try:
             if roles_to_remove:
@@ -175,10 +213,8 @@ class LevelSystem(commands.Cog):
                 embed = discord.Embed(title="✨ Đột Phá Cảnh Giới! ✨", description=f"Chúc mừng {member.mention} đã đạt đến cảnh giới mới và nhận được thân phận **{target_role.name}**!",
                                       color=target_role.color or discord.Color.random(), timestamp=datetime.datetime.now(datetime.timezone.utc))
                 embed.set_thumbnail(url=member.display_avatar.url)
-
-                config = await db.get_or_create_config(member.guild.id)
-                if (channel_id := config.get('announcement_channel_id')) and (channel := self.bot.get_channel(channel_id)):
-                    await channel.send(embed=embed)
+                # Chỉ thông báo khi server đã đặt kênh thông báo
+                await announcer.announce(member.guild, embed=embed)
         except discord.Forbidden:
             print(
                 f"Bot không có quyền quản lý role trên server {member.guild.name}.")
@@ -194,19 +230,20 @@ class LevelSystem(commands.Cog):
         if message.channel.id == config.get('command_channel_id'):
             return
 
+        # Mọi tin nhắn đều tính cho nhiệm vụ/thành tựu CHAT; hàng đợi hoạt động cộng dồn và ghi theo lô
+        activity.emit(message.author.id, message.guild.id, 'CHAT', channel=message.channel)
+
+        # Giới hạn nhận thưởng được kiểm tra trong bộ nhớ, trước mọi truy cập DB
+        if not self.chat_cooldown.try_acquire(message.guild.id, message.author.id,
+                                              config['chat_xp_bucket_capacity'], config['chat_xp_refill_seconds']):
+            return
+
         user_data = await db.get_or_create_user(message.author.id, message.guild.id)
 
-        luck_role_id = config.get('luck_role_id')
-        vip_role_id = config.get('vip_role_id')
-        author_roles = message.author.roles
-        xp_multiplier = 1.0
-        coin_range = (1, 5)
-        has_bonus_chance = False
-
-        if luck_role_id and message.guild.get_role(luck_role_id) in author_roles:
-            xp_multiplier, coin_range, has_bonus_chance = 1.25, (3, 8), True
-        elif vip_role_id and message.guild.get_role(vip_role_id) in author_roles:
-            xp_multiplier, coin_range = 1.10, (2, 6)
+        profile = (await reward_roles.get(message.guild.id)).profile_for(message.author)
+        xp_multiplier = profile.xp_multiplier
+        coin_range = profile.chat_coin_range
+        has_bonus_chance = profile.has_bonus_chance
         if await db.get_user_active_effect(message.author.id, message.guild.id, 'xp_booster'):
             xp_multiplier *= 1.5  # Nhân thêm 50% (1.5 lần)
         coin_multiplier = 1.0
@@ -224,32 +261,50 @@ class LevelSystem(commands.Cog):
             coins_to_add += bonus_coin
             await message.channel.send(f"✨ Vận may mỉm cười! {message.author.mention} nhận thêm **{bonus_xp:.2f} XP** và **{bonus_coin} coin**!", delete_after=10)
 
-        await db.update_user_xp(message.author.id, message.guild.id, xp_to_add)
-        await db.update_coins(message.author.id, message.guild.id, int(coins_to_add))
-
-        await db.update_quest_progress(message.author.id, message.guild.id, 'CHAT')
-        unlocked_chat = await db.update_achievement_progress(message.author.id, message.guild.id, 'CHAT')
-        await self.check_and_notify_achievements(message.channel, message.author, unlocked_chat)
+        # user_data đã bao gồm phần XP còn nằm trong bộ đệm. Tin nhắn làm lên cấp thì ghi XP ngay
+        # (update_user_xp gộp luôn phần đang chờ và xử lý lên cấp trong một lần ghi), còn lại thì chỉ cộng dồn
+        if xp_curve.resolve_level(user_data['level'], user_data['xp'] + xp_to_add)[0] > user_data['level']:
+            self.level_up_channels[(message.guild.id, message.author.id)] = message.channel
+            await db.update_user_xp(message.author.id, message.guild.id, xp_to_add)
+            xp_to_add = 0
 
-        current_xp = user_data['xp'] + xp_to_add
-        xp_needed = 5 * (user_data['level'] ** 2) + \
-            50 * user_data['level'] + 100
+        # XP/coin được cộng dồn trong bộ đệm và ghi theo lô, không commit riêng cho từng tin nhắn
+        if db.buffer_chat_reward(message.author.id, message.guild.id, xp_to_add, int(coins_to_add)):
+            await db.flush_chat_rewards()
 
-        if current_xp >= xp_needed:
-            new_level = user_data['level'] + 1
-            await db.update_user_level(message.author.id, message.guild.id, new_level)
-            level_up_coin = new_level * 100
-            await db.update_coins(message.author.id, message.guild.id, level_up_coin)
-
-            channel_to_send = self.bot.get_channel(config.get(
-                'announcement_channel_id')) or message.channel
-            await channel_to_send.send(f"🎉 Chúc mừng {message.author.mention} đã đạt **Level {new_level}** và nhận được **{level_up_coin}** coin!")
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        # Role thưởng/phạt hoặc role-level có thể vừa bị xóa: dựng lại chỉ mục role của server ở lần dùng sau
+        reward_roles.invalidate(role.guild.id)
 
-            unlocked_level = await db.update_achievement_progress(
-                message.author.id, message.guild.id, 'REACH_LEVEL', value_to_add=new_level)
-            await self.check_and_notify_achievements(channel_to_send, message.author, unlocked_level)
+    def on_level_up(self, user_id: int, guild_id: int, old_level: int, new_level: int):
+        # Listener của database: được gọi đồng bộ sau khi commit, phần việc với Discord chạy trong task riêng
+        asyncio.create_task(self.handle_level_up(user_id, guild_id, old_level, new_level))
 
-            await self.update_level_role(message.author, new_level)
+    async def handle_level_up(self, user_id: int, guild_id: int, old_level: int, new_level: int):
+        """Thưởng coin, thông báo, thành tựu và role cho mọi nguồn XP (chat, boss, thành tựu...)."""
+        origin_channel = self.level_up_channels.pop((guild_id, user_id), None)
+        try:
+            # Nhảy nhiều cấp thì nhận đủ thưởng của từng cấp
+            level_up_coin = sum(level * 100 for level in range(old_level + 1, new_level + 1))
+            async with db.transaction() as tx:
+                await db.update_coins(user_id, guild_id, level_up_coin, tx=tx)
+                unlocked_level = await db.update_achievement_progress(
+                    user_id, guild_id, 'REACH_LEVEL', value_to_add=new_level, tx=tx)
+
+            guild = self.bot.get_guild(guild_id)
+            member = guild.get_member(user_id) if guild else None
+            if not member:
+                return
+
+            # Lời chúc, thành tựu và role mới được gom chung vào một tin nhắn ở kênh thông báo
+            await announcer.announce(guild, content=f"🎉 Chúc mừng {member.mention} đã đạt **Level {new_level}** và nhận được **{level_up_coin}** coin!",
+                                     origin=origin_channel)
+            await self.check_and_notify_achievements(origin_channel, member, unlocked_level)
+
+            await self.update_level_role(member, new_level)
+        except Exception as e:
+            print(f"Lỗi khi xử lý lên cấp cho user {user_id} tại server {guild_id}: {e}")
 
     @commands.hybrid_command(name='level', description="Kiểm tra level và XP của bạn hoặc người khác.")
     @app_commands.rename(member="thành_viên")
@@ -259,7 +314,7 @@ class LevelSystem(commands.Cog):
 
         level = user_data['level']
         xp = user_data['xp']
-        xp_needed = 5 * (level**2) + 50 * level + 100
+        xp_needed = xp_curve.xp_needed(level)
 
         fill, empty, bar_len = '🟩', '⬛', 10
         percent = (xp / xp_needed * 100) if xp_needed > 0 else 100
@@ -279,13 +334,10 @@ class LevelSystem(commands.Cog):
 
     @commands.hybrid_command(name='leaderboard', aliases=['lb', 'top'], description="Xem bảng xếp hạng level của server.")
     async def leaderboard(self, ctx: commands.Context):
-        full_lb_data = await db.get_leaderboard(ctx.guild.id, limit=100)
-        if not full_lb_data:
+        view = LeaderboardView(ctx.author, ctx.guild, per_page=10)
+        initial_embed = await view.load_page()
+        if not initial_embed:
             return await ctx.send("Chưa có ai trên bảng xếp hạng!", ephemeral=True)
-
-        view = LeaderboardView(ctx.author, ctx.guild,
-                               full_lb_data, per_page=10)
-        initial_embed = view.create_embed()
         await ctx.send(embed=initial_embed, view=view)
 
     @commands.hybrid_group(name="leveladmin", description="Các lệnh quản lý hệ thống level (Admin).", hidden=True)
@@ -302,6 +354,7 @@ class LevelSystem(commands.Cog):
             return await ctx.send(f"Bot không thể quản lý role `{role.name}` vì role của bot thấp hơn.", delete_after=15, ephemeral=True)
 
         await db.add_level_role(ctx.guild.id, level, role.id)
+        reward_roles.invalidate(ctx.guild.id)
         await ctx.send(embed=discord.Embed(description=f"✅ Đã đặt: Đạt **Level {level}** nhận role {role.mention}.", color=discord.Color.green()), delete_after=15)
 
     @leveladmin.command(name='removerole', description="Xóa một role thưởng khỏi mốc level.")
@@ -309,6 +362,7 @@ class LevelSystem(commands.Cog):
     @app_commands.rename(level="cấp_độ")
     async def removelevelrole(self, ctx: commands.Context, level: int):
         if await db.remove_level_role(ctx.guild.id, level) > 0:
+            reward_roles.invalidate(ctx.guild.id)
             await ctx.send(embed=discord.Embed(description=f"✅ Đã xóa cấu hình role cho **Level {level}**.", color=discord.Color.green()), delete_after=15)
         else:
             await ctx.send(embed=discord.Embed(description=f"ℹ️ Không có cấu hình role nào cho **Level {level}**.", color=discord.Color.yellow()), delete_after=15)
@@ -338,6 +392,27 @@ class LevelSystem(commands.Cog):
         self.xp_multiplier = max(1, multiplier)
         await ctx.send(f"✅ Đã đặt hệ số nhân XP và Coin khi chat thành **x{self.xp_multiplier}**!", delete_after=10)
 
+    @leveladmin.command(name='setchatburst', description="Đặt số tin nhắn liên tiếp được nhận XP & Coin trước khi phải chờ (Admin).")
+    @checks.is_administrator()
+    @app_commands.rename(messages="số_tin_nhắn")
+    async def setchatburst(self, ctx: commands.Context, messages: int):
+        messages = max(1, messages)
+        await db.update_config(ctx.guild.id, 'chat_xp_bucket_capacity', messages)
+        self.chat_cooldown.reset_guild(ctx.guild.id)
+        await ctx.send(f"✅ Mỗi thành viên được nhận thưởng liên tiếp tối đa **{messages}** tin nhắn.", delete_after=10)
+
+    @leveladmin.command(name='setchatcooldown', description="Đặt số giây để hồi một lượt nhận XP & Coin khi chat, 0 để tắt (Admin).")
+    @checks.is_administrator()
+    @app_commands.rename(seconds="số_giây")
+    async def setchatcooldown(self, ctx: commands.Context, seconds: int):
+        seconds = max(0, seconds)
+        await db.update_config(ctx.guild.id, 'chat_xp_refill_seconds', seconds)
+        self.chat_cooldown.reset_guild(ctx.guild.id)
+        if seconds == 0:
+            await ctx.send("✅ Đã tắt giới hạn: mọi tin nhắn đều được nhận XP và Coin.", delete_after=10)
+        else:
+            await ctx.send(f"✅ Mỗi **{seconds} giây** thành viên được hồi một lượt nhận XP và Coin khi chat.", delete_after=10)
+
 
 async def setup(bot):
     await bot.add_cog(LevelSystem(bot))
@@ -4,6 +4,8 @@ from discord.ext import commands
 import datetime
 import database as db
 from .utils import checks
+from .utils.activity import activity
+from .utils.reward_roles import reward_roles
 from discord import app_commands
 
 # Lấy ConfirmationView từ cogs/fun.py
@@ -31,13 +33,10 @@ class LoanSystem(commands.Cog):
 
     async def cog_check(self, ctx: commands.Context):
         """Kiểm tra chung cho tất cả các lệnh trong Cog này."""
-        config = await db.get_or_create_config(ctx.guild.id)
-        if debtor_role_id := config.get('debtor_role_id'):
-            if debtor_role := ctx.guild.get_role(debtor_role_id):
-                # Cho phép người nợ dùng lệnh trano
-                if debtor_role in ctx.author.roles and ctx.command.name != 'trano':
-                    await ctx.send("Bạn đang trong tình trạng vỡ nợ! Dùng `/trano` để trả nợ trước khi dùng các lệnh khác.", delete_after=10, ephemeral=True)
-                    return False
+        # Cho phép người nợ dùng lệnh trano
+        if ctx.command.name != 'trano' and (await reward_roles.get(ctx.guild.id)).is_debtor(ctx.author):
+            await ctx.send("Bạn đang trong tình trạng vỡ nợ! Dùng `/trano` để trả nợ trước khi dùng các lệnh khác.", delete_after=10, ephemeral=True)
+            return False
         return True
 
     @commands.hybrid_command(name="vay", description=f"Vay tiền từ ngân hàng (tối đa {LOAN_CONFIG['MAX_LOAN']:,} coin).")
@@ -71,17 +70,11 @@ class LoanSystem(commands.Cog):
         if view.confirmed:
             await msg.edit(content=f"✅ Giao dịch thành công! Bạn đã vay **{amount:,}** coin.", embed=None, view=None)
 
-            await db.update_coins(ctx.author.id, ctx.guild.id, amount)
-            await db.create_loan(ctx.author.id, ctx.guild.id,
-                                 repayment_amount, due_date.isoformat())
-
-            await db.update_quest_progress(ctx.author.id, ctx.guild.id, 'LOAN_TAKEN')
-
-            unlocked_loan = await db.update_achievement_progress(
-                ctx.author.id, ctx.guild.id, 'LOAN_TAKEN')
-            if unlocked_loan:
-                for ach in unlocked_loan:
-                    await ctx.channel.send(f"🏆 {ctx.author.mention} vừa mở khóa thành tựu mới: **{ach['name']}**! (+{ach['reward_coin']:,} coin, +{ach['reward_xp']} XP)", delete_after=30)
+            async with db.transaction() as tx:
+                await db.update_coins(ctx.author.id, ctx.guild.id, amount, tx=tx)
+                await db.create_loan(ctx.author.id, ctx.guild.id,
+                                     repayment_amount, due_date.isoformat(), tx=tx)
+            activity.emit(ctx.author.id, ctx.guild.id, 'LOAN_TAKEN', channel=ctx.channel)
 
         elif view.confirmed is False:
             await msg.edit(content="Đã hủy giao dịch vay.", embed=None, view=None, delete_after=10)
@@ -106,12 +99,8 @@ class LoanSystem(commands.Cog):
         await db.update_coins(ctx.author.id, ctx.guild.id, -repayment_amount)
         await db.delete_loan(ctx.author.id, ctx.guild.id)
 
-        # Cập nhật thành tựu tiêu tiền khi trả nợ
-        unlocked_spend = await db.update_achievement_progress(
-            ctx.author.id, ctx.guild.id, 'COIN_SPEND', value_to_add=repayment_amount)
-        if unlocked_spend:
-            for ach in unlocked_spend:
-                await ctx.channel.send(f"🏆 {ctx.author.mention} vừa mở khóa thành tựu mới: **{ach['name']}**! (+{ach['reward_coin']:,} coin, +{ach['reward_xp']} XP)", delete_after=30)
+        # Trả nợ cũng tính là tiêu tiền cho thành tựu, nhưng không tính cho nhiệm vụ ngày
+        activity.emit(ctx.author.id, ctx.guild.id, 'COIN_SPEND', repayment_amount, channel=ctx.channel, quests=False)
 
         config = await db.get_or_create_config(ctx.guild.id)
         if debtor_role_id := config.get('debtor_role_id'):
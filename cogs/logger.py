@@ -3,7 +3,18 @@ import discord
 from discord.ext import commands
 import datetime
 import database as db
-import asyncio
+import collections
+import os
+from discord import app_commands
+from .utils import checks
+from .utils.message_cache import CachedMessage, MessageCache, MAX_GUILD_CAPACITY
+from .utils.message_journal import MessageJournal
+from .utils.audit_log import audit_log
+from .utils.log_sink import log_sink
+
+# Nhật ký tin nhắn trên đĩa (tùy chọn) để log xóa/sửa vẫn có nội dung sau khi bot khởi động lại.
+# Mặc định tắt; đặt MESSAGE_JOURNAL_DB=message_journal.db trong .env để bật.
+MESSAGE_JOURNAL_DB = os.getenv('MESSAGE_JOURNAL_DB', '')
 
 
 class Logger(commands.Cog):
@@ -12,84 +23,119 @@ class Logger(commands.Cog):
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        # Dùng cache để tránh query database liên tục khi không cần
-        self.log_channel_cache = {}
-        # Cache tin nhắn để lấy nội dung khi bị xóa
-        self.message_cache = {}
+        # Cache tin nhắn (LRU theo từng server) để lấy nội dung khi bị xóa
+        self.message_cache = MessageCache()
+        self.journal = MessageJournal(MESSAGE_JOURNAL_DB) if MESSAGE_JOURNAL_DB else None
+        self.journal_hits = 0  # Tin bị xóa trượt cache nhưng tìm thấy trong nhật ký
+        db.add_config_listener(self.on_config_change)
+
+    async def cog_load(self):
+        if self.journal:
+            await self.journal.open()
+
+    async def cog_unload(self):
+        db.remove_config_listener(self.on_config_change)
+        # Gửi nốt các log đang chờ trong lúc bot còn kết nối
+        await log_sink.close()
+        if self.journal:
+            await self.journal.close()
+
+    def on_config_change(self, guild_id, key, value):
+        if key == 'message_cache_size':
+            self.message_cache.resize(guild_id, value)
 
     async def get_log_channel(self, guild_id: int) -> discord.TextChannel | None:
-        """Hàm helper để lấy kênh log, có sử dụng cache để tối ưu."""
-        if guild_id in self.log_channel_cache:
-            channel_id = self.log_channel_cache[guild_id]
-            if channel_id:
-                return self.bot.get_channel(channel_id)
-            return None
-
+        """Hàm helper để lấy kênh log. Cấu hình server được database giữ sẵn trong bộ nhớ
+        và tự cập nhật khi chạy `/set logchannel`, nên không cần cache riêng ở đây."""
         config = await db.get_or_create_config(guild_id)
-        channel_id = config.get('log_channel_id')
-        self.log_channel_cache[guild_id] = channel_id  # Cập nhật cache
-
-        if channel_id:
+        if channel_id := config.get('log_channel_id'):
             return self.bot.get_channel(channel_id)
         return None
 
     # --- SỰ KIỆN LOG TIN NHẮN ---
 
+    async def pop_record(self, guild_id: int, message_id: int) -> CachedMessage | None:
+        """Lấy bản ghi của tin nhắn vừa bị xóa: cache trong bộ nhớ trước, sau đó tới nhật ký trên đĩa."""
+        record = self.message_cache.pop(guild_id, message_id)
+        if self.journal:
+            # Luôn bỏ khỏi nhật ký, tin đã xóa không cần chiếm dung lượng của server
+            journal_record = await self.journal.pop(message_id)
+            if record is None and journal_record is not None:
+                self.journal_hits += 1
+                record = journal_record
+        return record
+
+    async def pop_records(self, guild_id: int, message_ids) -> dict:
+        """Như pop_record cho một lần xóa hàng loạt. Trả về dict message_id -> bản ghi."""
+        records = {}
+        for message_id in message_ids:
+            if (record := self.message_cache.pop(guild_id, message_id)) is not None:
+                records[message_id] = record
+        if self.journal:
+            for message_id, record in (await self.journal.pop_many(message_ids)).items():
+                if message_id not in records:
+                    self.journal_hits += 1
+                    records[message_id] = record
+        return records
+
+    async def get_record(self, guild_id: int, message_id: int) -> CachedMessage | None:
+        if (record := self.message_cache.get(guild_id, message_id)) is None and self.journal:
+            record = await self.journal.get(message_id)
+        return record
+
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
         """Lưu tin nhắn và tệp đính kèm vào cache để có thể lấy lại khi bị xóa."""
         if not message.author.bot and message.guild:
-            # Lấy danh sách URL của tất cả tệp đính kèm
-            attachment_urls = [att.url for att in message.attachments]
-
-            self.message_cache[message.id] = {
-                'content': message.content,
-                'author': message.author,
-                'channel': message.channel,
-                'created_at': message.created_at,
-                'attachment_urls': attachment_urls  # Lưu danh sách URL vào cache
-            }
-            # Giữ cache không quá lớn để tiết kiệm bộ nhớ
-            if len(self.message_cache) > 200:
-                oldest_keys = list(self.message_cache.keys())[:50]
-                for key in oldest_keys:
-                    del self.message_cache[key]
+            config = await db.get_or_create_config(message.guild.id)
+            record = CachedMessage(message.id, message.channel.id, message.author.id, message.content,
+                                   message.created_at, tuple(att.url for att in message.attachments))
+            # Server đầy thì tin cũ nhất bị loại, các server khác không bị ảnh hưởng
+            self.message_cache.put(message.guild.id, record, config['message_cache_size'])
+            # Chỉ ghi xuống đĩa cho server có kênh log, server khác không bao giờ dùng tới
+            if self.journal and config.get('log_channel_id'):
+                self.journal.record(message.guild.id, record)
 
     @commands.Cog.listener()
     async def on_message_delete(self, message: discord.Message):
         if not message.guild or message.author.bot:
             return
 
-        log_channel = await self.get_log_channel(message.guild.id)
+        # Lấy bản ghi ra ngay cả khi không có kênh log, tin đã xóa không cần chiếm chỗ trong cache
+        cached_message = await self.pop_record(message.guild.id, message.id)
+        await self.send_delete_log(message.guild, message.channel.id, message.author, message.id, cached_message)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        """Tin nhắn không còn trong cache của discord.py (vd: gửi trước khi bot khởi động lại).
+        Tin còn trong cache đã được on_message_delete xử lý."""
+        if payload.cached_message is not None or payload.guild_id is None:
+            return
+        if not (guild := self.bot.get_guild(payload.guild_id)):
+            return
+        # Không có bản ghi thì cũng không biết ai là người gửi, bỏ qua
+        if (cached_message := await self.pop_record(guild.id, payload.message_id)) is None:
+            return
+
+        author = guild.get_member(cached_message.author_id) or self.bot.get_user(cached_message.author_id)
+        if author is None:
+            try:
+                author = await self.bot.fetch_user(cached_message.author_id)
+            except discord.NotFound:
+                return
+        await self.send_delete_log(guild, payload.channel_id, author, payload.message_id, cached_message)
+
+    async def send_delete_log(self, guild: discord.Guild, channel_id: int, author: discord.abc.User,
+                              message_id: int, cached_message: CachedMessage | None):
+        log_channel = await self.get_log_channel(guild.id)
         if not log_channel:
             return
 
-        await asyncio.sleep(1.5)
-
-        deleter = None
-        try:
-            async for entry in message.guild.audit_logs(limit=5, action=discord.AuditLogAction.message_delete):
-                if entry.extra.channel.id == message.channel.id and entry.target.id == message.author.id:
-                    if (datetime.datetime.now(datetime.timezone.utc) - entry.created_at).total_seconds() < 5:
-                        deleter = entry.user
-                        break
-        except discord.Forbidden:
-            pass
-
-        cached_message = self.message_cache.pop(message.id, None)
-        author = message.author
-        content = cached_message.get('content') if cached_message else None
-        attachment_urls = cached_message.get(
-            'attachment_urls', []) if cached_message else []
-
-        action_text = ""
-        if deleter and deleter.id != author.id:
-            action_text = f"bị xóa bởi **{deleter.mention}**."
-        else:
-            action_text = f"do **chính họ** xóa."
+        content = cached_message.content if cached_message else None
+        attachment_urls = cached_message.attachment_urls if cached_message else ()
 
         embed = discord.Embed(
-            description=f"**Tin nhắn của {author.mention} trong {message.channel.mention} {action_text}**",
+            description=f"**Tin nhắn của {author.mention} trong <#{channel_id}> đã bị xóa.**",
             color=discord.Color.orange(),
             timestamp=datetime.datetime.now(datetime.timezone.utc)
         )
@@ -119,37 +165,151 @@ class Logger(commands.Cog):
                 name="Nội dung đã xóa", value="*Không thể truy xuất nội dung (tin nhắn được gửi khi bot offline hoặc quá cũ)*", inline=False)
 
         embed.set_footer(
-            text=f"ID Người Gửi: {author.id} | ID Tin Nhắn: {message.id}")
+            text=f"ID Người Gửi: {author.id} | ID Tin Nhắn: {message_id}")
+
+        async def add_deleter():
+            # Các lần xóa gần nhau trong server dùng chung một lần lấy audit log
+            deleter = await audit_log.message_deleter(guild, channel_id, author.id)
+            if deleter and deleter.id != author.id:
+                action_text = f"bị xóa bởi **{deleter.mention}**."
+            else:
+                action_text = f"do **chính họ** xóa."
+            embed.description = f"**Tin nhắn của {author.mention} trong <#{channel_id}> {action_text}**"
 
-        try:
-            await log_channel.send(embed=embed)
-        except Exception as e:
-            print(f"Lỗi khi gửi log tin nhắn bị xóa: {e}")
+        # Người xóa được điền trong nền; listener trả về ngay
+        log_sink.log(log_channel, embed, finalize=add_deleter())
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+        """Xóa hàng loạt (vd: /clear) được ghi thành một mục log tóm tắt duy nhất."""
+        if payload.guild_id is None or not (guild := self.bot.get_guild(payload.guild_id)):
+            return
+        records = await self.pop_records(guild.id, payload.message_ids)
+        log_channel = await self.get_log_channel(guild.id)
+        if not log_channel:
+            return
+
+        summary = f"🧹 **{len(payload.message_ids)} tin nhắn trong <#{payload.channel_id}> đã bị xóa hàng loạt"
+        embed = discord.Embed(
+            description=f"{summary}.**",
+            color=discord.Color.dark_orange(),
+            timestamp=datetime.datetime.now(datetime.timezone.utc)
+        )
+
+        if records:
+            author_counts = collections.Counter(record.author_id for record in records.values())
+            embed.add_field(name="Người gửi", value="\n".join(
+                f"<@{author_id}>: {count} tin" for author_id, count in author_counts.most_common(10)), inline=False)
+            # Xem trước nội dung theo thứ tự gửi, cắt cho vừa một field
+            preview, length = [], 0
+            for record in sorted(records.values(), key=lambda record: record.message_id):
+                line = f"<@{record.author_id}>: {(record.content or '*[tệp đính kèm]*')[:100]}"
+                if length + len(line) > 1000:
+                    preview.append("…")
+                    break
+                preview.append(line)
+                length += len(line) + 1
+            embed.add_field(name="Nội dung", value="\n".join(preview), inline=False)
+        embed.set_footer(text=f"Truy xuất được {len(records)}/{len(payload.message_ids)} tin | ID Kênh: {payload.channel_id}")
+
+        async def add_moderator():
+            if moderator := await audit_log.bulk_deleter(guild, payload.channel_id):
+                embed.description = f"{summary} bởi **{moderator.mention}**.**"
+                embed.set_author(name=str(moderator), icon_url=moderator.display_avatar.url)
+
+        log_sink.log(log_channel, embed, finalize=add_moderator())
 
     @commands.Cog.listener()
     async def on_message_edit(self, before: discord.Message, after: discord.Message):
         if before.author.bot or not before.guild or before.content == after.content:
             return
 
-        log_channel = await self.get_log_channel(before.guild.id)
+        # Giữ nội dung mới nhất để log xóa sau đó hiện đúng bản đã sửa
+        await self.update_record(before.guild.id, before.id, after.content)
+        await self.send_edit_log(before.content, after)
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        """Tin nhắn được sửa nhưng không còn trong cache của discord.py: lấy nội dung cũ từ bản ghi."""
+        after = payload.message
+        if payload.cached_message is not None or not after.guild or after.author.bot:
+            return
+        if (cached_message := await self.get_record(after.guild.id, after.id)) is None:
+            return
+        before_content = cached_message.content
+        if before_content == after.content:
+            return
+
+        await self.update_record(after.guild.id, after.id, after.content)
+        await self.send_edit_log(before_content, after)
+
+    async def update_record(self, guild_id: int, message_id: int, content: str):
+        journal = self.journal if self.journal and (await db.get_or_create_config(guild_id)).get('log_channel_id') else None
+        if cached_message := self.message_cache.get(guild_id, message_id):
+            cached_message.set_content(content)
+            if journal:
+                journal.record(guild_id, cached_message)
+        elif journal:
+            await journal.update_content(guild_id, message_id, content)
+
+    async def send_edit_log(self, before_content: str, after: discord.Message):
+        log_channel = await self.get_log_channel(after.guild.id)
         if not log_channel:
             return
 
         embed = discord.Embed(
-            description=f"**Tin nhắn được sửa trong {before.channel.mention}** [Nhảy tới tin nhắn]({after.jump_url})",
+            description=f"**Tin nhắn được sửa trong {after.channel.mention}** [Nhảy tới tin nhắn]({after.jump_url})",
             color=discord.Color.blue(),
             timestamp=datetime.datetime.now(datetime.timezone.utc)
         )
-        embed.set_author(name=str(before.author),
-                         icon_url=before.author.display_avatar.url)
+        embed.set_author(name=str(after.author),
+                         icon_url=after.author.display_avatar.url)
         embed.add_field(name="Trước khi sửa",
-                        value=f"```{before.content[:1020]}```", inline=False)
+                        value=f"```{before_content[:1020]}```", inline=False)
         embed.add_field(name="Sau khi sửa",
                         value=f"```{after.content[:1020]}```", inline=False)
         embed.set_footer(
-            text=f"ID Người Gửi: {before.author.id} | ID Tin Nhắn: {before.id}")
+            text=f"ID Người Gửi: {after.author.id} | ID Tin Nhắn: {after.id}")
 
-        await log_channel.send(embed=embed)
+        log_sink.log(log_channel, embed)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.message_cache.drop_guild(guild.id)
+        audit_log.drop_guild(guild.id)
+
+    # --- LỆNH QUẢN LÝ CACHE TIN NHẮN ---
+
+    @commands.hybrid_command(name='logstats', description="Xem thống kê cache tin nhắn của Logger (Admin).")
+    @checks.is_administrator()
+    async def logstats(self, ctx: commands.Context):
+        cache = self.message_cache
+        guild_cache = cache.guild(ctx.guild.id, (await db.get_or_create_config(ctx.guild.id))['message_cache_size'])
+        embed = discord.Embed(title="📝 Cache tin nhắn của Logger", color=discord.Color.blurple())
+        embed.add_field(name="Server này",
+                        value=f"**{len(guild_cache):,}**/{guild_cache.capacity:,} tin nhắn\n~{guild_cache.nbytes / 1024:,.1f} KiB", inline=True)
+        embed.add_field(name="Toàn bot",
+                        value=f"**{len(cache):,}** tin nhắn\n~{cache.nbytes / 1024:,.1f} KiB", inline=True)
+        embed.add_field(name="Tin nhắn bị xóa tìm thấy trong cache",
+                        value=f"**{cache.hit_rate:.1%}** ({cache.hits:,} hit / {cache.misses:,} miss) • {cache.evictions:,} tin bị loại", inline=False)
+        if self.journal:
+            embed.add_field(name="Nhật ký trên đĩa",
+                            value=f"~{self.journal.guild_nbytes(ctx.guild.id) / 1024:,.1f}/{self.journal.byte_budget / 1024:,.0f} KiB của server này\n"
+                                  f"**{self.journal_hits:,}** tin bị xóa trượt cache nhưng tìm thấy trong nhật ký", inline=False)
+        embed.add_field(name="Hàng đợi gửi log",
+                        value=f"{log_sink.sent_embeds:,} mục log trong {log_sink.sent_messages:,} tin nhắn • "
+                              f"{log_sink.queued:,} đang chờ • **{log_sink.dropped:,}** bị bỏ", inline=False)
+        embed.add_field(name="Audit log",
+                        value=f"**{audit_log.fetches:,}** lần gọi Discord cho {audit_log.requests:,} lần tìm người xóa", inline=False)
+        await ctx.send(embed=embed, ephemeral=True)
+
+    @commands.hybrid_command(name='logcachesize', description="Đặt số tin nhắn Logger giữ lại cho server này (Admin).")
+    @checks.is_administrator()
+    @app_commands.rename(size="số_tin_nhắn")
+    async def logcachesize(self, ctx: commands.Context, size: int):
+        size = max(0, min(size, MAX_GUILD_CAPACITY))
+        await db.update_config(ctx.guild.id, 'message_cache_size', size)
+        await ctx.send(f"✅ Logger sẽ giữ tối đa **{size:,}** tin nhắn gần nhất của server này.", delete_after=10)
 
     # --- SỰ KIỆN LOG THÀNH VIÊN ---
 
@@ -173,7 +333,7 @@ class Logger(commands.Cog):
             embed.add_field(
                 name="Tên mới", value=after.display_name, inline=True)
             embed.set_footer(text=f"User ID: {after.id}")
-            await log_channel.send(embed=embed)
+            log_sink.log(log_channel, embed)
 
         # Log thay đổi vai trò
         if before.roles != after.roles:
@@ -194,7 +354,7 @@ class Logger(commands.Cog):
                     embed.add_field(name="❌ Vai trò đã xóa", value=", ".join(
                         [r.mention for r in removed_roles]), inline=False)
                 embed.set_footer(text=f"User ID: {after.id}")
-                await log_channel.send(embed=embed)
+                log_sink.log(log_channel, embed)
 
     # --- SỰ KIỆN LOG KICK/BAN/UNBAN ---
 
@@ -204,52 +364,37 @@ class Logger(commands.Cog):
 
     @commands.Cog.listener()
     async def on_member_ban(self, guild: discord.Guild, user: discord.User | discord.Member):
-        log_channel = await self.get_log_channel(guild.id)
-        if not log_channel:
-            return
-
-        try:
-            async for entry in guild.audit_logs(limit=1, action=discord.AuditLogAction.ban):
-                if entry.target == user:
-                    moderator = entry.user
-                    reason = entry.reason or "Không có lý do."
-                    embed = discord.Embed(
-                        description=f"🔨 **{user} (`{user.id}`) đã bị cấm khỏi server**",
-                        color=discord.Color.dark_red(),
-                        timestamp=entry.created_at
-                    )
-                    embed.set_author(name=str(moderator),
-                                     icon_url=moderator.display_avatar.url)
-                    embed.add_field(name="Lý do", value=reason, inline=False)
-                    await log_channel.send(embed=embed)
-                    return
-        except discord.Forbidden:
-            pass
+        await self.send_ban_log(guild, user, discord.AuditLogAction.ban,
+                                f"🔨 **{user} (`{user.id}`) đã bị cấm khỏi server**", discord.Color.dark_red())
 
     @commands.Cog.listener()
     async def on_member_unban(self, guild: discord.Guild, user: discord.User):
+        await self.send_ban_log(guild, user, discord.AuditLogAction.unban,
+                                f"♻️ **{user} (`{user.id}`) đã được gỡ cấm**", discord.Color.green())
+
+    async def send_ban_log(self, guild: discord.Guild, user: discord.abc.User, action: discord.AuditLogAction,
+                           description: str, color: discord.Color):
         log_channel = await self.get_log_channel(guild.id)
         if not log_channel:
             return
 
-        try:
-            async for entry in guild.audit_logs(limit=1, action=discord.AuditLogAction.unban):
-                if entry.target == user:
-                    moderator = entry.user
-                    reason = entry.reason or "Không có lý do."
-                    embed = discord.Embed(
-                        description=f"♻️ **{user} (`{user.id}`) đã được gỡ cấm**",
-                        color=discord.Color.green(),
-                        timestamp=entry.created_at
-                    )
-                    embed.set_author(name=str(moderator),
-                                     icon_url=moderator.display_avatar.url)
-                    embed.add_field(name="Lý do", value=reason, inline=False)
-                    await log_channel.send(embed=embed)
-                    return
-        except discord.Forbidden:
-            pass
-
+        embed = discord.Embed(description=description, color=color,
+                              timestamp=datetime.datetime.now(datetime.timezone.utc))
+        embed.set_footer(text=f"ID Người Dùng: {user.id}")
+
+        async def add_moderator():
+            try:
+                async for entry in guild.audit_logs(limit=5, action=action):
+                    if entry.target is not None and entry.target.id == user.id:
+                        embed.timestamp = entry.created_at
+                        embed.set_author(name=str(entry.user), icon_url=entry.user.display_avatar.url)
+                        embed.add_field(name="Lý do", value=entry.reason or "Không có lý do.", inline=False)
+                        return
+            except discord.Forbidden:  # Bot không có quyền xem audit log: vẫn log, chỉ thiếu người thực hiện
+                pass
+
+        # Người thực hiện và lý do được điền trong nền; listener trả về ngay
+        log_sink.log(log_channel, embed, finalize=add_moderator())
 
 async def setup(bot):
     await bot.add_cog(Logger(bot))
@@ -8,6 +8,9 @@ from .utils import checks
 import asyncio
 from typing import Optional
 
+REPIN_QUIET_SECONDS = 3  # Ghim lại sau khi kênh im lặng được chừng này giây
+REPIN_MAX_DELAY_SECONDS = 30  # Kênh không bao giờ im thì vẫn ghim lại sau tối đa chừng này giây
+
 
 async def _pin_id_autocomplete(interaction: discord.Interaction, current: str) -> list[app_commands.Choice[int]]:
     all_pins = await db.get_all_pinned_messages(interaction.guild.id)
@@ -51,6 +54,12 @@ class Pinner(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.repinning_locks = set()
+        self.repin_tasks = {}  # channel_id -> task đang chờ kênh im lặng để ghim lại
+        self.last_activity = {}  # channel_id -> thời điểm (loop.time()) của tin nhắn mới nhất
+
+    def cog_unload(self):
+        for task in self.repin_tasks.values():
+            task.cancel()
 
     @commands.Cog.listener()
     async def on_ready(self):
@@ -83,11 +92,12 @@ class Pinner(commands.Cog):
             return
         self.repinning_locks.add(channel.id)
         try:
-            try:
-                old_message = await channel.fetch_message(pin_data['last_message_id'])
-                await old_message.delete()
-            except (discord.NotFound, discord.Forbidden):
-                pass
+            # Đã biết id của bản cũ nên xóa thẳng, không cần fetch
+            if pin_data['last_message_id']:
+                try:
+                    await channel.get_partial_message(pin_data['last_message_id']).delete()
+                except (discord.NotFound, discord.Forbidden):
+                    pass
             content = pin_data['message_content']
             embed = discord.Embed.from_dict(json.loads(
                 pin_data['embed_data'])) if pin_data['embed_data'] else None
@@ -98,13 +108,29 @@ class Pinner(commands.Cog):
 
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
-        if message.author.bot or not message.guild:
+        if message.author.bot or not message.guild or not db.has_pinned_messages(message.channel.id):
             return
-        pinned_messages = await db.get_pinned_messages_for_channel(message.channel.id)
-        if not pinned_messages:
-            return
-        for pin in pinned_messages:
-            await self.repin_message(message.channel, pin)
+        # Gom một loạt tin nhắn thành một lần ghim lại khi kênh đã im lặng
+        self.last_activity[message.channel.id] = asyncio.get_running_loop().time()
+        if (task := self.repin_tasks.get(message.channel.id)) is None or task.done():
+            self.repin_tasks[message.channel.id] = asyncio.create_task(self.repin_when_quiet(message.channel))
+
+    async def repin_when_quiet(self, channel: discord.TextChannel):
+        loop = asyncio.get_running_loop()
+        while True:
+            deadline = loop.time() + REPIN_MAX_DELAY_SECONDS
+            while (wait := min(self.last_activity[channel.id] + REPIN_QUIET_SECONDS, deadline) - loop.time()) > 0:
+                await asyncio.sleep(wait)
+            started = loop.time()
+            for pin in await db.get_pinned_messages_for_channel(channel.id):
+                try:
+                    await self.repin_message(channel, pin)
+                except Exception as e:
+                    print(f"Lỗi khi ghim lại {pin['pin_id']}: {e}")
+            # Có tin nhắn mới trong lúc đang ghim lại thì chờ thêm một lượt nữa
+            if self.last_activity[channel.id] <= started:
+                del self.last_activity[channel.id]
+                return
 
     @commands.hybrid_command(name="ghim", description="Ghim một tin nhắn mới hoặc một tin nhắn có sẵn.")
     @checks.has_permissions(manage_messages=True)
@@ -145,8 +171,7 @@ class Pinner(commands.Cog):
             return await ctx.send(f"❌ Không tìm thấy ghim nào với ID `{pin_id}`.", ephemeral=True)
         try:
             channel = self.bot.get_channel(pin_data['channel_id']) or await self.bot.fetch_channel(pin_data['channel_id'])
-            message = await channel.fetch_message(pin_data['last_message_id'])
-            await message.delete()
+            await channel.get_partial_message(pin_data['last_message_id']).delete()
         except (discord.NotFound, discord.Forbidden):
             pass
         await db.remove_pinned_message(pin_id)
@@ -3,7 +3,7 @@ import discord
 from discord.ext import commands
 import database as db
 import datetime
-from .utils import checks
+from .utils import checks, xp_curve
 from discord import app_commands
 
 
@@ -27,12 +27,8 @@ class Profile(commands.Cog):
         partner_id = await db.get_partner(ctx.guild.id, target.id)
         partner = ctx.guild.get_member(partner_id) if partner_id else None
 
-        leaderboard_data = await db.get_leaderboard(ctx.guild.id, limit=1000)
-        user_rank = "N/A"
-        for i, rank_user in enumerate(leaderboard_data):
-            if rank_user['user_id'] == target.id:
-                user_rank = f"#{i + 1}"
-                break
+        rank = await db.get_user_rank(ctx.guild.id, target.id)
+        user_rank = f"#{rank}" if rank else "N/A"
 
         embed = discord.Embed(
             title=f"Hồ Sơ Thành Viên: {target.name}",
@@ -63,7 +59,7 @@ class Profile(commands.Cog):
         # ... (các field khác giữ nguyên) ...
         xp = user_data.get('xp', 0)
         level = user_data.get('level', 1)
-        xp_needed = 5 * (level**2) + 50 * level + 100
+        xp_needed = xp_curve.xp_needed(level)
 
         fill = '🟩'
         empty = '⬛'
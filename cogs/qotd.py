@@ -2,9 +2,9 @@
 import discord
 from discord.ext import commands, tasks
 import datetime
-import aiosqlite
 import random
 import asyncio
+import database as db
 
 # =================================================================================
 # === DANH SÁCH CÂU HỎI MỚI - PHONG CÁCH GENZ, HÀI HƯỚC, BẮT TREND ===
@@ -42,8 +42,6 @@ DEFAULT_QUESTIONS = [
     "Điều gì bạn từng rất tin tưởng khi còn nhỏ nhưng giờ nhận ra nó 'ảo ma canada'?",
 ]
 
-DB_NAME = 'bot_data.db'
-
 
 class QOTD(commands.Cog):
     """❓ Tự động đặt nhiều câu hỏi trong ngày để tăng tương tác."""
@@ -63,32 +61,29 @@ class QOTD(commands.Cog):
 
     async def initialize_questions(self):
         """Thêm các câu hỏi mặc định vào DB nếu chưa có."""
-        async with aiosqlite.connect(DB_NAME) as db:
-            async with db.execute("SELECT question_text FROM qotd") as cursor:
+        async with db.writer() as conn:
+            async with conn.execute("SELECT question_text FROM qotd") as cursor:
                 existing_questions = {row[0] for row in await cursor.fetchall()}
 
             new_questions = [
                 (q,) for q in DEFAULT_QUESTIONS if q not in existing_questions]
 
             if new_questions:
-                await db.executemany("INSERT INTO qotd (question_text) VALUES (?)", new_questions)
-                await db.commit()
+                await conn.executemany("INSERT INTO qotd (question_text) VALUES (?)", new_questions)
                 print(
                     f"[QOTD] Đã thêm {len(new_questions)} câu hỏi mới vào database.")
 
     async def get_random_question(self):
         """Lấy một câu hỏi ngẫu nhiên chưa được sử dụng từ DB."""
-        async with aiosqlite.connect(DB_NAME) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("SELECT * FROM qotd WHERE is_used = 0") as cursor:
+        async with db.writer() as conn:
+            async with conn.execute("SELECT * FROM qotd WHERE is_used = 0") as cursor:
                 unused_questions = await cursor.fetchall()
 
             if not unused_questions:
-                await db.execute("UPDATE qotd SET is_used = 0")
-                await db.commit()
+                await conn.execute("UPDATE qotd SET is_used = 0")
                 print(
                     "[QOTD] Tất cả câu hỏi đã được sử dụng. Đang reset lại danh sách.")
-                async with db.execute("SELECT * FROM qotd WHERE is_used = 0") as cursor:
+                async with conn.execute("SELECT * FROM qotd WHERE is_used = 0") as cursor:
                     unused_questions = await cursor.fetchall()
 
             if not unused_questions:
@@ -96,8 +91,7 @@ class QOTD(commands.Cog):
 
             chosen_question = random.choice(unused_questions)
 
-            await db.execute("UPDATE qotd SET is_used = 1 WHERE question_id = ?", (chosen_question['question_id'],))
-            await db.commit()
+            await conn.execute("UPDATE qotd SET is_used = 1 WHERE question_id = ?", (chosen_question['question_id'],))
 
             return chosen_question['question_text']
 
@@ -135,12 +129,10 @@ class QOTD(commands.Cog):
             return
 
         try:
-            async with aiosqlite.connect(DB_NAME) as db:
-                async with db.execute("SELECT main_chat_channel_id FROM server_configs WHERE guild_id = ?", (guild.id,)) as cursor:
-                    config_row = await cursor.fetchone()
+            config = await db.get_or_create_config(guild.id)
 
-            if config_row and config_row[0]:
-                target_channel = self.bot.get_channel(config_row[0])
+            if main_chat_id := config.get('main_chat_channel_id'):
+                target_channel = self.bot.get_channel(main_chat_id)
                 if target_channel:
                     embed = discord.Embed(
                         title="❓ CÂU HỎI TRONG NGÀY ❓",
@@ -42,12 +42,19 @@ class QuestView(discord.ui.View):
     async def claim_reward(self, interaction: discord.Interaction):
         quest_id = interaction.data['custom_id']
 
-        # Lấy lại dữ liệu quest mới nhất từ DB để tránh lỗi "double-claim"
         current_quests = await db.get_user_quests(self.author.id, self.author.guild.id)
         quest_to_claim = next(
             (q for q in current_quests if q['quest_id'] == quest_id and q['is_completed']), None)
 
-        if not quest_to_claim:
+        claimed = False
+        if quest_to_claim:
+            # Đánh dấu đã nhận và trao thưởng trong cùng giao dịch: bấm nút dồn dập cũng chỉ nhận được một lần
+            async with db.transaction() as tx:
+                if claimed := await db.claim_quest_reward(self.author.id, self.author.guild.id, quest_id, tx=tx):
+                    await db.update_coins(self.author.id, self.author.guild.id, quest_to_claim['reward_coin'], tx=tx)
+                    await db.update_user_xp(self.author.id, self.author.guild.id, quest_to_claim['reward_xp'], tx=tx)
+
+        if not claimed:
             await interaction.response.send_message("Nhiệm vụ không hợp lệ hoặc đã được nhận thưởng.", ephemeral=True)
             # Cập nhật lại giao diện để xóa nút bấm đã dùng
             await self.cog.send_quest_embed(interaction.message, self.author)
@@ -56,10 +63,6 @@ class QuestView(discord.ui.View):
         reward_coin = quest_to_claim['reward_coin']
         reward_xp = quest_to_claim['reward_xp']
 
-        await db.update_coins(self.author.id, self.author.guild.id, reward_coin)
-        await db.update_user_xp(self.author.id, self.author.guild.id, reward_xp)
-        await db.claim_quest_reward(self.author.id, self.author.guild.id, quest_id)
-
         await interaction.response.send_message(f"🎉 Bạn đã nhận thành công **{reward_coin:,} coin** và **{reward_xp} XP** từ nhiệm vụ **'{quest_to_claim['name']}'**!", ephemeral=True)
 
         # Cập nhật lại giao diện sau khi nhận thưởng
@@ -84,7 +87,7 @@ class Quests(commands.Cog):
             text="Nhiệm vụ sẽ được làm mới vào 8:00 sáng mỗi ngày.")
 
         if not user_quests:
-            embed.description = "Bạn chưa có nhiệm vụ nào. Hãy chờ đến ngày mai nhé!"
+            embed.description = "Bạn đã hoàn thành hết nhiệm vụ hôm nay. Hãy chờ đến ngày mai nhé!"
         else:
             # Sắp xếp nhiệm vụ theo category
             categorized_quests = {category: []
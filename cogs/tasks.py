@@ -2,8 +2,9 @@
 import discord
 from discord.ext import commands, tasks
 import database as db
+from .utils import checks, members
+from .utils.scheduler import scheduler
 import datetime
-import random
 import itertools
 import asyncio
 
@@ -41,16 +42,45 @@ class BackgroundTasks(commands.Cog):
             discord.Color.from_rgb(255, 198, 255),   # Pastel Pink/Violet
         ])
 
+        # Việc đến hạn (role tạm thời, hiệu ứng, nợ quá hạn) do bộ hẹn giờ gọi đúng lúc, không quét định kỳ
+        # Role tạm thời và nợ quá hạn cần tra thành viên: dùng handler theo lô để mỗi server chỉ tra một lần
+        scheduler.add_handler('temp_role', self.expire_temporary_roles, batch=True)
+        scheduler.add_handler('effect', self.expire_effect)
+        scheduler.add_handler('loan', self.flag_overdue_loans_for, batch=True)
+        self.scheduler_starter = asyncio.create_task(self.start_scheduler())
+        db.add_config_listener(self.on_config_change)
+
         # Bắt đầu tất cả các task
-        self.check_expirations.start()
         self.weekly_leaderboard_reward.start()
-        self.check_overdue_loans.start()
-        self.assign_daily_quests.start()
+        self.recheck_overdue_loans.start()
+        self.cleanup_daily_quests.start()
         self.rainbow_role_task.start()
 
     def cog_unload(self):
-        for task in [self.check_expirations, self.weekly_leaderboard_reward, self.check_overdue_loans, self.assign_daily_quests, self.rainbow_role_task]:
+        for task in [self.weekly_leaderboard_reward, self.recheck_overdue_loans, self.cleanup_daily_quests, self.rainbow_role_task]:
             task.cancel()
+        self.scheduler_starter.cancel()
+        scheduler.stop()
+        scheduler.remove_handler('temp_role', self.expire_temporary_roles)
+        scheduler.remove_handler('effect', self.expire_effect)
+        scheduler.remove_handler('loan', self.flag_overdue_loans_for)
+        db.remove_config_listener(self.on_config_change)
+
+    def on_config_change(self, guild_id, key, value):
+        if key == 'debtor_role_id':
+            # Role nợ vừa được đặt/đổi: gắn ngay cho các khoản đã quá hạn của server này
+            asyncio.create_task(self.flag_overdue_loans(guild_id))
+
+    @commands.hybrid_command(name='memberstats', description="Thống kê tra cứu thành viên của các tác vụ nền (Admin).", hidden=True)
+    @checks.is_administrator()
+    async def memberstats(self, ctx: commands.Context):
+        lines = [member_resolver.summary() for member_resolver in members.all_resolvers()]
+        await ctx.send("\n".join(lines) or "Chưa có tác vụ nền nào tra cứu thành viên.", ephemeral=True)
+
+    async def start_scheduler(self):
+        # Handler cần cache guild/member nên chỉ chạy bộ hẹn giờ khi bot đã sẵn sàng
+        await self.bot.wait_until_ready()
+        scheduler.start()
 
     # ===============================================
     # Task đổi màu Cầu vồng
@@ -95,47 +125,44 @@ class BackgroundTasks(commands.Cog):
         await self.bot.wait_until_ready()
 
     # ===============================================
-    # Task kiểm tra hết hạn
+    # Xử lý hết hạn (gọi bởi bộ hẹn giờ)
     # ===============================================
-    @tasks.loop(minutes=1)
-    async def check_expirations(self):
-        if self.role_update_lock.locked():
-            return
+    @staticmethod
+    def group_by_guild(keys):
+        """Nhóm các key (user_id, guild_id, ...) của bộ hẹn giờ theo server."""
+        groups = {}
+        for key in keys:
+            groups.setdefault(key[1], []).append(key)
+        return groups.items()
+
+    async def expire_temporary_roles(self, keys):
+        """Gỡ các role tạm thời đến hạn cùng lúc; thành viên của mỗi server được tra trong một lần.
+        Trả về các key bị lỗi để bộ hẹn giờ thử lại."""
+        failed = []
         async with self.role_update_lock:
-            try:
-                expired_roles = await db.get_expired_items('temporary_roles')
-                if expired_roles:
-                    items_to_clear = []
-                    for item in expired_roles:
-                        guild = self.bot.get_guild(item['guild_id'])
-                        if not guild:
-                            items_to_clear.append(item)
-                            continue
-                        role = guild.get_role(item['role_id'])
-                        if not role:
-                            items_to_clear.append(item)
-                            continue
-                        try:
-                            member = await guild.fetch_member(item['user_id'])
-                            if member and role in member.roles:
+            for guild_id, guild_keys in self.group_by_guild(keys):
+                found = {}
+                if guild := self.bot.get_guild(guild_id):
+                    # Role đã bị xóa khỏi server thì không cần tìm thành viên
+                    user_ids = [user_id for user_id, _, role_id in guild_keys if guild.get_role(role_id)]
+                    found = await members.resolver('temp_role').get_many(guild, user_ids)
+                for key in guild_keys:
+                    user_id, _, role_id = key
+                    try:
+                        if (member := found.get(user_id)) and (role := guild.get_role(role_id)) and role in member.roles:
+                            try:
                                 await member.remove_roles(role, reason="Role đã mua/bị phạt đã hết hạn.")
-                        except (discord.NotFound, discord.Forbidden):
-                            pass
-                        except Exception as e:
-                            print(f" ! Error removing temporary role: {e}")
-                        items_to_clear.append(item)
-                    if items_to_clear:
-                        await db.clear_expired_items('temporary_roles', ['user_id', 'guild_id', 'role_id'], items_to_clear)
-                expired_effects = await db.get_expired_items('active_effects')
-                if expired_effects:
-                    await db.clear_expired_items('active_effects', ['user_id', 'guild_id', 'effect_type'], expired_effects)
-            except Exception as e:
-                print(
-                    f"[CRITICAL TASK ERROR] Task check_expirations đã gặp lỗi: {e}")
+                            except (discord.NotFound, discord.Forbidden):
+                                pass
+                        await db.remove_temporary_role(user_id, guild_id, role_id)
+                    except Exception as e:
+                        print(f"[CRITICAL TASK ERROR] Lỗi khi gỡ role tạm thời {role_id} của {user_id}: {e}")
+                        failed.append(key)
+        return failed
 
-    @check_expirations.before_loop
-    async def before_check_expirations(self):
-        await self.bot.wait_until_ready()
+    async def expire_effect(self, key):
+        # Hiệu ứng chỉ sống trong DB và bộ nhớ: gỡ đúng hiệu ứng đến hạn
+        await db.expire_active_effect(*key)
 
     # ===============================================
     # Task trao thưởng BXH Tuần
@@ -184,8 +211,12 @@ class BackgroundTasks(commands.Cog):
                             continue
 
                         new_winner_id = leaderboard[0]['user_id']
+                        new_winner = await members.resolver('weekly_reward').get(guild, new_winner_id)
+                        if not new_winner:
+                            print(
+                                f"   ! Người đứng đầu BXH của guild '{guild.name}' không còn trong server.")
+                            continue
                         try:
-                            new_winner = await guild.fetch_member(new_winner_id)
                             if top_role not in new_winner.roles:
                                 await new_winner.add_roles(top_role, reason="Đạt Top 1 Leaderboard tuần")
 
@@ -200,7 +231,7 @@ class BackgroundTasks(commands.Cog):
                                     text="Một tuần mới, một cuộc đua mới lại bắt đầu!")
                                 await channel.send(embed=embed)
 
-                        except (discord.NotFound, discord.Forbidden) as e:
+                        except discord.Forbidden as e:
                             print(
                                 f"   ! Không thể xử lý người thắng cuộc cho guild '{guild.name}': {e}")
                     except Exception as e:
@@ -209,79 +240,80 @@ class BackgroundTasks(commands.Cog):
             except Exception as e:
                 print(
                     f"[CRITICAL TASK ERROR] Task weekly_leaderboard_reward đã thất bại: {e}")
+            print(f"   Tra cứu thành viên - {members.resolver('weekly_reward').summary()}")
 
     @weekly_leaderboard_reward.before_loop
     async def before_weekly_leaderboard_reward(self):
         await self.bot.wait_until_ready()
 
     # ===============================================
-    # Task kiểm tra nợ quá hạn
+    # Xử lý nợ quá hạn (gọi bởi bộ hẹn giờ)
     # ===============================================
-    @tasks.loop(minutes=5)
-    async def check_overdue_loans(self):
-        if self.role_update_lock.locked():
-            return
-        async with self.role_update_lock:
-            try:
-                print(f"[{datetime.datetime.now()}] Running overdue loans check...")
-                now = datetime.datetime.now(datetime.timezone.utc)
-                all_loans = await db.get_all_loans()
-                for loan in all_loans:
-                    if now > datetime.datetime.fromisoformat(loan['due_date']):
-                        guild = self.bot.get_guild(loan['guild_id'])
-                        if not guild:
-                            continue
-                        config = await db.get_or_create_config(guild.id)
-                        if not (debtor_role_id := config.get('debtor_role_id')) or not (debtor_role := guild.get_role(debtor_role_id)):
-                            continue
-                        try:
-                            member = await guild.fetch_member(loan['user_id'])
-                            if debtor_role not in member.roles:
-                                await member.add_roles(debtor_role, reason="Quá hạn trả nợ")
-                        except discord.NotFound:
-                            await db.delete_loan(loan['user_id'], loan['guild_id'])
-                        except discord.Forbidden:
-                            print(
-                                f"Bot cannot apply debtor role in {guild.name}")
-            except Exception as e:
-                print(
-                    f"[CRITICAL TASK ERROR] Task check_overdue_loans đã gặp lỗi: {e}")
+    async def flag_overdue_loans_for(self, keys):
+        """Gắn role nợ cho các khoản vay (user_id, guild_id) đã quá hạn; người vay của mỗi server được tra
+        trong một lần. Trả về các key bị lỗi để bộ hẹn giờ thử lại."""
+        failed = []
+        for guild_id, guild_keys in self.group_by_guild(keys):
+            guild = self.bot.get_guild(guild_id)
+            if not guild:
+                continue
+            config = await db.get_or_create_config(guild.id)
+            if not (debtor_role_id := config.get('debtor_role_id')) or not (debtor_role := guild.get_role(debtor_role_id)):
+                continue
+            async with self.role_update_lock:
+                found = await members.resolver('loan').get_many(guild, [user_id for user_id, _ in guild_keys])
+                for key in guild_keys:
+                    user_id, _ = key
+                    try:
+                        if not (member := found.get(user_id)):
+                            # Người vay đã rời server
+                            await db.delete_loan(user_id, guild_id)
+                        elif debtor_role not in member.roles:
+                            await member.add_roles(debtor_role, reason="Quá hạn trả nợ")
+                    except discord.NotFound:
+                        await db.delete_loan(user_id, guild_id)
+                    except discord.Forbidden:
+                        print(
+                            f"Bot cannot apply debtor role in {guild.name}")
+                    except Exception as e:
+                        print(f"[CRITICAL TASK ERROR] Lỗi khi gắn role nợ cho {user_id} ở server {guild_id}: {e}")
+                        failed.append(key)
+        return failed
+
+    # Lượt quét dự phòng: bộ hẹn giờ chỉ gọi mỗi khoản một lần lúc tới hạn, nên khoản bị bỏ sót
+    # (role nợ bị gỡ tay, bot thiếu quyền lúc đó, guild chưa sẵn sàng...) được gắn lại ở đây
+    @tasks.loop(minutes=30)
+    async def recheck_overdue_loans(self):
+        await self.flag_overdue_loans()
 
-    @check_overdue_loans.before_loop
-    async def before_check_loans(self):
+    async def flag_overdue_loans(self, guild_id=None):
+        """Gắn role nợ cho mọi khoản đã quá hạn (của một server, hoặc tất cả nếu guild_id là None)."""
+        try:
+            loans = await db.get_overdue_loans(datetime.datetime.now(datetime.timezone.utc).isoformat())
+            await self.flag_overdue_loans_for([(loan['user_id'], loan['guild_id']) for loan in loans
+                                               if guild_id is None or loan['guild_id'] == guild_id])
+        except Exception as e:
+            print(f"[CRITICAL TASK ERROR] Lỗi khi quét các khoản nợ quá hạn: {e}")
+
+    @recheck_overdue_loans.before_loop
+    async def before_recheck_overdue_loans(self):
         await self.bot.wait_until_ready()
 
     # ===============================================
-    # Task giao nhiệm vụ hàng ngày
+    # Task dọn nhiệm vụ ngày cũ
     # ===============================================
-    @tasks.loop(time=datetime.time(hour=1, minute=0, tzinfo=datetime.timezone.utc))
-    # @tasks.loop(minutes=1)
-    async def assign_daily_quests(self):
+    # Nhiệm vụ hằng ngày được suy ra khi cần (database.daily_quest_ids), task này chỉ xóa tiến trình của ngày trước
+    @tasks.loop(time=datetime.time(hour=db.QUEST_DAY_START_HOUR_UTC, minute=0, tzinfo=datetime.timezone.utc))
+    async def cleanup_daily_quests(self):
         try:
-            daily_quests = await db.get_quests_by_frequency('DAILY')
-            if not daily_quests:
-                return
-            today_str = datetime.date.today().isoformat()
-            num_quests_to_assign = 8
-            for guild in self.bot.guilds:
-                if len(daily_quests) < num_quests_to_assign:
-                    num_quests_to_assign = len(daily_quests)
-                for member in guild.members:
-                    if member.bot:
-                        continue
-                    current_quests = await db.get_user_quests(member.id, guild.id)
-                    if not current_quests or current_quests[0]['assigned_date'] != today_str:
-                        quests_for_this_member = random.sample(
-                            daily_quests, min(num_quests_to_assign, len(daily_quests)))
-                        quest_ids = [q['quest_id']
-                                     for q in quests_for_this_member]
-                        await db.assign_user_quests(member.id, guild.id, quest_ids, today_str)
+            deleted = await db.delete_stale_user_quests()
+            print(f"[{datetime.datetime.now()}] Đã dọn {deleted} dòng nhiệm vụ của các ngày trước.")
         except Exception as e:
             print(
-                f"[CRITICAL TASK ERROR] Task assign_daily_quests đã gặp lỗi: {e}")
+                f"[CRITICAL TASK ERROR] Task cleanup_daily_quests đã gặp lỗi: {e}")
 
-    @assign_daily_quests.before_loop
-    async def before_assign_quests(self):
+    @cleanup_daily_quests.before_loop
+    async def before_cleanup_quests(self):
         await self.bot.wait_until_ready()
 
 
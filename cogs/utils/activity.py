@@ -0,0 +1,96 @@
+# cogs/utils/activity.py
+import asyncio
+import database as db
+
+ACTIVITY_BATCH_SECONDS = 2  # Gom các hoạt động trong khoảng này rồi mới ghi một lần
+
+
+class ActivityBus:
+    """Hàng đợi hoạt động (CHAT, RPS_WIN, SHOP_BUY, COIN_SPEND...) cho nhiệm vụ và thành tựu.
+
+    Lệnh chỉ gọi emit() - thao tác đồng bộ trong bộ nhớ - rồi trả lời người dùng ngay. Các hoạt động
+    cùng (user, guild, loại) được cộng dồn lúc xếp hàng; một task nền ghi cả lô trong MỘT giao dịch
+    rồi báo thành tựu vừa mở khóa cho các unlock listener.
+
+    Mặc định một hoạt động tính cho cả nhiệm vụ lẫn thành tựu; `quests=False` / `achievements=False`
+    giới hạn nó vào một bên (vd: trả nợ chỉ tính cho thành tựu tiêu tiền, không tính nhiệm vụ ngày)."""
+
+    def __init__(self, batch_seconds=ACTIVITY_BATCH_SECONDS):
+        self.batch_seconds = batch_seconds
+        self._pending = {}  # (user_id, guild_id, activity_type, quests, achievements) -> [giá trị cộng dồn, kênh gần nhất]
+        self._wakeup = asyncio.Event()
+        self._consumer = None
+        self._unlock_listeners = []
+
+    def emit(self, user_id: int, guild_id: int, activity_type: str, value: int = 1, channel=None,
+             *, quests: bool = True, achievements: bool = True):
+        """Ghi nhận một hoạt động. `channel` là nơi thông báo thành tựu nếu server chưa đặt kênh thông báo."""
+        if value <= 0 or not (quests or achievements):
+            return
+        entry = self._pending.setdefault((user_id, guild_id, activity_type, quests, achievements), [0, None])
+        entry[0] += value
+        if channel is not None:
+            entry[1] = channel
+        self._wakeup.set()
+        if self._consumer is None or self._consumer.done():
+            self._consumer = asyncio.create_task(self._run())
+
+    def add_unlock_listener(self, listener):
+        """listener(user_id, guild_id, channel, unlocked) là coroutine, được gọi sau khi lô đã commit."""
+        self._unlock_listeners.append(listener)
+
+    def remove_unlock_listener(self, listener):
+        if listener in self._unlock_listeners:
+            self._unlock_listeners.remove(listener)
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.batch_seconds)
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"[CRITICAL TASK ERROR] Lỗi khi ghi tiến trình nhiệm vụ/thành tựu: {e}")
+
+    async def flush(self):
+        """Ghi toàn bộ hoạt động đang chờ trong một giao dịch. Trả về số nhóm (user, guild, loại, phạm vi) đã ghi."""
+        if not self._pending:
+            return 0
+        batch, self._pending = self._pending, {}
+        unlocked_batch = []
+        try:
+            async with db.transaction() as tx:
+                for (user_id, guild_id, activity_type, quests, achievements), (value, channel) in batch.items():
+                    if quests:
+                        await db.update_quest_progress(user_id, guild_id, activity_type, value_to_add=value, tx=tx)
+                    if achievements and (unlocked := await db.update_achievement_progress(user_id, guild_id, activity_type, value_to_add=value, tx=tx)):
+                        unlocked_batch.append((user_id, guild_id, channel, unlocked))
+        except BaseException:
+            # Ghi thất bại (hoặc task bị hủy giữa chừng): trả lại hàng đợi để lần sau ghi tiếp
+            for key, (value, channel) in batch.items():
+                entry = self._pending.setdefault(key, [0, channel])
+                entry[0] += value
+            raise
+
+        for user_id, guild_id, channel, unlocked in unlocked_batch:
+            for listener in self._unlock_listeners:
+                try:
+                    await listener(user_id, guild_id, channel, unlocked)
+                except Exception as e:
+                    print(f"Lỗi khi thông báo thành tựu cho user {user_id}: {e}")
+        return len(batch)
+
+    async def close(self):
+        """Dừng task nền rồi ghi nốt phần còn lại. Gọi trước khi đóng pool database."""
+        if self._consumer is not None and not self._consumer.done():
+            self._consumer.cancel()
+            try:
+                await self._consumer
+            except asyncio.CancelledError:
+                pass
+        self._consumer = None
+        await self.flush()
+
+
+activity = ActivityBus()
@@ -0,0 +1,106 @@
+# cogs/utils/announcer.py
+import asyncio
+import collections
+import time
+import discord
+import database as db
+
+ANNOUNCE_WINDOW_SECONDS = 1.5  # Gom các thông báo tới cùng kênh trong khoảng này thành một tin nhắn
+MAX_EMBEDS_PER_MESSAGE = 10  # Giới hạn của Discord
+MAX_CONTENT_LENGTH = 2000  # Giới hạn của Discord
+CHANNEL_SEND_BUDGET = 5  # Số tin nhắn tối đa gửi vào một kênh ...
+CHANNEL_SEND_PERIOD_SECONDS = 5  # ... trong khoảng thời gian này
+
+
+class Announcement:
+    __slots__ = ('content', 'embed', 'origin')
+
+    def __init__(self, content, embed, origin):
+        self.content = content
+        self.embed = embed
+        self.origin = origin
+
+
+class ChannelQueue:
+    __slots__ = ('channel', 'items', 'sent_at', 'task')
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.items = []
+        self.sent_at = collections.deque()  # Thời điểm các lần gửi gần nhất, để không vượt ngân sách của kênh
+        self.task = None
+
+
+class Announcer:
+    """Gom thông báo lên cấp / thành tựu / role theo kênh đích và gửi thành ít tin nhắn nhất có thể.
+
+    Mỗi kênh có một hàng đợi: sau ANNOUNCE_WINDOW_SECONDS, các thông báo đang chờ được ghép vào một tin nhắn
+    (nội dung nối dòng, tối đa 10 embed), và mỗi kênh không gửi quá CHANNEL_SEND_BUDGET tin trong
+    CHANNEL_SEND_PERIOD_SECONDS giây. Kênh thông báo báo Forbidden thì thông báo được chuyển về kênh gốc."""
+
+    def __init__(self):
+        self._queues = {}  # channel_id -> ChannelQueue, chỉ gồm kênh thông báo và kênh gốc nên không lớn
+
+    async def announce(self, guild: discord.Guild, *, content: str = None, embed: discord.Embed = None, origin=None):
+        """Xếp một thông báo vào kênh thông báo của server, hoặc kênh gốc `origin` nếu server chưa đặt.
+        Không có kênh nào phù hợp thì bỏ qua."""
+        config = await db.get_or_create_config(guild.id)
+        channel = guild.get_channel(config.get('announcement_channel_id') or 0) or origin
+        if channel is not None:
+            self._enqueue(channel, Announcement(content, embed, origin))
+
+    def _enqueue(self, channel, item: Announcement):
+        if (queue := self._queues.get(channel.id)) is None:
+            queue = self._queues[channel.id] = ChannelQueue(channel)
+        queue.items.append(item)
+        if queue.task is None or queue.task.done():
+            queue.task = asyncio.create_task(self._drain(queue))
+
+    async def _drain(self, queue: ChannelQueue):
+        # Hàng đợi của kênh được giữ lại sau khi gửi xong để lần gom sau vẫn tính vào ngân sách gửi của kênh
+        await asyncio.sleep(ANNOUNCE_WINDOW_SECONDS)
+        while queue.items:
+            batch = self._take_batch(queue)
+            await self._wait_for_budget(queue)
+            await self._send(queue.channel, batch)
+
+    @staticmethod
+    def _take_batch(queue: ChannelQueue) -> list:
+        """Lấy từ đầu hàng đợi nhiều thông báo nhất còn vừa một tin nhắn."""
+        batch, embeds, length = [], 0, 0
+        for item in queue.items:
+            item_embeds = 1 if item.embed else 0
+            item_length = len(item.content) + 1 if item.content else 0
+            if batch and (embeds + item_embeds > MAX_EMBEDS_PER_MESSAGE or length + item_length > MAX_CONTENT_LENGTH):
+                break
+            batch.append(item)
+            embeds += item_embeds
+            length += item_length
+        del queue.items[:len(batch)]
+        return batch
+
+    @staticmethod
+    async def _wait_for_budget(queue: ChannelQueue):
+        now = time.monotonic()
+        while queue.sent_at and now - queue.sent_at[0] >= CHANNEL_SEND_PERIOD_SECONDS:
+            queue.sent_at.popleft()
+        if len(queue.sent_at) >= CHANNEL_SEND_BUDGET:
+            await asyncio.sleep(queue.sent_at[0] + CHANNEL_SEND_PERIOD_SECONDS - now)
+            queue.sent_at.popleft()
+        queue.sent_at.append(time.monotonic())
+
+    async def _send(self, channel, batch: list):
+        content = "\n".join(item.content for item in batch if item.content)[:MAX_CONTENT_LENGTH]
+        embeds = [item.embed for item in batch if item.embed]
+        try:
+            await channel.send(content=content or None, embeds=embeds)
+        except discord.Forbidden:
+            # Không có quyền ở kênh thông báo: chuyển từng thông báo về kênh gốc của nó (chỉ thử một lần)
+            for item in batch:
+                if item.origin is not None and item.origin.id != channel.id:
+                    self._enqueue(item.origin, Announcement(item.content, item.embed, None))
+        except discord.HTTPException as e:
+            print(f"Lỗi khi gửi thông báo vào kênh {channel.id}: {e}")
+
+
+announcer = Announcer()
@@ -0,0 +1,131 @@
+# cogs/utils/audit_log.py
+import asyncio
+import datetime
+import discord
+
+AUDIT_WINDOW_SECONDS = 1.5  # Chờ audit log kịp ghi nhận, đồng thời gom các lần xóa trong khoảng này vào một lần gọi
+AUDIT_FETCH_LIMIT = 25  # Số mục audit log mỗi lần lấy
+AUDIT_FRESH_SECONDS = 10  # Mục chưa từng thấy chỉ được tính nếu vừa tạo trong khoảng này
+
+
+class _GuildAuditState:
+    __slots__ = ('pending', 'seen', 'poller')
+
+    def __init__(self):
+        self.pending = {}  # action -> [(khóa khớp, future)]
+        self.seen = {}  # action -> {entry_id: count} của lần lấy gần nhất
+        self.poller = None
+
+
+class AuditLogAttributor:
+    """Tìm người đã xóa tin nhắn qua audit log mà không gọi Discord cho từng tin.
+
+    Mỗi server có một poller: yêu cầu đầu tiên mở một cửa sổ AUDIT_WINDOW_SECONDS, mọi lần xóa trong cửa sổ
+    được khớp với MỘT lần lấy audit log cho mỗi loại hành động.
+
+    Discord gộp các lần một người xóa tin của cùng một người trong cùng kênh vào một mục và chỉ tăng
+    extra.count (created_at giữ nguyên), nên số lần xóa mới được tính bằng độ chênh count so với lần lấy trước.
+    Lần xóa không có mục audit log tương ứng là do chính người gửi tự xóa."""
+
+    def __init__(self, window=AUDIT_WINDOW_SECONDS):
+        self.window = window
+        self._guilds = {}  # guild_id -> _GuildAuditState
+        self.requests = 0
+        self.fetches = 0
+
+    async def message_deleter(self, guild: discord.Guild, channel_id: int, author_id: int):
+        """Người đã xóa một tin của author_id trong channel_id, hoặc None nếu không có mục audit log (tự xóa)."""
+        return await self._request(guild, discord.AuditLogAction.message_delete, (channel_id, author_id))
+
+    async def bulk_deleter(self, guild: discord.Guild, channel_id: int):
+        """Người đã xóa hàng loạt tin nhắn trong channel_id (vd: /clear), hoặc None nếu không tìm thấy."""
+        return await self._request(guild, discord.AuditLogAction.message_bulk_delete, (channel_id,))
+
+    def drop_guild(self, guild_id):
+        if (state := self._guilds.pop(guild_id, None)) is None:
+            return
+        if state.poller:
+            state.poller.cancel()
+        # Poller bị hủy trước khi kịp chạy thì không tự trả kết quả: trả None cho các yêu cầu chưa được lấy
+        pending, state.pending = state.pending, {}
+        for requests in pending.values():
+            for _, future in requests:
+                if not future.done():
+                    future.set_result(None)
+
+    async def _request(self, guild, action, key):
+        self.requests += 1
+        if (state := self._guilds.get(guild.id)) is None:
+            state = self._guilds[guild.id] = _GuildAuditState()
+        future = asyncio.get_running_loop().create_future()
+        state.pending.setdefault(action, []).append((key, future))
+        if state.poller is None or state.poller.done():
+            state.poller = asyncio.create_task(self._poll(guild, state))
+        return await future
+
+    async def _poll(self, guild, state):
+        pending, cancelled = {}, False
+        try:
+            await asyncio.sleep(self.window)
+            pending, state.pending = state.pending, {}
+            for action, requests in pending.items():
+                try:
+                    entries = [entry async for entry in guild.audit_logs(limit=AUDIT_FETCH_LIMIT, action=action)]
+                    self.fetches += 1
+                    credits = self._new_deletions(state, action, entries)
+                except discord.Forbidden:  # Bot không có quyền xem audit log
+                    credits = []
+                except Exception as e:
+                    print(f"Lỗi khi lấy audit log của server {guild.id}: {e}")
+                    credits = []
+
+                for key, future in requests:
+                    user = None
+                    for credit in credits:
+                        if credit[0] == key and credit[2] > 0:
+                            credit[2] -= 1
+                            user = credit[1]
+                            break
+                    if not future.done():
+                        future.set_result(user)
+        except asyncio.CancelledError:
+            # drop_guild hoặc tắt bot: trả None cho cả các yêu cầu tới sau lần hoán đổi
+            cancelled = True
+            pending, state.pending = [pending, state.pending], {}
+            raise
+        finally:
+            # Không để người gọi nào chờ mãi, kể cả khi có lỗi giữa chừng
+            for batch in (pending if cancelled else [pending]):
+                for requests in batch.values():
+                    for _, future in requests:
+                        if not future.done():
+                            future.set_result(None)
+            # Yêu cầu tới trong lúc đang lấy audit log cần một lượt mới
+            if state.pending and not cancelled:
+                state.poller = asyncio.create_task(self._poll(guild, state))
+
+    def _new_deletions(self, state, action, entries):
+        """Trả về [khóa, người xóa, số lần xóa mới] cho các mục có thay đổi kể từ lần lấy trước."""
+        previous = state.seen.get(action, {})
+        fresh_after = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=self.window + AUDIT_FRESH_SECONDS)
+        credits = []
+        for entry in entries:
+            count = getattr(entry.extra, 'count', None) or 1
+            if entry.id in previous:
+                new = count - previous[entry.id]
+            else:
+                new = count if entry.created_at >= fresh_after else 0
+            if new <= 0:
+                continue
+            if action is discord.AuditLogAction.message_bulk_delete:
+                # Mỗi mục là một lần xóa hàng loạt; count là số tin trong lần đó
+                if entry.target is not None:
+                    credits.append([(entry.target.id,), entry.user, 1])
+            elif (channel := getattr(entry.extra, 'channel', None)) is not None and entry.target is not None:
+                credits.append([(channel.id, entry.target.id), entry.user, new])
+        # Chỉ giữ các mục của lần lấy này; mục đã trôi khỏi trang đầu sẽ không còn được gộp thêm
+        state.seen[action] = {entry.id: getattr(entry.extra, 'count', None) or 1 for entry in entries}
+        return credits
+
+
+audit_log = AuditLogAttributor()
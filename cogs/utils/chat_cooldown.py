@@ -0,0 +1,44 @@
+# cogs/utils/chat_cooldown.py
+import time
+
+
+class ChatCooldown:
+    """Token bucket trong bộ nhớ theo (guild_id, user_id), quyết định tin nhắn nào được nhận XP/coin.
+
+    Mỗi người có tối đa `capacity` lượt, mỗi lượt hồi lại sau `refill_seconds` giây. Kiểm tra chỉ là
+    vài phép tính trên dict, không chạm DB."""
+
+    def __init__(self):
+        self._buckets = {}  # (guild_id, user_id) -> [số lượt còn lại, lần cập nhật cuối, thời điểm đầy lại]
+
+    def try_acquire(self, guild_id: int, user_id: int, capacity: int, refill_seconds: float, now: float = None) -> bool:
+        """Lấy một lượt nhận thưởng. Trả về False nếu người dùng đang hết lượt."""
+        if refill_seconds <= 0:
+            return True  # Server đã tắt giới hạn
+        capacity = max(1, capacity)
+        now = time.monotonic() if now is None else now
+        key = (guild_id, user_id)
+        if (bucket := self._buckets.get(key)) is None:
+            tokens = capacity
+        else:
+            tokens = min(capacity, bucket[0] + (now - bucket[1]) / refill_seconds)
+
+        if tokens < 1:
+            bucket[0], bucket[1] = tokens, now
+            return False
+        tokens -= 1
+        self._buckets[key] = [tokens, now, now + (capacity - tokens) * refill_seconds]
+        return True
+
+    def prune(self, now: float = None) -> int:
+        """Bỏ các bucket đã hồi đầy: xóa đi cũng như người đó chưa chat, bộ nhớ không phình theo số người từng chat."""
+        now = time.monotonic() if now is None else now
+        full = [key for key, bucket in self._buckets.items() if bucket[2] <= now]
+        for key in full:
+            del self._buckets[key]
+        return len(full)
+
+    def reset_guild(self, guild_id: int):
+        """Xóa trạng thái của cả server, dùng khi admin đổi cấu hình bucket."""
+        for key in [key for key in self._buckets if key[0] == guild_id]:
+            del self._buckets[key]
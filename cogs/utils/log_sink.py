@@ -0,0 +1,130 @@
+# cogs/utils/log_sink.py
+import asyncio
+import datetime
+import discord
+from .announcer import Announcer, Announcement, ChannelQueue, MAX_EMBEDS_PER_MESSAGE
+
+LOG_WINDOW_SECONDS = 2  # Gửi sau khoảng này, hoặc ngay khi đủ 10 embed
+LOG_QUEUE_LIMIT = 500  # Số embed tối đa chờ gửi của một kênh log; vượt quá thì log mới bị bỏ
+LOG_WEBHOOK_NAME = "Bot Logger"
+
+
+class _LogItem(Announcement):
+    __slots__ = ('pending',)
+
+    def __init__(self, embed, pending=None):
+        super().__init__(None, embed, None)
+        self.pending = pending  # Task hoàn thiện embed (vd: tìm người xóa qua audit log), chờ xong mới gửi
+
+
+class _LogQueue(ChannelQueue):
+    __slots__ = ('full', 'dropped', 'webhook', 'webhook_failed')
+
+    def __init__(self, channel):
+        super().__init__(channel)
+        self.full = asyncio.Event()  # Đủ embed cho một tin nhắn: gửi luôn, không chờ hết cửa sổ
+        self.dropped = 0  # Số log bị bỏ kể từ lần báo gần nhất
+        self.webhook = None
+        self.webhook_failed = False
+
+
+class LogSink(Announcer):
+    """Hàng đợi gửi log theo từng kênh log của Logger, dùng lại cách gom và ngân sách gửi của Announcer.
+
+    log() chỉ xếp embed vào hàng đợi rồi trả về ngay. Mỗi tin nhắn gồm tối đa 10 embed, gửi qua webhook của
+    kênh nếu bot có quyền Quản lý Webhook (không chiếm giới hạn gửi tin của bot), nếu không thì gửi thường.
+    Hàng đợi có giới hạn: khi kênh log không theo kịp (raid, đổi role hàng loạt), log mới bị bỏ và được đếm;
+    tin nhắn kế tiếp kèm một embed cảnh báo số log đã mất."""
+
+    def __init__(self):
+        super().__init__()
+        self.dropped = 0
+        self.sent_messages = 0
+        self.sent_embeds = 0
+
+    def log(self, channel: discord.TextChannel, embed: discord.Embed, finalize=None) -> bool:
+        """Xếp một embed vào hàng đợi của kênh log. Trả về False nếu hàng đợi đã đầy và log bị bỏ.
+
+        `finalize` (coroutine, tùy chọn) được chạy ngay trong nền để sửa embed trước khi gửi; embed vẫn giữ
+        đúng thứ tự trong hàng đợi, người gọi không phải chờ."""
+        if (queue := self._queues.get(channel.id)) is None:
+            queue = self._queues[channel.id] = _LogQueue(channel)
+        if len(queue.items) >= LOG_QUEUE_LIMIT:
+            if finalize is not None:
+                finalize.close()
+            queue.dropped += 1
+            self.dropped += 1
+            return False
+        queue.items.append(_LogItem(embed, asyncio.create_task(finalize) if finalize is not None else None))
+        if len(queue.items) >= MAX_EMBEDS_PER_MESSAGE:
+            queue.full.set()
+        if queue.task is None or queue.task.done():
+            queue.task = asyncio.create_task(self._drain(queue))
+        return True
+
+    async def close(self):
+        """Gửi ngay mọi log còn trong hàng đợi, không chờ hết cửa sổ gom. Gọi khi gỡ Logger (trước khi bot ngắt kết nối)."""
+        tasks = []
+        for queue in self._queues.values():
+            if queue.task is not None and not queue.task.done():
+                queue.full.set()
+                tasks.append(queue.task)
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    @property
+    def queued(self):
+        return sum(len(queue.items) for queue in self._queues.values())
+
+    async def _drain(self, queue: _LogQueue):
+        try:
+            await asyncio.wait_for(queue.full.wait(), LOG_WINDOW_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        while queue.items:
+            queue.full.clear()
+            if queue.dropped:
+                queue.items.insert(0, _LogItem(discord.Embed(
+                    description=f"⚠️ **{queue.dropped:,} mục log đã bị bỏ** vì kênh log không gửi kịp.",
+                    color=discord.Color.red(), timestamp=datetime.datetime.now(datetime.timezone.utc))))
+                queue.dropped = 0
+            batch = self._take_batch(queue)
+            for item in batch:
+                if item.pending is not None:
+                    try:
+                        await item.pending
+                    except Exception as e:
+                        print(f"Lỗi khi hoàn thiện log cho kênh {queue.channel.id}: {e}")
+            await self._wait_for_budget(queue)
+            await self._send_logs(queue, [item.embed for item in batch])
+
+    async def _webhook(self, queue: _LogQueue):
+        if queue.webhook is None and not queue.webhook_failed:
+            try:
+                webhooks = await queue.channel.webhooks()
+                queue.webhook = discord.utils.find(lambda hook: hook.name == LOG_WEBHOOK_NAME and hook.token, webhooks)
+                if queue.webhook is None:
+                    queue.webhook = await queue.channel.create_webhook(name=LOG_WEBHOOK_NAME)
+            except (discord.HTTPException, AttributeError):  # Thiếu quyền, hoặc kênh không hỗ trợ webhook (thread)
+                queue.webhook_failed = True
+        return queue.webhook
+
+    async def _send_logs(self, queue: _LogQueue, embeds: list):
+        channel = queue.channel
+        try:
+            if webhook := await self._webhook(queue):
+                try:
+                    me = channel.guild.me
+                    await webhook.send(embeds=embeds, username=me.display_name, avatar_url=me.display_avatar.url)
+                except discord.NotFound:
+                    # Webhook bị xóa: gửi lô này bằng tin nhắn thường, lần sau tạo lại
+                    queue.webhook = None
+                    await channel.send(embeds=embeds)
+            else:
+                await channel.send(embeds=embeds)
+            self.sent_messages += 1
+            self.sent_embeds += len(embeds)
+        except discord.HTTPException as e:
+            print(f"Lỗi khi gửi log vào kênh {channel.id}: {e}")
+
+
+log_sink = LogSink()
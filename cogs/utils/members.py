@@ -0,0 +1,70 @@
+# cogs/utils/members.py
+import asyncio
+import discord
+
+QUERY_MEMBERS_CHUNK = 100  # Số user_id tối đa mỗi lần query_members (giới hạn của Discord)
+
+
+class MemberResolver:
+    """Tìm Member cho các tác vụ nền: đọc cache của guild trước (Intents.all() giữ cache đầy đủ),
+    chỉ hỏi Discord cho những id bị trượt cache, gộp theo lô bằng query_members.
+
+    Mỗi tác vụ dùng một resolver riêng (xem resolver()) nên bộ đếm cho biết tác vụ nào còn phải gọi Discord."""
+
+    __slots__ = ('name', 'cache_hits', 'remote_lookups', 'not_found')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.cache_hits = 0
+        self.remote_lookups = 0  # Số lần gọi Discord (mỗi lô query_members hoặc mỗi fetch_member tính một lần)
+        self.not_found = 0
+
+    async def get(self, guild: discord.Guild, user_id: int):
+        """Trả về Member hoặc None nếu người đó không còn trong server."""
+        return (await self.get_many(guild, [user_id])).get(user_id)
+
+    async def get_many(self, guild: discord.Guild, user_ids) -> dict:
+        """Trả về dict user_id -> Member cho những người còn trong server."""
+        found, missing = {}, []
+        for user_id in dict.fromkeys(user_ids):
+            if (member := guild.get_member(user_id)) is not None:
+                found[user_id] = member
+            else:
+                missing.append(user_id)
+        self.cache_hits += len(found)
+
+        for start in range(0, len(missing), QUERY_MEMBERS_CHUNK):
+            chunk = missing[start:start + QUERY_MEMBERS_CHUNK]
+            self.remote_lookups += 1
+            try:
+                members = await guild.query_members(user_ids=chunk, limit=len(chunk), cache=True)
+            except (asyncio.TimeoutError, discord.ClientException):
+                # Gateway không trả lời: hỏi lần lượt qua REST
+                members = []
+                for user_id in chunk:
+                    self.remote_lookups += 1
+                    try:
+                        members.append(await guild.fetch_member(user_id))
+                    except discord.NotFound:
+                        pass
+            found.update((member.id, member) for member in members)
+
+        self.not_found += sum(1 for user_id in missing if user_id not in found)
+        return found
+
+    def summary(self) -> str:
+        return f"{self.name}: {self.cache_hits} cache | {self.remote_lookups} gọi Discord | {self.not_found} không tìm thấy"
+
+
+_resolvers = {}  # Tên tác vụ -> MemberResolver
+
+
+def resolver(name: str) -> MemberResolver:
+    """Resolver (kèm bộ đếm) của một tác vụ nền; gọi nhiều lần với cùng tên trả về cùng một đối tượng."""
+    if (member_resolver := _resolvers.get(name)) is None:
+        member_resolver = _resolvers[name] = MemberResolver(name)
+    return member_resolver
+
+
+def all_resolvers():
+    return list(_resolvers.values())
@@ -0,0 +1,120 @@
+# cogs/utils/message_cache.py
+import collections
+import sys
+
+DEFAULT_GUILD_CAPACITY = 1000  # Số tin nhắn giữ lại cho mỗi server nếu chưa cấu hình
+MAX_GUILD_CAPACITY = 20000
+_ENTRY_OVERHEAD = 100  # Ước lượng phần tốn thêm của một mục OrderedDict (node liên kết + khóa int)
+
+
+class CachedMessage:
+    """Bản ghi gọn của một tin nhắn: chỉ id và nội dung, không giữ tham chiếu tới Member/Channel."""
+    __slots__ = ('message_id', 'channel_id', 'author_id', 'content', 'created_at', 'attachment_urls', 'nbytes')
+
+    def __init__(self, message_id, channel_id, author_id, content, created_at, attachment_urls):
+        self.message_id = message_id
+        self.channel_id = channel_id
+        self.author_id = author_id
+        self.content = content
+        self.created_at = created_at
+        self.attachment_urls = attachment_urls
+        self.nbytes = self._measure()
+
+    def _measure(self):
+        return (_ENTRY_OVERHEAD + sys.getsizeof(self) + sys.getsizeof(self.content)
+                + sys.getsizeof(self.attachment_urls) + sum(sys.getsizeof(url) for url in self.attachment_urls))
+
+    def set_content(self, content):
+        self.content = content
+        self.nbytes = self._measure()
+
+
+class GuildMessageCache:
+    """LRU tin nhắn của một server. Thêm, lấy ra và loại bỏ đều O(1) nhờ OrderedDict."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.nbytes = 0
+        self._messages = collections.OrderedDict()  # message_id -> CachedMessage, cũ nhất đứng đầu
+
+    def __len__(self):
+        return len(self._messages)
+
+    def put(self, record: CachedMessage) -> int:
+        """Thêm/thay bản ghi. Trả về số bản ghi cũ bị loại để giữ đúng sức chứa."""
+        if (old := self._messages.pop(record.message_id, None)) is not None:
+            self.nbytes -= old.nbytes
+        self._messages[record.message_id] = record
+        self.nbytes += record.nbytes
+        return self._evict()
+
+    def get(self, message_id):
+        return self._messages.get(message_id)
+
+    def pop(self, message_id):
+        if (record := self._messages.pop(message_id, None)) is not None:
+            self.nbytes -= record.nbytes
+        return record
+
+    def resize(self, capacity) -> int:
+        self.capacity = capacity
+        return self._evict()
+
+    def _evict(self):
+        evicted = 0
+        while len(self._messages) > self.capacity:
+            _, record = self._messages.popitem(last=False)
+            self.nbytes -= record.nbytes
+            evicted += 1
+        return evicted
+
+
+class MessageCache:
+    """Các LRU tin nhắn theo server, kèm bộ đếm hit/miss/loại bỏ cho /logstats."""
+
+    def __init__(self):
+        self._guilds = {}  # guild_id -> GuildMessageCache
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def guild(self, guild_id, capacity=DEFAULT_GUILD_CAPACITY) -> GuildMessageCache:
+        if (cache := self._guilds.get(guild_id)) is None:
+            cache = self._guilds[guild_id] = GuildMessageCache(capacity)
+        return cache
+
+    def put(self, guild_id, record: CachedMessage, capacity=DEFAULT_GUILD_CAPACITY):
+        self.evictions += self.guild(guild_id, capacity).put(record)
+
+    def get(self, guild_id, message_id):
+        cache = self._guilds.get(guild_id)
+        return cache.get(message_id) if cache else None
+
+    def pop(self, guild_id, message_id):
+        """Lấy ra bản ghi của tin nhắn vừa bị xóa; tính vào tỉ lệ hit."""
+        cache = self._guilds.get(guild_id)
+        record = cache.pop(message_id) if cache else None
+        if record is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return record
+
+    def resize(self, guild_id, capacity):
+        if cache := self._guilds.get(guild_id):
+            self.evictions += cache.resize(capacity)
+
+    def drop_guild(self, guild_id):
+        self._guilds.pop(guild_id, None)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    @property
+    def nbytes(self):
+        return sum(cache.nbytes for cache in self._guilds.values())
+
+    def __len__(self):
+        return sum(len(cache) for cache in self._guilds.values())
@@ -0,0 +1,201 @@
+# cogs/utils/message_journal.py
+import asyncio
+import datetime
+import json
+import aiosqlite
+import discord
+from .message_cache import CachedMessage
+
+JOURNAL_GUILD_BYTE_BUDGET = 8 * 1024 * 1024  # Dung lượng tối đa mỗi server được chiếm trong nhật ký
+JOURNAL_TTL_DAYS = 7  # Tin nhắn cũ hơn thì bị xóa khỏi nhật ký
+JOURNAL_FLUSH_SECONDS = 1  # Chu kỳ ghi các tin nhắn đang chờ xuống đĩa
+JOURNAL_FLUSH_MAX_PENDING = 500  # Ghi ngay khi số tin nhắn đang chờ vượt ngưỡng này
+JOURNAL_PRUNE_SECONDS = 3600  # Chu kỳ xóa tin nhắn quá hạn TTL
+
+
+class MessageJournal:
+    """Nhật ký tin nhắn trên đĩa (file SQLite riêng, chế độ WAL) để log xóa/sửa vẫn có nội dung sau khi bot khởi động lại.
+
+    Mỗi server là một vòng đệm theo dung lượng: vượt JOURNAL_GUILD_BYTE_BUDGET thì tin cũ nhất bị xóa trước;
+    tin cũ hơn JOURNAL_TTL_DAYS cũng bị xóa. Vì message_id là snowflake (tăng theo thời gian), "cũ nhất"
+    và "quá hạn" đều là một khoảng message_id trên khóa chính, không cần cột thời gian riêng.
+
+    record() chỉ thêm vào hàng chờ trong bộ nhớ; một task nền ghi theo lô trong một giao dịch, và aiosqlite
+    chạy trên luồng riêng nên event loop không bị chặn."""
+
+    def __init__(self, path, byte_budget=JOURNAL_GUILD_BYTE_BUDGET, ttl_days=JOURNAL_TTL_DAYS):
+        self.path = path
+        self.byte_budget = byte_budget
+        self.ttl = datetime.timedelta(days=ttl_days)
+        self._conn = None
+        self._pending = {}  # message_id -> (guild_id, CachedMessage), chưa ghi xuống đĩa
+        self._flushing = {}  # Lô đang được ghi
+        self._flush_lock = asyncio.Lock()
+        self._guild_bytes = {}  # guild_id -> tổng nbytes đang lưu trên đĩa
+        self._flusher = None
+        self._early_flush = None
+        self._last_prune = 0.0
+
+    async def open(self):
+        self._conn = await aiosqlite.connect(self.path)
+        self._conn.row_factory = aiosqlite.Row
+        await self._conn.execute("PRAGMA journal_mode = WAL")
+        await self._conn.execute("PRAGMA synchronous = NORMAL")
+        await self._conn.execute('''CREATE TABLE IF NOT EXISTS messages (message_id INTEGER PRIMARY KEY, guild_id INTEGER NOT NULL, channel_id INTEGER NOT NULL, author_id INTEGER NOT NULL, content TEXT, attachment_urls TEXT, created_at TEXT, nbytes INTEGER NOT NULL)''')
+        await self._conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_guild ON messages (guild_id, message_id)")
+        await self._conn.commit()
+        async with self._conn.execute("SELECT guild_id, SUM(nbytes) AS total FROM messages GROUP BY guild_id") as cursor:
+            self._guild_bytes = {row['guild_id']: row['total'] for row in await cursor.fetchall()}
+        await self.prune_expired()
+        self._flusher = asyncio.create_task(self._run())
+        print(f"[Logger] Đã mở nhật ký tin nhắn '{self.path}' ({sum(self._guild_bytes.values()) / 1024:,.0f} KiB).")
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        if self._conn is not None:
+            await self.flush()
+            await self._conn.close()
+            self._conn = None
+
+    def guild_nbytes(self, guild_id):
+        return self._guild_bytes.get(guild_id, 0)
+
+    def record(self, guild_id, record: CachedMessage):
+        """Đưa tin nhắn vào hàng chờ ghi. Không I/O."""
+        self._pending[record.message_id] = (guild_id, record)
+        if (len(self._pending) >= JOURNAL_FLUSH_MAX_PENDING and self._flusher is not None
+                and (self._early_flush is None or self._early_flush.done())):
+            self._early_flush = asyncio.create_task(self.flush())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(JOURNAL_FLUSH_SECONDS)
+            try:
+                await self.flush()
+                if loop.time() - self._last_prune >= JOURNAL_PRUNE_SECONDS:
+                    await self.prune_expired()
+            except Exception as e:
+                print(f"[CRITICAL TASK ERROR] Lỗi khi ghi nhật ký tin nhắn: {e}")
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending or self._conn is None:
+                return
+            # Lô đang ghi vẫn đọc được qua get() cho tới khi đã nằm trên đĩa
+            self._flushing, self._pending = self._pending, {}
+            try:
+                await self._write(list(self._flushing.values()))
+            finally:
+                self._flushing = {}
+
+    async def _write(self, batch):
+        replaced = []
+        for start in range(0, len(batch), JOURNAL_FLUSH_MAX_PENDING):
+            ids = [record.message_id for _, record in batch[start:start + JOURNAL_FLUSH_MAX_PENDING]]
+            # Tin đã sửa ghi đè bản cũ trên đĩa: cần nbytes cũ để trừ khỏi dung lượng của server
+            async with self._conn.execute(f"SELECT guild_id, nbytes FROM messages WHERE message_id IN ({', '.join('?' * len(ids))})", ids) as cursor:
+                replaced.extend(await cursor.fetchall())
+        await self._conn.executemany("INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?)", [
+            (record.message_id, guild_id, record.channel_id, record.author_id, record.content,
+             json.dumps(record.attachment_urls) if record.attachment_urls else None,
+             record.created_at.isoformat() if record.created_at else None, record.nbytes)
+            for guild_id, record in batch])
+        await self._conn.commit()
+
+        for row in replaced:
+            self._guild_bytes[row['guild_id']] -= row['nbytes']
+        for guild_id, record in batch:
+            self._guild_bytes[guild_id] = self._guild_bytes.get(guild_id, 0) + record.nbytes
+        for guild_id in {guild_id for guild_id, _ in batch}:
+            if self._guild_bytes[guild_id] > self.byte_budget:
+                await self._evict_oldest(guild_id)
+
+    async def _evict_oldest(self, guild_id):
+        """Xóa tin cũ nhất của server cho tới khi dưới 90% dung lượng (chừa chỗ để không phải xóa sau mỗi lô)."""
+        to_free = self._guild_bytes[guild_id] - int(self.byte_budget * 0.9)
+        cutoff, freed = None, 0
+        async with self._conn.execute("SELECT message_id, nbytes FROM messages WHERE guild_id = ? ORDER BY message_id", (guild_id,)) as cursor:
+            async for row in cursor:
+                cutoff, freed = row['message_id'], freed + row['nbytes']
+                if freed >= to_free:
+                    break
+        if cutoff is not None:
+            await self._conn.execute("DELETE FROM messages WHERE guild_id = ? AND message_id <= ?", (guild_id, cutoff))
+            await self._conn.commit()
+            self._guild_bytes[guild_id] -= freed
+
+    async def prune_expired(self):
+        """Xóa mọi tin nhắn cũ hơn TTL. Trả về số tin đã xóa."""
+        self._last_prune = asyncio.get_running_loop().time()
+        cutoff = discord.utils.time_snowflake(datetime.datetime.now(datetime.timezone.utc) - self.ttl)
+        async with self._flush_lock:
+            async with self._conn.execute("DELETE FROM messages WHERE message_id < ? RETURNING guild_id, nbytes", (cutoff,)) as cursor:
+                deleted = await cursor.fetchall()
+            await self._conn.commit()
+        for row in deleted:
+            self._guild_bytes[row['guild_id']] -= row['nbytes']
+        return len(deleted)
+
+    async def get(self, message_id):
+        """Bản ghi của tin nhắn (kể cả khi còn trong hàng chờ), hoặc None."""
+        if pending := self._pending.get(message_id) or self._flushing.get(message_id):
+            return pending[1]
+        if self._conn is None:
+            return None
+        async with self._conn.execute("SELECT * FROM messages WHERE message_id = ?", (message_id,)) as cursor:
+            row = await cursor.fetchone()
+        return self._from_row(row) if row is not None else None
+
+    @staticmethod
+    def _from_row(row):
+        return CachedMessage(row['message_id'], row['channel_id'], row['author_id'], row['content'],
+                             datetime.datetime.fromisoformat(row['created_at']) if row['created_at'] else None,
+                             tuple(json.loads(row['attachment_urls'])) if row['attachment_urls'] else ())
+
+    async def pop(self, message_id):
+        """Lấy bản ghi của tin nhắn vừa bị xóa rồi bỏ nó khỏi nhật ký."""
+        record = await self.get(message_id)
+        self._pending.pop(message_id, None)
+        if record is not None and self._conn is not None:
+            # Vẫn xóa trên đĩa khi bản ghi lấy từ hàng chờ: tin đã sửa có thể có cả bản cũ đã ghi
+            async with self._flush_lock:
+                async with self._conn.execute("DELETE FROM messages WHERE message_id = ? RETURNING guild_id, nbytes", (message_id,)) as cursor:
+                    deleted = await cursor.fetchall()
+                await self._conn.commit()
+            for row in deleted:
+                self._guild_bytes[row['guild_id']] -= row['nbytes']
+        return record
+
+    async def pop_many(self, message_ids) -> dict:
+        """Như pop() cho một lần xóa hàng loạt: một câu DELETE cho mỗi lô, trả về dict message_id -> bản ghi."""
+        records = {}
+        for message_id in message_ids:
+            if pending := self._pending.pop(message_id, None) or self._flushing.get(message_id):
+                records[message_id] = pending[1]
+        if self._conn is None:
+            return records
+        message_ids = list(message_ids)
+        async with self._flush_lock:
+            for start in range(0, len(message_ids), JOURNAL_FLUSH_MAX_PENDING):
+                chunk = message_ids[start:start + JOURNAL_FLUSH_MAX_PENDING]
+                async with self._conn.execute(f"DELETE FROM messages WHERE message_id IN ({', '.join('?' * len(chunk))}) RETURNING *", chunk) as cursor:
+                    deleted = await cursor.fetchall()
+                for row in deleted:
+                    self._guild_bytes[row['guild_id']] -= row['nbytes']
+                    records.setdefault(row['message_id'], self._from_row(row))
+            await self._conn.commit()
+        return records
+
+    async def update_content(self, guild_id, message_id, content):
+        """Cập nhật nội dung sau khi tin nhắn được sửa."""
+        record = await self.get(message_id)
+        if record is not None:
+            record.set_content(content)
+            self.record(guild_id, record)
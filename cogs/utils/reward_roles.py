@@ -0,0 +1,84 @@
+# cogs/utils/reward_roles.py
+import bisect
+import discord
+import database as db
+
+
+class RewardProfile:
+    """Bộ hệ số thưởng áp dụng cho một thành viên, tùy theo role đặc biệt họ đang có."""
+    __slots__ = ('tier', 'xp_multiplier', 'chat_coin_range', 'has_bonus_chance', 'daily_range')
+
+    def __init__(self, tier, xp_multiplier, chat_coin_range, has_bonus_chance, daily_range):
+        self.tier = tier
+        self.xp_multiplier = xp_multiplier
+        self.chat_coin_range = chat_coin_range
+        self.has_bonus_chance = has_bonus_chance
+        self.daily_range = daily_range
+
+
+DEFAULT_PROFILE = RewardProfile(None, 1.0, (1, 5), False, (500, 1500))
+VIP_PROFILE = RewardProfile('vip', 1.10, (2, 6), False, (600, 1600))
+LUCK_PROFILE = RewardProfile('luck', 1.25, (3, 8), True, (700, 1800))
+
+# Các cột cấu hình mà khi đổi thì chỉ mục role của server phải dựng lại
+REWARD_ROLE_CONFIG_KEYS = {'luck_role_id', 'vip_role_id', 'debtor_role_id'}
+
+
+class GuildRewardRoles:
+    """Các role thưởng/phạt của một server, dựng sẵn để mỗi lần kiểm tra chỉ là tra set/bisect."""
+    __slots__ = ('luck_role_id', 'vip_role_id', 'debtor_role_id', '_levels', '_level_role_ids', 'level_role_ids')
+
+    def __init__(self, config: dict, level_roles: dict):
+        self.luck_role_id = config.get('luck_role_id')
+        self.vip_role_id = config.get('vip_role_id')
+        self.debtor_role_id = config.get('debtor_role_id')
+        milestones = sorted(level_roles.items())
+        self._levels = [level for level, _ in milestones]
+        self._level_role_ids = [role_id for _, role_id in milestones]
+        self.level_role_ids = frozenset(self._level_role_ids)
+
+    @staticmethod
+    def _has(member: discord.Member, role_id):
+        # Member.get_role tra trên danh sách id role đã sắp xếp của member, không duyệt member.roles
+        return role_id is not None and member.get_role(role_id) is not None
+
+    def profile_for(self, member: discord.Member) -> RewardProfile:
+        if self._has(member, self.luck_role_id):
+            return LUCK_PROFILE
+        if self._has(member, self.vip_role_id):
+            return VIP_PROFILE
+        return DEFAULT_PROFILE
+
+    def is_debtor(self, member: discord.Member) -> bool:
+        return self._has(member, self.debtor_role_id)
+
+    def level_role_for(self, level: int):
+        """role_id của mốc level cao nhất mà `level` đã đạt, hoặc None."""
+        i = bisect.bisect_right(self._levels, level)
+        return self._level_role_ids[i - 1] if i else None
+
+
+class RewardRoleIndex:
+    """Cache GuildRewardRoles theo server. Tự xóa khi cấu hình role đổi (config listener);
+    khi role-level đổi hoặc role bị xóa thì cog gọi invalidate()."""
+
+    def __init__(self):
+        self._guilds = {}
+
+    async def get(self, guild_id: int) -> GuildRewardRoles:
+        if (roles := self._guilds.get(guild_id)) is None:
+            config = await db.get_or_create_config(guild_id)
+            level_roles = await db.get_level_roles(guild_id)
+            roles = self._guilds[guild_id] = GuildRewardRoles(config, level_roles)
+        return roles
+
+    def invalidate(self, guild_id: int):
+        self._guilds.pop(guild_id, None)
+
+    def on_config_change(self, guild_id, key, value):
+        if key in REWARD_ROLE_CONFIG_KEYS:
+            self.invalidate(guild_id)
+
+
+reward_roles = RewardRoleIndex()
+db.add_config_listener(reward_roles.on_config_change)
@@ -0,0 +1,140 @@
+# cogs/utils/scheduler.py
+import asyncio
+import datetime
+import heapq
+import itertools
+import time
+
+TIMER_RETRY_SECONDS = 60  # Handler lỗi thì thử lại sau khoảng này
+
+
+class TimerScheduler:
+    """Bộ hẹn giờ dùng chung cho mọi việc "đến hạn thì làm": role tạm thời, hiệu ứng, khoản vay, đấu giá.
+
+    Hạn của từng việc được giữ trong một min-heap theo (kind, key). Task nền ngủ đúng tới hạn gần nhất
+    rồi gọi handler của kind đó - không quét bảng định kỳ. Đặt lại hạn cho một key chỉ cần schedule()
+    lần nữa; mục cũ trong heap bị bỏ qua lúc lấy ra (xóa lười, như ActiveEffects).
+    Handler theo lô (batch=True) nhận cùng lúc mọi key cùng loại đã đến hạn, để gom các lần gọi Discord.
+    database.py nạp toàn bộ hạn từ DB khi khởi động nên việc đã quá hạn lúc bot tắt sẽ chạy bù ngay."""
+
+    def __init__(self):
+        self._due = {}  # (kind, key) -> thời điểm đến hạn (POSIX timestamp)
+        self._heap = []  # (thời điểm, số thứ tự, kind, key)
+        self._counter = itertools.count()
+        self._handlers = {}  # kind -> coroutine handler(key), hoặc handler(keys) với loại trong _batch_kinds
+        self._batch_kinds = set()
+        self._parked = {}  # kind -> các mục đã đến hạn nhưng loại đó chưa có handler
+        self._wakeup = asyncio.Event()
+        self._runner = None
+
+    def __len__(self):
+        return len(self._due)
+
+    @staticmethod
+    def _timestamp(due):
+        if isinstance(due, str):
+            due = datetime.datetime.fromisoformat(due)
+        if isinstance(due, datetime.datetime):
+            if due.tzinfo is None:
+                due = due.replace(tzinfo=datetime.timezone.utc)
+            return due.timestamp()
+        return float(due)
+
+    def schedule(self, kind: str, key, due):
+        """Hẹn (hoặc dời) việc `key` thuộc loại `kind` vào thời điểm `due` (chuỗi ISO, datetime hoặc timestamp)."""
+        due = self._timestamp(due)
+        self._due[(kind, key)] = due
+        heapq.heappush(self._heap, (due, next(self._counter), kind, key))
+        if self._heap[0][0] == due:
+            # Việc mới sớm hơn việc task nền đang chờ: đánh thức để tính lại thời gian ngủ
+            self._wakeup.set()
+
+    def cancel(self, kind: str, key):
+        self._due.pop((kind, key), None)
+
+    def clear(self):
+        self._due.clear()
+        self._heap.clear()
+        self._parked.clear()
+
+    def add_handler(self, kind: str, handler, *, batch=False):
+        """Đăng ký coroutine handler(key) cho một loại việc. Việc đến hạn khi chưa có handler sẽ chờ tới khi có.
+
+        Với batch=True, handler(keys) nhận danh sách key đến hạn cùng lúc và trả về các key xử lý lỗi
+        (được thử lại như handler thường); handler ném lỗi thì cả lô được thử lại."""
+        self._handlers[kind] = handler
+        if batch:
+            self._batch_kinds.add(kind)
+        else:
+            self._batch_kinds.discard(kind)
+        for entry in self._parked.pop(kind, ()):
+            heapq.heappush(self._heap, entry)
+        self._wakeup.set()
+
+    def remove_handler(self, kind: str, handler):
+        if self._handlers.get(kind) is handler:
+            del self._handlers[kind]
+            self._batch_kinds.discard(kind)
+
+    def start(self):
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._runner is not None:
+            self._runner.cancel()
+            self._runner = None
+
+    def _pop_due(self, now):
+        """Lấy các việc đã đến hạn và có handler, theo thứ tự hạn. Việc chưa có handler được cất riêng."""
+        ready = []
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            due, _, kind, key = entry
+            if self._due.get((kind, key)) != due:
+                continue  # Mục cũ đã bị dời hạn hoặc hủy
+            if kind in self._handlers:
+                del self._due[(kind, key)]
+                ready.append((kind, key))
+            else:
+                self._parked.setdefault(kind, []).append(entry)
+        return ready
+
+    def _retry(self, kind, key):
+        if (kind, key) not in self._due:
+            self.schedule(kind, key, time.time() + TIMER_RETRY_SECONDS)
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            ready = self._pop_due(time.time())
+            batches = {}
+            for kind, key in ready:
+                if kind in self._batch_kinds:
+                    batches.setdefault(kind, []).append(key)
+                    continue
+                try:
+                    await self._handlers[kind](key)
+                except Exception as e:
+                    print(f"[CRITICAL TASK ERROR] Lỗi khi xử lý việc hẹn giờ {kind} {key}: {e}")
+                    self._retry(kind, key)
+            for kind, keys in batches.items():
+                try:
+                    failed = await self._handlers[kind](keys) or ()
+                except Exception as e:
+                    print(f"[CRITICAL TASK ERROR] Lỗi khi xử lý {len(keys)} việc hẹn giờ {kind}: {e}")
+                    failed = keys
+                for key in failed:
+                    self._retry(kind, key)
+            if ready:
+                continue
+
+            # Ngủ tới hạn gần nhất hoặc tới khi có việc sớm hơn / handler mới được thêm vào
+            timeout = max(0.0, self._heap[0][0] - time.time()) if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+scheduler = TimerScheduler()
@@ -0,0 +1,26 @@
+# cogs/utils/xp_curve.py
+import bisect
+
+MAX_LEVEL = 1000  # Cấp tối đa có trong bảng tra; XP vượt quá vẫn được cộng dồn ở cấp này
+
+
+def xp_needed(level: int) -> int:
+    """Lượng XP cần để đi từ `level` lên `level + 1`."""
+    return 5 * (level ** 2) + 50 * level + 100
+
+
+# _CUMULATIVE_XP[i] = tổng XP cần để đi từ level 1 lên level i + 1
+_CUMULATIVE_XP = [0]
+for _level in range(1, MAX_LEVEL):
+    _CUMULATIVE_XP.append(_CUMULATIVE_XP[-1] + xp_needed(_level))
+
+
+def resolve_level(level: int, xp: float) -> tuple[int, float]:
+    """Quy đổi (level, XP trong level) sau khi cộng XP về đúng cấp, kể cả khi nhảy nhiều cấp một lúc.
+    Trả về (level mới, XP thừa mang sang level mới)."""
+    if level >= MAX_LEVEL:
+        return level, xp
+    total_xp = _CUMULATIVE_XP[level - 1] + xp
+    # Không bao giờ hạ cấp, kể cả khi XP bị trừ
+    new_level = max(level, min(bisect.bisect_right(_CUMULATIVE_XP, total_xp), MAX_LEVEL))
+    return new_level, total_xp - _CUMULATIVE_XP[new_level - 1]
@@ -1,15 +1,28 @@
 # database.py
 import aiosqlite
 import sqlite3  # Vẫn giữ lại để dùng cho các hàm khởi tạo đồng bộ
+import asyncio
+import bisect
+import contextlib
 import datetime
+import itertools
+import json
+import random
 
-DB_NAME = 'bot_data.db'
+from cogs.utils import xp_curve
+from cogs.utils.scheduler import scheduler
 
+DB_NAME = 'bot_data.db'
+DB_POOL_SIZE = 4  # Số kết nối chỉ-đọc mặc định trong pool
+CHAT_FLUSH_INTERVAL_SECONDS = 10  # Chu kỳ ghi bộ đệm XP/coin từ chat xuống DB
+CHAT_FLUSH_MAX_PENDING = 200  # Ghi ngay khi số người đang chờ ghi vượt ngưỡng này
+DAILY_QUEST_COUNT = 8  # Số nhiệm vụ hằng ngày của mỗi người
+QUEST_DAY_START_HOUR_UTC = 1  # Ngày nhiệm vụ bắt đầu lúc 01:00 UTC (8:00 sáng giờ Việt Nam)
 
-def run_migrations(cursor):
-    """Kiểm tra và nâng cấp cấu trúc DB một cách an toàn. (Hàm này vẫn chạy đồng bộ lúc khởi tạo)"""
-    print("Bắt đầu kiểm tra và di trú cơ sở dữ liệu...")
 
+def upgrade_legacy_columns(cursor):
+    """Nâng cấp cấu trúc của các DB được tạo từ trước khi có bảng schema_version.
+    Chỉ chạy một lần trong migration số 1; với DB mới tạo thì mọi nhánh đều bỏ qua."""
     # --- Migration cho bảng 'users' ---
     user_columns = [info[1] for info in cursor.execute(
         "PRAGMA table_info(users)").fetchall()]
@@ -92,14 +105,14 @@ def run_migrations(cursor):
         print(" > Migration: Đang thêm cột 'log_channel_id' vào bảng server_configs...")
         cursor.execute(
             "ALTER TABLE server_configs ADD COLUMN log_channel_id INTEGER")
-    print("   ✅ Migration cho 'log_channel_id' hoàn tất!")
+        print("   ✅ Migration cho 'log_channel_id' hoàn tất!")
 
     if 'main_chat_channel_id' not in config_columns:
         print(
             " > Migration: Đang thêm cột 'main_chat_channel_id' vào bảng server_configs...")
         cursor.execute(
             "ALTER TABLE server_configs ADD COLUMN main_chat_channel_id INTEGER")
-    print("   ✅ Migration cho 'main_chat_channel_id' hoàn tất!")
+        print("   ✅ Migration cho 'main_chat_channel_id' hoàn tất!")
 
     # --- Migration cho bảng 'auctions' ---
     try:
@@ -141,12 +154,9 @@ def run_migrations(cursor):
     except sqlite3.OperationalError:
         pass
 
-    cursor.connection.commit()
-    print("Di trú cơ sở dữ liệu hoàn tất.")
-
 
-def populate_initial_quests():
-    """Thêm các nhiệm vụ mẫu vào DB nếu chưa có. (Hàm này vẫn chạy đồng bộ lúc khởi tạo)"""
+def populate_initial_quests(cursor):
+    """Thêm các nhiệm vụ mẫu vào DB nếu chưa có."""
     quests_data = [
         ('daily_chat_25', 'Người Mới', 'Gửi 25 tin nhắn trong ngày.',
          'CHAT', 25, 250, 50, 'DAILY'),
@@ -193,18 +203,14 @@ def populate_initial_quests():
         ('daily_blackjack_win_3', 'Tay Chơi Lão Làng',
          'Thắng 3 ván Blackjack.', 'BLACKJACK_WIN', 3, 2000, 400, 'DAILY'),
     ]
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
     cursor.executemany(
         "INSERT OR IGNORE INTO quests VALUES (?, ?, ?, ?, ?, ?, ?, ?)", quests_data)
-    conn.commit()
-    conn.close()
     print(
         f" > Đã kiểm tra và thêm/cập nhật {len(quests_data)} nhiệm vụ mẫu vào database.")
 
 
-def populate_initial_achievements():
-    """Cập nhật các thành tựu. (Hàm này vẫn chạy đồng bộ lúc khởi tạo)"""
+def populate_initial_achievements(cursor):
+    """Cập nhật các thành tựu."""
     achievements_data_with_emoji = {
         'chat_master': ('Bậc Thầy Tán Gẫu', 'Gửi 1,000,000 tin nhắn.', 'CHAT', 1000000, 50000, 5000, '💬'),
         'rps_king': ('Vua Oẳn Tù Tì', 'Thắng 1000 trận Oẳn Tù Tì.', 'RPS_WIN', 1000, 40000, 5000, '✌️'),
@@ -215,22 +221,15 @@ def populate_initial_achievements():
         'debt_is_a_tool': ('Vay Nợ Là Một Công Cụ', 'Thực hiện 500 lần vay tiền.', 'LOAN_TAKEN', 500, 50000, 5000, '💸'),
         'blackjack_master': ('Thần Bài Xì Dách', 'Thắng 1000 ván Blackjack.', 'BLACKJACK_WIN', 1000, 80000, 10000, '🃏'),
     }
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
     for ach_id, data in achievements_data_with_emoji.items():
         cursor.execute(
             "INSERT OR REPLACE INTO achievements VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (ach_id,) + data)
-    conn.commit()
-    conn.close()
     print(
         f" > Đã kiểm tra và cập nhật emoji cho {len(achievements_data_with_emoji)} thành tựu.")
 
 
-def init_db():
-    """Hàm khởi tạo database, chỉ chạy 1 lần khi bot khởi động. (Vẫn dùng sqlite3 đồng bộ)"""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-
+def create_base_tables(cursor):
+    """Tạo tất cả các bảng nếu chưa có."""
     cursor.execute('''CREATE TABLE IF NOT EXISTS users (user_id INTEGER NOT NULL, guild_id INTEGER NOT NULL, xp REAL DEFAULT 0, level INTEGER DEFAULT 1, coins INTEGER DEFAULT 0 NOT NULL, daily_timestamp TEXT, PRIMARY KEY (user_id, guild_id))''')
     cursor.execute('''CREATE TABLE IF NOT EXISTS warnings (warning_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, guild_id INTEGER NOT NULL, moderator_id INTEGER NOT NULL, reason TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
     cursor.execute('''CREATE TABLE IF NOT EXISTS server_configs (guild_id INTEGER PRIMARY KEY, welcome_channel_id INTEGER, goodbye_channel_id INTEGER, announcement_channel_id INTEGER, command_channel_id INTEGER, muted_role_id INTEGER, luck_role_id INTEGER, top_role_id INTEGER, vip_role_id INTEGER, debtor_role_id INTEGER, create_vc_channel_id INTEGER, log_channel_id INTEGER, main_chat_channel_id INTEGER)''')
@@ -252,19 +251,605 @@ def init_db():
     cursor.execute('''CREATE TABLE IF NOT EXISTS pinned_messages (pin_id INTEGER PRIMARY KEY AUTOINCREMENT, guild_id INTEGER NOT NULL, channel_id INTEGER NOT NULL, author_id INTEGER NOT NULL, message_content TEXT, embed_data TEXT, last_message_id INTEGER)''')
     cursor.execute('''CREATE TABLE IF NOT EXISTS temp_voice_channels (guild_id INTEGER NOT NULL, creator_id INTEGER NOT NULL, channel_id INTEGER PRIMARY KEY)''')
     cursor.execute('''CREATE TABLE IF NOT EXISTS qotd (question_id INTEGER PRIMARY KEY AUTOINCREMENT, question_text TEXT NOT NULL, is_used INTEGER DEFAULT 0)''')
-    run_migrations(cursor)
-    populate_initial_quests()
-    populate_initial_achievements()
 
-    conn.commit()
-    conn.close()
-    print("Database đã được khởi tạo và kiểm tra.")
+
+# --- DANH SÁCH MIGRATION THEO PHIÊN BẢN ---
+# Mỗi migration là (số phiên bản, mô tả, hàm nhận cursor). Chỉ được THÊM vào cuối danh sách,
+# không sửa các migration đã phát hành: DB đã chạy qua phiên bản nào sẽ không chạy lại phiên bản đó.
+
+def _migration_001_base_schema(cursor):
+    create_base_tables(cursor)
+    upgrade_legacy_columns(cursor)
+
+
+def _migration_002_seed_catalog(cursor):
+    populate_initial_quests(cursor)
+    populate_initial_achievements(cursor)
+
+
+def _migration_003_hot_path_indexes(cursor):
+    # Ghim tin nhắn: on_message tra theo channel_id, lệnh danh sách tra theo guild_id
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pinned_messages_channel ON pinned_messages (channel_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pinned_messages_guild ON pinned_messages (guild_id)")
+    # Quét hết hạn mỗi phút
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_temporary_roles_expiry ON temporary_roles (expiry_timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_active_effects_expiry ON active_effects (expiry_timestamp)")
+    # Chỉ index các phiên đấu giá còn mở (partial index), phiên đã kết thúc không chiếm chỗ
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_auctions_active ON auctions (end_timestamp) WHERE is_active = 1")
+    # Bảng xếp hạng: index bao phủ đúng thứ tự ORDER BY, không cần sắp xếp lại hay đọc bảng gốc
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_leaderboard ON users (guild_id, level DESC, xp DESC, user_id, coins)")
+    # get_partner tìm theo cả user1_id (khóa chính) lẫn user2_id
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_relationships_user2 ON relationships (guild_id, user2_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_warnings_user ON warnings (user_id, guild_id, timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_quests_frequency ON quests (frequency)")
+
+
+def _migration_004_achievement_type_index(cursor):
+    # update_achievement_progress tạo dòng thành tựu lười theo loại thành tựu
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_achievements_type ON achievements (achievement_type)")
+
+
+def _migration_005_compact_user_achievements(cursor):
+    # Dòng thành tựu giờ chỉ được tạo khi có tiến trình: bỏ các dòng 0 tiến trình được gán sẵn trước đây
+    cursor.execute("DELETE FROM user_achievements WHERE progress = 0 AND unlocked_timestamp IS NULL")
+    print(f"   Đã dọn {cursor.rowcount} dòng thành tựu chưa có tiến trình.")
+
+
+def _migration_006_chat_xp_cooldown(cursor):
+    # Token bucket giới hạn tin nhắn được nhận XP/coin khi chat, theo từng server. Mặc định: được thưởng
+    # liên tiếp tối đa 3 tin, sau đó hồi 1 lượt mỗi 20 giây (đặt số giây = 0 để tắt giới hạn)
+    cursor.execute("ALTER TABLE server_configs ADD COLUMN chat_xp_bucket_capacity INTEGER NOT NULL DEFAULT 3")
+    cursor.execute("ALTER TABLE server_configs ADD COLUMN chat_xp_refill_seconds INTEGER NOT NULL DEFAULT 20")
+
+
+def _migration_007_lazy_daily_quests(cursor):
+    # Nhiệm vụ hằng ngày được suy ra khi cần, dòng user_quests chỉ được tạo khi có tiến trình đầu tiên.
+    # Nhận thưởng giờ đánh dấu is_claimed thay vì xóa dòng (xóa đi thì nhiệm vụ sẽ hiện lại từ đầu)
+    cursor.execute("ALTER TABLE user_quests ADD COLUMN is_claimed INTEGER NOT NULL DEFAULT 0")
+    # Dọn dòng của các ngày cũ
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_quests_assigned_date ON user_quests (assigned_date)")
+
+
+def _migration_008_message_cache_size(cursor):
+    # Số tin nhắn Logger giữ trong bộ nhớ cho mỗi server để hiện lại nội dung khi bị xóa
+    cursor.execute("ALTER TABLE server_configs ADD COLUMN message_cache_size INTEGER NOT NULL DEFAULT 1000")
+
+
+def _migration_009_loan_due_date_index(cursor):
+    # Lượt quét dự phòng định kỳ tìm các khoản nợ đã quá hạn
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_loans_due_date ON loans (due_date)")
+
+
+MIGRATIONS = [
+    (1, "Tạo các bảng cơ bản và nâng cấp cấu trúc cũ", _migration_001_base_schema),
+    (2, "Thêm nhiệm vụ và thành tựu mẫu", _migration_002_seed_catalog),
+    (3, "Thêm index cho các truy vấn nóng", _migration_003_hot_path_indexes),
+    (4, "Thêm index theo loại thành tựu", _migration_004_achievement_type_index),
+    (5, "Dọn các dòng thành tựu chưa có tiến trình", _migration_005_compact_user_achievements),
+    (6, "Thêm cấu hình giới hạn nhận thưởng khi chat", _migration_006_chat_xp_cooldown),
+    (7, "Chuyển nhiệm vụ hằng ngày sang giao lười", _migration_007_lazy_daily_quests),
+    (8, "Thêm cấu hình sức chứa cache tin nhắn của Logger", _migration_008_message_cache_size),
+    (9, "Thêm index theo hạn trả nợ", _migration_009_loan_due_date_index),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def init_db():
+    """Đưa database lên phiên bản schema mới nhất. (Vẫn dùng sqlite3 đồng bộ, chạy 1 lần trong setup_hook)
+
+    Với DB đã ở phiên bản mới nhất, hàm chỉ đọc một số nguyên trong bảng schema_version.
+    Các migration còn thiếu được chạy theo thứ tự trong CÙNG một giao dịch: lỗi ở bất kỳ bước nào
+    sẽ rollback toàn bộ, DB giữ nguyên phiên bản cũ."""
+    # isolation_level=None để tự quản lý BEGIN/COMMIT, nhờ đó cả các lệnh DDL cũng nằm trong giao dịch
+    conn = sqlite3.connect(DB_NAME, isolation_level=None)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+        row = cursor.execute("SELECT MAX(version) FROM schema_version").fetchone()
+        current_version = row[0] or 0
+
+        if current_version >= SCHEMA_VERSION:
+            print(f"Database đã ở phiên bản mới nhất (v{current_version}).")
+            return
+
+        print(f"Bắt đầu di trú cơ sở dữ liệu từ v{current_version} lên v{SCHEMA_VERSION}...")
+        cursor.execute("BEGIN")
+        try:
+            for version, description, migrate in MIGRATIONS:
+                if version <= current_version:
+                    continue
+                print(f" > Migration {version:03d}: {description}")
+                migrate(cursor)
+            cursor.execute("DELETE FROM schema_version")
+            cursor.execute("INSERT INTO schema_version (version) VALUES (?)", (SCHEMA_VERSION,))
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        print(f"Di trú cơ sở dữ liệu hoàn tất (v{SCHEMA_VERSION}).")
+    finally:
+        conn.close()
+
+
+# --- POOL KẾT NỐI DÙNG CHUNG ---
+
+class ConnectionPool:
+    """Giữ sẵn các kết nối aiosqlite sống suốt vòng đời bot.
+
+    - 1 kết nối ghi duy nhất, được khóa bằng asyncio.Lock để các giao dịch ghi không chen nhau.
+      Khi thoát khối `writer()` sẽ tự commit (hoặc rollback nếu có lỗi).
+    - `size` kết nối chỉ-đọc xoay vòng qua một hàng đợi. Chế độ WAL cho phép đọc song song với ghi.
+    """
+
+    def __init__(self, db_name=DB_NAME, size=DB_POOL_SIZE):
+        self.db_name = db_name
+        self.size = max(1, size)
+        self._writer = None
+        self._write_lock = asyncio.Lock()
+        self._readers = asyncio.Queue()
+        self._all_readers = []
+        self._on_commit = []  # Callback chỉ chạy khi giao dịch ghi hiện tại commit thành công
+
+    async def _connect(self):
+        conn = await aiosqlite.connect(self.db_name)
+        conn.row_factory = aiosqlite.Row
+        await conn.execute("PRAGMA journal_mode=WAL")
+        await conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    async def open(self):
+        self._writer = await self._connect()
+        for _ in range(self.size):
+            conn = await self._connect()
+            self._all_readers.append(conn)
+            self._readers.put_nowait(conn)
+        print(f"[DB] Đã mở pool kết nối: 1 ghi + {self.size} đọc.")
+
+    async def close(self):
+        # Chờ giao dịch ghi đang chạy (nếu có) kết thúc rồi mới đóng
+        async with self._write_lock:
+            if self._writer is not None:
+                await self._writer.close()
+                self._writer = None
+        for conn in self._all_readers:
+            await conn.close()
+        self._all_readers.clear()
+        self._readers = asyncio.Queue()
+        print("[DB] Đã đóng pool kết nối.")
+
+    @contextlib.asynccontextmanager
+    async def reader(self):
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    @contextlib.asynccontextmanager
+    async def writer(self):
+        async with self._write_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                self._on_commit.clear()
+                await self._writer.rollback()
+                raise
+            else:
+                await self._writer.commit()
+                callbacks, self._on_commit = self._on_commit, []
+                for callback in callbacks:
+                    callback()
+
+    def on_commit(self, callback):
+        """Đăng ký callback (hàm đồng bộ, không tham số) chạy sau khi giao dịch ghi đang mở commit.
+        Chỉ gọi bên trong khối `writer()`; nếu giao dịch rollback thì callback bị bỏ."""
+        self._on_commit.append(callback)
+
+
+_pool = None
+
+
+async def init_pool(size=DB_POOL_SIZE):
+    """Mở pool kết nối. Gọi một lần trong setup_hook của bot."""
+    global _pool
+    if _pool is None:
+        _pool = ConnectionPool(DB_NAME, size)
+        await _pool.open()
+        await _load_catalogs()
+    return _pool
+
+
+async def close_pool():
+    """Đóng toàn bộ kết nối trong pool. Gọi khi bot tắt."""
+    global _pool
+    if _pool is not None:
+        await flush_chat_rewards()
+        await _pool.close()
+        _pool = None
+
+
+# Danh mục thành tựu và nhiệm vụ chỉ thay đổi qua migration nên được giữ sẵn trong bộ nhớ
+_achievement_catalog = {}
+_quest_catalog = {}
+_daily_quest_ids = []  # Đã sắp xếp, để cùng một seed luôn chọn ra cùng các nhiệm vụ
+# Cấu hình server: nạp hết khi khởi động, chỉ thay đổi qua update_config (ghi xuyên - write-through)
+_config_cache = {}
+_config_listeners = []
+_level_up_listeners = []
+# Tin nhắn ghim tự động theo kênh: chỉ vài kênh có ghim, nên kênh không có ghim chỉ tốn một lần tra dict
+_pins_by_channel = {}  # channel_id -> {pin_id: dict}
+
+
+async def _load_catalogs():
+    async with reader() as db:
+        async with db.execute("SELECT * FROM achievements") as cursor:
+            _achievement_catalog.clear()
+            _achievement_catalog.update({row['achievement_id']: dict(row) for row in await cursor.fetchall()})
+        async with db.execute("SELECT * FROM quests") as cursor:
+            _quest_catalog.clear()
+            _quest_catalog.update({row['quest_id']: dict(row) for row in await cursor.fetchall()})
+            _daily_quest_ids[:] = sorted(quest_id for quest_id, quest in _quest_catalog.items() if quest['frequency'] == 'DAILY')
+        async with db.execute("SELECT * FROM server_configs") as cursor:
+            _config_cache.clear()
+            _config_cache.update({row['guild_id']: dict(row) for row in await cursor.fetchall()})
+        async with db.execute("SELECT * FROM pinned_messages") as cursor:
+            _pins_by_channel.clear()
+            for row in await cursor.fetchall():
+                _remember_pin(dict(row))
+        scheduler.clear()
+        async with db.execute("SELECT * FROM active_effects") as cursor:
+            rows = await cursor.fetchall()
+            _active_effects.load(rows)
+            for row in rows:
+                scheduler.schedule('effect', (row['user_id'], row['guild_id'], row['effect_type']), row['expiry_timestamp'])
+        # Hạn của role tạm thời, khoản vay và phiên đấu giá: việc đã quá hạn trong lúc bot tắt sẽ chạy bù ngay
+        async with db.execute("SELECT user_id, guild_id, role_id, expiry_timestamp FROM temporary_roles") as cursor:
+            for row in await cursor.fetchall():
+                scheduler.schedule('temp_role', (row['user_id'], row['guild_id'], row['role_id']), row['expiry_timestamp'])
+        async with db.execute("SELECT user_id, guild_id, due_date FROM loans") as cursor:
+            for row in await cursor.fetchall():
+                scheduler.schedule('loan', (row['user_id'], row['guild_id']), row['due_date'])
+        async with db.execute("SELECT message_id, end_timestamp FROM auctions WHERE is_active = 1") as cursor:
+            for row in await cursor.fetchall():
+                scheduler.schedule('auction', row['message_id'], row['end_timestamp'])
+        async with db.execute("SELECT user_id, guild_id, level, xp FROM users") as cursor:
+            _rank_indexes.clear()
+            for row in await cursor.fetchall():
+                _rank_index(row['guild_id']).update(row['user_id'], row['level'], row['xp'])
+    print(f"[DB] Đã nạp cấu hình của {len(_config_cache)} server và {len(scheduler)} việc hẹn giờ vào bộ nhớ.")
+
+
+def add_config_listener(callback):
+    """Đăng ký callback(guild_id, key, value), được gọi sau khi update_config commit thành công."""
+    _config_listeners.append(callback)
+
+
+def remove_config_listener(callback):
+    if callback in _config_listeners:
+        _config_listeners.remove(callback)
+
+
+def add_level_up_listener(callback):
+    """Đăng ký callback(user_id, guild_id, level cũ, level mới), được gọi sau khi một lần cộng XP
+    làm người dùng lên cấp đã commit. Callback là hàm đồng bộ; việc cần await thì tự tạo task."""
+    _level_up_listeners.append(callback)
+
+
+def remove_level_up_listener(callback):
+    if callback in _level_up_listeners:
+        _level_up_listeners.remove(callback)
+
+
+def _notify_level_up(user_id, guild_id, old_level, new_level):
+    for callback in list(_level_up_listeners):
+        try:
+            callback(user_id, guild_id, old_level, new_level)
+        except Exception as e:
+            print(f"[DB] Lỗi trong level-up listener {callback!r}: {e}")
+
+
+def _apply_config_change(guild_id, key, value):
+    _config_cache.setdefault(guild_id, {'guild_id': guild_id})[key] = value
+    for callback in list(_config_listeners):
+        try:
+            callback(guild_id, key, value)
+        except Exception as e:
+            print(f"[DB] Lỗi trong config listener {callback!r}: {e}")
+
+
+def _get_pool():
+    if _pool is None:
+        raise RuntimeError("Pool kết nối database chưa được khởi tạo. Hãy gọi init_pool() trước.")
+    return _pool
+
+
+def reader():
+    """`async with db.reader() as conn:` - mượn một kết nối chỉ-đọc."""
+    return _get_pool().reader()
+
+
+def writer():
+    """`async with db.writer() as conn:` - giữ kết nối ghi, tự commit khi thoát khối."""
+    return _get_pool().writer()
+
+
+def transaction():
+    """`async with db.transaction() as tx:` - gom nhiều thao tác ghi thành MỘT giao dịch.
+
+    Mọi hàm truy cập DB trong module này đều nhận `tx=tx`: khi đó chúng chạy trên kết nối của giao dịch
+    (đọc được cả thay đổi chưa commit) và không tự commit. Cả khối commit một lần khi thoát,
+    hoặc rollback toàn bộ nếu có lỗi. Khóa ghi bị giữ suốt khối, nên:
+    - không gọi Discord API hay chờ người dùng bên trong khối;
+    - không gọi hàm DB nào mà quên truyền `tx=tx` (sẽ tự chờ khóa ghi của chính mình)."""
+    return _get_pool().writer()
+
+
+def _reading(tx):
+    # Trong giao dịch thì đọc trên chính kết nối của giao dịch, ngoài giao dịch thì mượn kết nối đọc
+    return contextlib.nullcontext(tx) if tx is not None else reader()
+
+
+def _writing(tx):
+    # Trong giao dịch thì ghi thẳng (giao dịch tự commit), ngoài giao dịch thì tự mở một giao dịch riêng
+    return contextlib.nullcontext(tx) if tx is not None else writer()
+
+
+# --- BỘ ĐỆM GHI TRỄ XP/COIN TỪ CHAT ---
+
+class ChatRewardBuffer:
+    """Cộng dồn XP/coin kiếm được khi chat theo (user_id, guild_id) trong bộ nhớ,
+    rồi ghi tất cả xuống DB trong một giao dịch executemany duy nhất."""
+
+    def __init__(self, max_pending=CHAT_FLUSH_MAX_PENDING):
+        self.max_pending = max_pending
+        self._pending = {}  # (user_id, guild_id) -> [xp, coins]
+        self._in_flight = {}  # Phần đang được ghi, vẫn tính vào số dư cho tới khi commit xong
+
+    def add(self, user_id, guild_id, xp=0, coins=0):
+        """Cộng dồn thay đổi. Trả về True nếu bộ đệm đã chạm ngưỡng và nên được ghi ngay."""
+        entry = self._pending.setdefault((user_id, guild_id), [0.0, 0])
+        entry[0] += xp
+        entry[1] += coins
+        return len(self._pending) >= self.max_pending
+
+    def peek(self, user_id, guild_id):
+        """Tổng (xp, coins) chưa được ghi xuống DB của một người dùng."""
+        xp, coins = 0.0, 0
+        for source in (self._in_flight, self._pending):
+            if entry := source.get((user_id, guild_id)):
+                xp += entry[0]
+                coins += entry[1]
+        return xp, coins
+
+    def pending_xp(self, user_id, guild_id):
+        entry = self._pending.get((user_id, guild_id))
+        return entry[0] if entry else 0.0
+
+    def consume_xp(self, user_id, guild_id, amount):
+        """Trừ đi phần XP đang chờ đã được ghi trực tiếp xuống DB (XP cộng thêm sau đó vẫn được giữ)."""
+        if entry := self._pending.get((user_id, guild_id)):
+            entry[0] -= amount
+
+    def discard(self, user_id, guild_id, *, xp=False, coins=False):
+        """Bỏ phần XP và/hoặc coin đang chờ khi giá trị trong DB bị đặt lại trực tiếp."""
+        if entry := self._pending.get((user_id, guild_id)):
+            if xp:
+                entry[0] = 0.0
+            if coins:
+                entry[1] = 0
+
+    async def flush(self):
+        """Ghi toàn bộ phần đang chờ xuống DB. Trả về số người dùng đã được ghi."""
+        if not self._pending:
+            return 0
+        batch = {}
+        try:
+            async with writer() as db:
+                # Lấy bộ đệm bên trong khóa ghi để không lẫn với các lệnh ghi trực tiếp khác
+                batch, self._pending = self._pending, {}
+                self._in_flight = batch
+                await db.executemany(
+                    "UPDATE users SET xp = xp + ?, coins = coins + ? WHERE user_id = ? AND guild_id = ?",
+                    [(xp, coins, user_id, guild_id) for (user_id, guild_id), (xp, coins) in batch.items()])
+        except BaseException:
+            # Ghi thất bại (hoặc task bị hủy giữa chừng, vd: khi unload cog): trả lại bộ đệm để lần sau
+            # ghi tiếp, không làm mất XP/coin của ai
+            for (user_id, guild_id), (xp, coins) in batch.items():
+                self.add(user_id, guild_id, xp, coins)
+            raise
+        finally:
+            self._in_flight = {}
+        return len(batch)
+
+
+_chat_rewards = ChatRewardBuffer()
+
+
+def buffer_chat_reward(user_id, guild_id, xp, coins):
+    """Cộng XP/coin từ chat vào bộ đệm. Trả về True nếu nên gọi flush_chat_rewards() ngay."""
+    # Bảng xếp hạng tính luôn phần XP đang chờ ghi, giống như get_or_create_user
+    _rank_index(guild_id).add_xp(user_id, xp)
+    return _chat_rewards.add(user_id, guild_id, xp, coins)
+
+
+async def flush_chat_rewards():
+    return await _chat_rewards.flush()
+
+
+# --- CHỈ MỤC HIỆU ỨNG ĐANG HOẠT ĐỘNG TRONG BỘ NHỚ ---
+
+class ActiveEffects:
+    """Giữ các hiệu ứng (bùa XP, bùa coin...) đang hoạt động trong bộ nhớ.
+
+    Tra cứu "người X có hiệu ứng Y không" chỉ là một lần tra dict. Việc gỡ hiệu ứng đúng lúc hết hạn
+    do bộ hẹn giờ dùng chung (scheduler, loại 'effect') đảm nhận, xem expire_active_effect."""
+
+    def __init__(self):
+        self._expiries = {}  # (user_id, guild_id, effect_type) -> datetime hết hạn
+
+    def load(self, rows):
+        self._expiries.clear()
+        for row in rows:
+            self.set(row['user_id'], row['guild_id'], row['effect_type'], row['expiry_timestamp'])
+
+    def set(self, user_id, guild_id, effect_type, expiry_timestamp_str):
+        self._expiries[(user_id, guild_id, effect_type)] = datetime.datetime.fromisoformat(expiry_timestamp_str)
+
+    def get(self, user_id, guild_id, effect_type):
+        """Trả về thời điểm hết hạn nếu hiệu ứng còn hiệu lực, ngược lại None."""
+        expiry = self._expiries.get((user_id, guild_id, effect_type))
+        if expiry and expiry > datetime.datetime.now(datetime.timezone.utc):
+            return expiry
+        return None
+
+    def is_expired(self, key):
+        """Hiệu ứng còn trong bộ nhớ và đã quá hạn (chưa được gia hạn)."""
+        expiry = self._expiries.get(key)
+        return expiry is not None and expiry <= datetime.datetime.now(datetime.timezone.utc)
+
+    def discard(self, key):
+        self._expiries.pop(key, None)
+
+
+_active_effects = ActiveEffects()
+
+
+# --- CHỈ MỤC XẾP HẠNG THEO SERVER ---
+
+class RankIndex:
+    """Bảng xếp hạng level/XP của một server, giữ trong bộ nhớ dưới dạng danh sách đã sắp xếp chia khối.
+
+    Khóa sắp xếp là (-level, -xp, user_id), cùng thứ tự với index idx_users_leaderboard. Thêm/sửa một
+    người chỉ chèn/xóa trong một khối nhỏ (bisect), tìm hạng hay lấy một đoạn [a, b) chỉ cần cộng kích thước
+    các khối đứng trước - không phải tải và duyệt cả bảng xếp hạng như trước."""
+
+    BUCKET_SIZE = 256
+
+    def __init__(self):
+        self._scores = {}  # user_id -> (level, xp)
+        self._buckets = []  # Các khối khóa đã sắp xếp, nối lại thành toàn bộ bảng xếp hạng
+        self._maxes = []  # Khóa lớn nhất của từng khối, để bisect chọn khối
+
+    def __len__(self):
+        return len(self._scores)
+
+    def __contains__(self, user_id):
+        return user_id in self._scores
+
+    def _key(self, user_id):
+        level, xp = self._scores[user_id]
+        return (-level, -xp, user_id)
+
+    def _locate(self, key):
+        return min(bisect.bisect_left(self._maxes, key), len(self._buckets) - 1)
+
+    def _insert(self, key):
+        if not self._buckets:
+            self._buckets.append([key])
+            self._maxes.append(key)
+            return
+        i = self._locate(key)
+        bucket = self._buckets[i]
+        bisect.insort(bucket, key)
+        self._maxes[i] = bucket[-1]
+        if len(bucket) > 2 * self.BUCKET_SIZE:
+            # Khối quá lớn thì tách đôi để việc chèn/xóa luôn rẻ
+            tail = bucket[self.BUCKET_SIZE:]
+            del bucket[self.BUCKET_SIZE:]
+            self._buckets.insert(i + 1, tail)
+            self._maxes[i] = bucket[-1]
+            self._maxes.insert(i + 1, tail[-1])
+
+    def _remove(self, key):
+        i = self._locate(key)
+        bucket = self._buckets[i]
+        del bucket[bisect.bisect_left(bucket, key)]
+        if bucket:
+            self._maxes[i] = bucket[-1]
+        else:
+            del self._buckets[i]
+            del self._maxes[i]
+
+    def update(self, user_id, level, xp):
+        if user_id in self._scores:
+            self._remove(self._key(user_id))
+        self._scores[user_id] = (level, xp)
+        self._insert(self._key(user_id))
+
+    def add_xp(self, user_id, xp):
+        level, current_xp = self._scores.get(user_id, (1, 0.0))
+        self.update(user_id, level, current_xp + xp)
+
+    def rank(self, user_id):
+        """Hạng (bắt đầu từ 1) của người dùng, hoặc None nếu chưa có trong bảng."""
+        if user_id not in self._scores:
+            return None
+        key = self._key(user_id)
+        i = self._locate(key)
+        return sum(len(bucket) for bucket in self._buckets[:i]) + bisect.bisect_left(self._buckets[i], key) + 1
+
+    def page_after(self, cursor, limit, keep=None):
+        """Phân trang keyset: tối đa `limit` khóa đứng ngay sau `cursor` (None = từ đầu bảng),
+        bỏ qua các user_id mà keep(user_id) trả về False. Trả về (các khóa, còn trang sau không)."""
+        keys = []
+        if not self._buckets:
+            return keys, False
+        if cursor is None:
+            i, j = 0, 0
+        else:
+            i = self._locate(cursor)
+            j = bisect.bisect_right(self._buckets[i], cursor)
+        for bucket in self._buckets[i:]:
+            for key in itertools.islice(bucket, j, None):
+                if keep is not None and not keep(key[2]):
+                    continue
+                if len(keys) == limit:
+                    return keys, True
+                keys.append(key)
+            j = 0
+        return keys, False
+
+    def user_ids(self, start, stop):
+        """user_id của những người ở vị trí [start, stop) (tính từ 0)."""
+        result = []
+        offset = 0
+        for bucket in self._buckets:
+            if offset + len(bucket) > start:
+                result.extend(key[2] for key in bucket[max(0, start - offset):stop - offset])
+                if offset + len(bucket) >= stop:
+                    break
+            offset += len(bucket)
+        return result
+
+
+_rank_indexes = {}  # guild_id -> RankIndex
+
+
+def _rank_index(guild_id):
+    if (index := _rank_indexes.get(guild_id)) is None:
+        index = _rank_indexes[guild_id] = RankIndex()
+    return index
+
+
+async def expire_active_effect(user_id, guild_id, effect_type):
+    """Xóa một hiệu ứng đã hết hạn khỏi DB rồi khỏi bộ nhớ. Trả về False nếu hiệu ứng đã được gia hạn
+    hoặc không còn. Nếu ghi lỗi, hiệu ứng vẫn giữ nguyên để bộ hẹn giờ thử lại."""
+    key = (user_id, guild_id, effect_type)
+    if not _active_effects.is_expired(key):
+        return False
+    # So cả hạn: hiệu ứng được gia hạn ngay trước lần ghi này thì không bị xóa nhầm
+    async with writer() as db:
+        await db.execute("DELETE FROM active_effects WHERE user_id = ? AND guild_id = ? AND effect_type = ? AND expiry_timestamp <= ?",
+                         (*key, datetime.datetime.now(datetime.timezone.utc).isoformat()))
+    if _active_effects.is_expired(key):
+        _active_effects.discard(key)
+    return True
 
 
 # --- TỪ ĐÂY TRỞ XUỐNG, TẤT CẢ HÀM TƯƠNG TÁC VỚI DB ĐỀU LÀ ASYNC ---
 
-async def add_shop_role(guild_id, role_id, price, duration_seconds, description):
-    async with aiosqlite.connect(DB_NAME) as db:
+async def add_shop_role(guild_id, role_id, price, duration_seconds, description, *, tx=None):
+    async with _writing(tx) as db:
         await db.execute('''
             INSERT INTO shop_roles (guild_id, role_id, price, duration_seconds, description) 
             VALUES (?, ?, ?, ?, ?)
@@ -273,74 +858,89 @@ async def add_shop_role(guild_id, role_id, price, duration_seconds, description)
             duration_seconds=excluded.duration_seconds,
             description=excluded.description
         ''', (guild_id, role_id, price, duration_seconds, description))
-        await db.commit()
 
 
-async def get_or_create_user(user_id, guild_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+async def get_or_create_user(user_id, guild_id, *, tx=None):
+    """Lấy thông tin người dùng, tạo mới (500 coin khởi đầu) nếu chưa có.
+
+    Người dùng đã tồn tại chỉ tốn một câu SELECT trên kết nối đọc. Lần đầu gặp thì tạo bằng
+    một câu INSERT ... RETURNING trên kết nối ghi. Dòng thành tựu không được tạo sẵn nữa mà
+    sẽ được tạo khi có tiến trình đầu tiên (xem update_achievement_progress)."""
+    async with _reading(tx) as db:
         async with db.execute("SELECT * FROM users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
             user = await cursor.fetchone()
 
-        if not user:
-            await db.execute("INSERT INTO users (user_id, guild_id, coins) VALUES (?, ?, ?)", (user_id, guild_id, 500))
-            await db.commit()
-            async with db.execute("SELECT * FROM users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
-                user = await cursor.fetchone()
-            # Phải gọi hàm async bằng await
-            await assign_all_achievements_to_user(user_id, guild_id)
-            # Truy vấn lại user để đảm bảo dữ liệu mới nhất
-            async with db.execute("SELECT * FROM users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
+    if not user:
+        async with _writing(tx) as db:
+            async with db.execute("""
+                INSERT INTO users (user_id, guild_id, coins) VALUES (?, ?, ?)
+                ON CONFLICT(user_id, guild_id) DO NOTHING
+                RETURNING *
+            """, (user_id, guild_id, 500)) as cursor:
                 user = await cursor.fetchone()
+            if user:
+                _get_pool().on_commit(lambda: _rank_index(guild_id).update(user_id, user['level'], user['xp']))
+            else:
+                # Một tác vụ khác vừa tạo người dùng này ngay trước đó
+                async with db.execute("SELECT * FROM users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
+                    user = await cursor.fetchone()
+
+    return _with_pending_rewards(dict(user))
 
-        return dict(user)
 
+def _with_pending_rewards(user):
+    """Cộng phần XP/coin còn nằm trong bộ đệm chat để số liệu luôn khớp với thực tế."""
+    pending_xp, pending_coins = _chat_rewards.peek(user['user_id'], user['guild_id'])
+    user['xp'] += pending_xp
+    user['coins'] += pending_coins
+    return user
 
-async def update_user_xp(user_id, guild_id, xp_to_add, *, db_conn=None):
-    # Hàm này có thể dùng kết nối có sẵn (db_conn) hoặc tự tạo mới
-    if db_conn:
-        await db_conn.execute("UPDATE users SET xp = xp + ? WHERE user_id = ? AND guild_id = ?", (xp_to_add, user_id, guild_id))
-        # Không commit ở đây, để hàm gọi bên ngoài commit
-    else:
-        async with aiosqlite.connect(DB_NAME) as db:
-            await db.execute("UPDATE users SET xp = xp + ? WHERE user_id = ? AND guild_id = ?", (xp_to_add, user_id, guild_id))
-            await db.commit()
 
+async def update_user_xp(user_id, guild_id, xp_to_add, *, tx=None):
+    """Cộng XP và tự lên cấp theo xp_curve (kể cả nhảy nhiều cấp), XP thừa được mang sang cấp mới.
+
+    Phần XP chat còn trong bộ đệm được gộp luôn, nên mọi thay đổi nằm trong MỘT câu UPDATE level + xp.
+    Sau khi commit, nếu có lên cấp thì các level-up listener được gọi. Trả về (level cũ, level mới),
+    hoặc None nếu người dùng chưa có hồ sơ."""
+    async with _writing(tx) as db:
+        async with db.execute("SELECT level, xp FROM users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
+            row = await cursor.fetchone()
+        if not row:
+            return None
+        pending_xp = _chat_rewards.pending_xp(user_id, guild_id)
+        old_level = row['level']
+        new_level, new_xp = xp_curve.resolve_level(old_level, row['xp'] + pending_xp + xp_to_add)
+        await db.execute("UPDATE users SET level = ?, xp = ? WHERE user_id = ? AND guild_id = ?", (new_level, new_xp, user_id, guild_id))
 
-async def update_user_level(user_id, guild_id, new_level):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("UPDATE users SET level = ?, xp = 0 WHERE user_id = ? AND guild_id = ?", (new_level, user_id, guild_id))
-        await db.commit()
+        def after_commit():
+            _chat_rewards.consume_xp(user_id, guild_id, pending_xp)
+            # XP chat được cộng thêm trong lúc chờ commit vẫn nằm trong bộ đệm và vẫn tính vào hạng
+            _rank_index(guild_id).update(user_id, new_level, new_xp + _chat_rewards.pending_xp(user_id, guild_id))
+            if new_level > old_level:
+                _notify_level_up(user_id, guild_id, old_level, new_level)
+        _get_pool().on_commit(after_commit)
+    return old_level, new_level
 
 
-async def update_coins(user_id, guild_id, amount, *, db_conn=None):
-    # Hàm này có thể dùng kết nối có sẵn (db_conn) hoặc tự tạo mới
-    if db_conn:
-        await db_conn.execute("UPDATE users SET coins = coins + ? WHERE user_id = ? AND guild_id = ?", (amount, user_id, guild_id))
-        # Không commit ở đây, để hàm gọi bên ngoài commit
-    else:
-        async with aiosqlite.connect(DB_NAME) as db:
-            await db.execute("UPDATE users SET coins = coins + ? WHERE user_id = ? AND guild_id = ?", (amount, user_id, guild_id))
-            await db.commit()
+async def update_coins(user_id, guild_id, amount, *, tx=None):
+    async with _writing(tx) as db:
+        await db.execute("UPDATE users SET coins = coins + ? WHERE user_id = ? AND guild_id = ?", (amount, user_id, guild_id))
 
 
-async def get_user_inventory(user_id, guild_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+async def get_user_inventory(user_id, guild_id, *, tx=None):
+    async with _reading(tx) as db:
         async with db.execute("SELECT item_id, quantity FROM inventory WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
             rows = await cursor.fetchall()
             return {item_id: quantity for item_id, quantity in rows}
 
 
-async def add_item_to_inventory(user_id, guild_id, item_id, quantity=1):
-    async with aiosqlite.connect(DB_NAME) as db:
+async def add_item_to_inventory(user_id, guild_id, item_id, quantity=1, *, tx=None):
+    async with _writing(tx) as db:
         await db.execute("INSERT INTO inventory (user_id, guild_id, item_id, quantity) VALUES (?, ?, ?, ?) ON CONFLICT(user_id, guild_id, item_id) DO UPDATE SET quantity = quantity + ?", (user_id, guild_id, item_id, quantity, quantity))
-        await db.commit()
 
 
-async def remove_item_from_inventory(user_id, guild_id, item_id, quantity=1):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+async def remove_item_from_inventory(user_id, guild_id, item_id, quantity=1, *, tx=None):
+    async with _writing(tx) as db:
         async with db.execute("SELECT quantity FROM inventory WHERE user_id = ? AND guild_id = ? AND item_id = ?", (user_id, guild_id, item_id)) as cursor:
             item = await cursor.fetchone()
 
@@ -352,105 +952,107 @@ async def remove_item_from_inventory(user_id, guild_id, item_id, quantity=1):
         else:
             await db.execute("DELETE FROM inventory WHERE user_id = ? AND guild_id = ? AND item_id = ?", (user_id, guild_id, item_id))
 
-        await db.commit()
         return True
 
 
-async def check_inventory_item(user_id, guild_id, item_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+async def check_inventory_item(user_id, guild_id, item_id, *, tx=None):
+    async with _reading(tx) as db:
         async with db.execute("SELECT quantity FROM inventory WHERE user_id = ? AND guild_id = ? AND item_id = ?", (user_id, guild_id, item_id)) as cursor:
             item = await cursor.fetchone()
         return item['quantity'] if item else 0
 
 
-async def remove_shop_role(guild_id, role_id):
-    async with aiosqlite.connect(DB_NAME) as db:
+async def remove_shop_role(guild_id, role_id, *, tx=None):
+    async with _writing(tx) as db:
         cursor = await db.execute("DELETE FROM shop_roles WHERE guild_id = ? AND role_id = ?", (guild_id, role_id))
         count = cursor.rowcount
-        await db.commit()
         return count
 
 
-async def get_shop_roles(guild_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+async def get_shop_roles(guild_id, *, tx=None):
+    async with _reading(tx) as db:
         async with db.execute("SELECT * FROM shop_roles WHERE guild_id = ?", (guild_id,)) as cursor:
             rows = await cursor.fetchall()
             return [dict(row) for row in rows]
 
 
-async def get_shop_role(guild_id, role_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+async def get_shop_role(guild_id, role_id, *, tx=None):
+    async with _reading(tx) as db:
         async with db.execute("SELECT * FROM shop_roles WHERE guild_id = ? AND role_id = ?", (guild_id, role_id)) as cursor:
             role = await cursor.fetchone()
         return dict(role) if role else None
 
 
-async def add_active_effect(user_id, guild_id, effect_type, expiry_timestamp_str):
-    async with aiosqlite.connect(DB_NAME) as db:
+async def add_active_effect(user_id, guild_id, effect_type, expiry_timestamp_str, *, tx=None):
+    async with _writing(tx) as db:
         await db.execute("INSERT OR REPLACE INTO active_effects (user_id, guild_id, effect_type, expiry_timestamp) VALUES (?, ?, ?, ?)", (user_id, guild_id, effect_type, expiry_timestamp_str))
-        await db.commit()
+        _get_pool().on_commit(lambda: _set_active_effect(user_id, guild_id, effect_type, expiry_timestamp_str))
+
+
+def _set_active_effect(user_id, guild_id, effect_type, expiry_timestamp_str):
+    _active_effects.set(user_id, guild_id, effect_type, expiry_timestamp_str)
+    scheduler.schedule('effect', (user_id, guild_id, effect_type), expiry_timestamp_str)
 
 
 async def get_user_active_effect(user_id, guild_id, effect_type):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT * FROM active_effects WHERE user_id = ? AND guild_id = ? AND effect_type = ?", (user_id, guild_id, effect_type)) as cursor:
-            effect = await cursor.fetchone()
-        if effect and datetime.datetime.fromisoformat(effect['expiry_timestamp']) > datetime.datetime.now(datetime.timezone.utc):
-            return dict(effect)
-        return None
+    """Tra hiệu ứng đang hoạt động từ bộ nhớ, không I/O. Trả về dict như một dòng active_effects hoặc None."""
+    if expiry := _active_effects.get(user_id, guild_id, effect_type):
+        return {'user_id': user_id, 'guild_id': guild_id, 'effect_type': effect_type,
+                'expiry_timestamp': expiry.isoformat()}
+    return None
 
 
-async def add_temporary_role(user_id, guild_id, role_id, expiry_timestamp_str):
-    async with aiosqlite.connect(DB_NAME) as db:
+async def add_temporary_role(user_id, guild_id, role_id, expiry_timestamp_str, *, tx=None):
+    async with _writing(tx) as db:
         await db.execute("INSERT OR REPLACE INTO temporary_roles (user_id, guild_id, role_id, expiry_timestamp) VALUES (?, ?, ?, ?)", (user_id, guild_id, role_id, expiry_timestamp_str))
-        await db.commit()
+        _get_pool().on_commit(lambda: scheduler.schedule('temp_role', (user_id, guild_id, role_id), expiry_timestamp_str))
 
 
-async def remove_temporary_role(user_id, guild_id, role_id):
-    async with aiosqlite.connect(DB_NAME) as db:
+async def remove_temporary_role(user_id, guild_id, role_id, *, tx=None):
+    async with _writing(tx) as db:
         await db.execute("DELETE FROM temporary_roles WHERE user_id = ? AND guild_id = ? AND role_id = ?", (user_id, guild_id, role_id))
-        await db.commit()
+        _get_pool().on_commit(lambda: scheduler.cancel('temp_role', (user_id, guild_id, role_id)))
 
 
-async def get_expired_items(table_name):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
-        now_str = datetime.datetime.now(datetime.timezone.utc).isoformat()
-        async with db.execute(f"SELECT * FROM {table_name} WHERE expiry_timestamp < ?", (now_str,)) as cursor:
-            items = await cursor.fetchall()
-            return [dict(row) for row in items]
+async def update_daily_timestamp(user_id, guild_id, timestamp_str, *, tx=None):
+    async with _writing(tx) as db:
+        await db.execute("UPDATE users SET daily_timestamp = ? WHERE user_id = ? AND guild_id = ?", (timestamp_str, user_id, guild_id))
 
 
-async def clear_expired_items(table_name, primary_keys, items_to_clear):
-    if not items_to_clear:
-        return
-    async with aiosqlite.connect(DB_NAME) as db:
-        placeholders = ' AND '.join([f"{key} = ?" for key in primary_keys])
-        keys_to_delete = [tuple(item[key] for key in primary_keys)
-                          for item in items_to_clear]
-        await db.executemany(f"DELETE FROM {table_name} WHERE {placeholders}", keys_to_delete)
-        await db.commit()
+async def get_leaderboard(guild_id, limit=100, offset=0, *, tx=None):
+    """Lấy `limit` người từ hạng `offset + 1` trở đi. Thứ tự lấy từ chỉ mục xếp hạng trong bộ nhớ,
+    DB chỉ được hỏi theo khóa chính cho đúng những người trên trang đó."""
+    user_ids = _rank_index(guild_id).user_ids(offset, offset + limit)
+    return await _get_leaderboard_rows(guild_id, user_ids, tx=tx)
 
 
-async def update_daily_timestamp(user_id, guild_id, timestamp_str):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("UPDATE users SET daily_timestamp = ? WHERE user_id = ? AND guild_id = ?", (timestamp_str, user_id, guild_id))
-        await db.commit()
+async def get_leaderboard_page(guild_id, after=None, limit=10, keep=None, *, tx=None):
+    """Một trang bảng xếp hạng theo keyset (level, xp, user_id): `after` là khóa của dòng cuối trang trước
+    (None cho trang đầu), `keep(user_id)` dùng để bỏ qua ví dụ như người đã rời server ngay lúc lấy trang.
+    Trả về (các dòng, khóa để lấy trang sau hoặc None nếu đây là trang cuối)."""
+    keys, has_more = _rank_index(guild_id).page_after(after, limit, keep)
+    rows = await _get_leaderboard_rows(guild_id, [key[2] for key in keys], tx=tx)
+    return rows, keys[-1] if has_more else None
 
 
-async def get_leaderboard(guild_id, limit=100):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT user_id, xp, level, coins FROM users WHERE guild_id = ? ORDER BY level DESC, xp DESC LIMIT ?", (guild_id, limit)) as cursor:
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+async def _get_leaderboard_rows(guild_id, user_ids, *, tx=None):
+    # Giữ nguyên thứ tự của user_ids, cộng phần XP/coin còn trong bộ đệm chat
+    if not user_ids:
+        return []
+    id_placeholders = ', '.join('?' * len(user_ids))
+    async with _reading(tx) as db:
+        async with db.execute(f"SELECT user_id, guild_id, xp, level, coins FROM users WHERE guild_id = ? AND user_id IN ({id_placeholders})",
+                              (guild_id, *user_ids)) as cursor:
+            rows = {row['user_id']: dict(row) for row in await cursor.fetchall()}
+    return [_with_pending_rewards(rows[user_id]) for user_id in user_ids if user_id in rows]
+
 
+async def get_user_rank(guild_id, user_id):
+    """Hạng (bắt đầu từ 1) của người dùng trong server, tra từ bộ nhớ. None nếu chưa có hồ sơ."""
+    return _rank_index(guild_id).rank(user_id)
 
-async def get_lottery_pot(guild_id):
+
+async def get_lottery_pot(guild_id, *, tx=None):
     base_prize = 20000
     try:
         from cogs.economy import SHOP_ITEMS
@@ -458,288 +1060,288 @@ async def get_lottery_pot(guild_id):
     except (ImportError, KeyError):
         price = 100
 
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _reading(tx) as db:
         async with db.execute("SELECT SUM(tickets_bought) FROM lottery_tickets WHERE guild_id = ?", (guild_id,)) as cursor:
             total_tickets = (await cursor.fetchone())[0] or 0
     return (total_tickets * price) + base_prize
 
 
-async def get_lottery_participants(guild_id):
-    async with aiosqlite.connect(DB_NAME) as db:
+async def get_lottery_participants(guild_id, *, tx=None):
+    async with _reading(tx) as db:
         async with db.execute("SELECT user_id, tickets_bought FROM lottery_tickets WHERE guild_id = ?", (guild_id,)) as cursor:
             return await cursor.fetchall()
 
 
-async def add_lottery_tickets(guild_id, user_id, amount):
-    async with aiosqlite.connect(DB_NAME) as db:
+async def add_lottery_tickets(guild_id, user_id, amount, *, tx=None):
+    async with _writing(tx) as db:
         await db.execute("INSERT INTO lottery_tickets (guild_id, user_id, tickets_bought) VALUES (?, ?, ?) ON CONFLICT(guild_id, user_id) DO UPDATE SET tickets_bought = tickets_bought + ?", (guild_id, user_id, amount, amount))
-        await db.commit()
 
 
-async def clear_lottery(guild_id):
-    async with aiosqlite.connect(DB_NAME) as db:
+async def clear_lottery(guild_id, *, tx=None):
+    async with _writing(tx) as db:
         await db.execute("DELETE FROM lottery_tickets WHERE guild_id = ?", (guild_id,))
-        await db.commit()
 
 
-async def add_warning(user_id, guild_id, moderator_id, reason):
-    async with aiosqlite.connect(DB_NAME) as db:
+async def add_warning(user_id, guild_id, moderator_id, reason, *, tx=None):
+    async with _writing(tx) as db:
         await db.execute("INSERT INTO warnings (user_id, guild_id, moderator_id, reason) VALUES (?, ?, ?, ?)", (user_id, guild_id, moderator_id, reason))
-        await db.commit()
 
 
-async def get_warnings(user_id, guild_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+async def get_warnings(user_id, guild_id, *, tx=None):
+    async with _reading(tx) as db:
         async with db.execute("SELECT moderator_id, reason, timestamp FROM warnings WHERE user_id = ? AND guild_id = ? ORDER BY timestamp DESC", (user_id, guild_id)) as cursor:
             rows = await cursor.fetchall()
             return [dict(row) for row in rows]
 
 
-async def clear_warnings(user_id, guild_id):
-    async with aiosqlite.connect(DB_NAME) as db:
+async def clear_warnings(user_id, guild_id, *, tx=None):
+    async with _writing(tx) as db:
         cursor = await db.execute("DELETE FROM warnings WHERE user_id = ? AND guild_id = ?", (user_id, guild_id))
         count = cursor.rowcount
-        await db.commit()
         return count
 
 
-async def get_or_create_config(guild_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+async def get_or_create_config(guild_id, *, tx=None):
+    """Lấy cấu hình server. Đọc thẳng từ bộ nhớ (không I/O); chỉ chạm DB khi gặp server mới.
+    Trả về bản sao, sửa dict trả về không ảnh hưởng tới cache - muốn đổi cấu hình hãy dùng update_config."""
+    if (config := _config_cache.get(guild_id)) is not None:
+        return dict(config)
+
+    async with _writing(tx) as db:
+        await db.execute("INSERT OR IGNORE INTO server_configs (guild_id) VALUES (?)", (guild_id,))
         async with db.execute("SELECT * FROM server_configs WHERE guild_id = ?", (guild_id,)) as cursor:
-            config_row = await cursor.fetchone()
-        if not config_row:
-            await db.execute("INSERT INTO server_configs (guild_id) VALUES (?)", (guild_id,))
-            await db.commit()
-            async with db.execute("SELECT * FROM server_configs WHERE guild_id = ?", (guild_id,)) as cursor:
-                config_row = await cursor.fetchone()
-        return dict(config_row)
-
-
-async def update_config(guild_id, key, value):
-    await get_or_create_config(guild_id)
-    async with aiosqlite.connect(DB_NAME) as db:
+            config = dict(await cursor.fetchone())
+        _get_pool().on_commit(lambda: _config_cache.setdefault(guild_id, config))
+    return dict(config)
+
+
+async def update_config(guild_id, key, value, *, tx=None):
+    """Ghi một cột cấu hình xuống DB rồi cập nhật cache và báo cho các config listener sau khi commit."""
+    await get_or_create_config(guild_id, tx=tx)
+    async with _writing(tx) as db:
         await db.execute(f"UPDATE server_configs SET {key} = ? WHERE guild_id = ?", (value, guild_id))
-        await db.commit()
+        _get_pool().on_commit(lambda: _apply_config_change(guild_id, key, value))
 
 
-async def add_level_role(guild_id, level, role_id):
-    async with aiosqlite.connect(DB_NAME) as db:
+async def add_level_role(guild_id, level, role_id, *, tx=None):
+    async with _writing(tx) as db:
         await db.execute("INSERT OR REPLACE INTO level_roles (guild_id, level, role_id) VALUES (?, ?, ?)", (guild_id, level, role_id))
-        await db.commit()
 
 
-async def remove_level_role(guild_id, level):
-    async with aiosqlite.connect(DB_NAME) as db:
+async def remove_level_role(guild_id, level, *, tx=None):
+    async with _writing(tx) as db:
         cursor = await db.execute("DELETE FROM level_roles WHERE guild_id = ? AND level = ?", (guild_id, level))
         count = cursor.rowcount
-        await db.commit()
         return count
 
 
-async def get_level_roles(guild_id):
-    async with aiosqlite.connect(DB_NAME) as db:
+async def get_level_roles(guild_id, *, tx=None):
+    async with _reading(tx) as db:
         async with db.execute("SELECT level, role_id FROM level_roles WHERE guild_id = ? ORDER BY level DESC", (guild_id,)) as cursor:
             rows = await cursor.fetchall()
             return {level: role_id for level, role_id in rows}
 
 
-async def create_auction(guild_id, channel_id, message_id, item_name, item_type, item_id, seller_id, start_price, end_timestamp_str):
-    async with aiosqlite.connect(DB_NAME) as db:
+async def create_auction(guild_id, channel_id, message_id, item_name, item_type, item_id, seller_id, start_price, end_timestamp_str, *, tx=None):
+    async with _writing(tx) as db:
         await db.execute('''
             INSERT INTO auctions (guild_id, channel_id, message_id, item_name, item_type, item_id, seller_id, start_price, current_bid, end_timestamp)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (guild_id, channel_id, message_id, item_name, item_type, item_id, seller_id, start_price, start_price, end_timestamp_str))
-        await db.commit()
+        _get_pool().on_commit(lambda: scheduler.schedule('auction', message_id, end_timestamp_str))
 
 
-async def get_auction(message_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+async def get_auction(message_id, *, tx=None):
+    async with _reading(tx) as db:
         async with db.execute("SELECT * FROM auctions WHERE message_id = ?", (message_id,)) as cursor:
             auction = await cursor.fetchone()
         return dict(auction) if auction else None
 
 
-async def update_bid(message_id, new_bid, bidder_id):
-    async with aiosqlite.connect(DB_NAME) as db:
+async def update_bid(message_id, new_bid, bidder_id, *, tx=None):
+    async with _writing(tx) as db:
         await db.execute('''
             UPDATE auctions 
             SET current_bid = ?, highest_bidder_id = ?
             WHERE message_id = ?
         ''', (new_bid, bidder_id, message_id))
-        await db.commit()
 
 
-async def get_active_auctions():
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT * FROM auctions WHERE is_active = 1") as cursor:
-            auctions = await cursor.fetchall()
-        return [dict(row) for row in auctions]
-
-
-async def end_auction(message_id):
-    async with aiosqlite.connect(DB_NAME) as db:
+async def end_auction(message_id, *, tx=None):
+    async with _writing(tx) as db:
         await db.execute("UPDATE auctions SET is_active = 0 WHERE message_id = ?", (message_id,))
-        await db.commit()
+        _get_pool().on_commit(lambda: scheduler.cancel('auction', message_id))
 
 
-async def create_loan(user_id, guild_id, repayment_amount, due_date_str):
-    async with aiosqlite.connect(DB_NAME) as db:
+async def create_loan(user_id, guild_id, repayment_amount, due_date_str, *, tx=None):
+    async with _writing(tx) as db:
         await db.execute("INSERT OR REPLACE INTO loans (user_id, guild_id, repayment_amount, due_date) VALUES (?, ?, ?, ?)", (user_id, guild_id, repayment_amount, due_date_str))
-        await db.commit()
+        _get_pool().on_commit(lambda: scheduler.schedule('loan', (user_id, guild_id), due_date_str))
 
 
-async def get_loan(user_id, guild_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+async def get_loan(user_id, guild_id, *, tx=None):
+    async with _reading(tx) as db:
         async with db.execute("SELECT * FROM loans WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
             loan = await cursor.fetchone()
         return dict(loan) if loan else None
 
 
-async def delete_loan(user_id, guild_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("DELETE FROM loans WHERE user_id = ? AND guild_id = ?", (user_id, guild_id))
-        await db.commit()
-
-
-async def get_all_loans():
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT * FROM loans") as cursor:
-            loans = await cursor.fetchall()
-        return [dict(row) for row in loans]
-
-
-async def get_quests_by_frequency(frequency):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT * FROM quests WHERE frequency = ?", (frequency,)) as cursor:
-            quests = await cursor.fetchall()
-        return [dict(row) for row in quests]
-
-
-async def assign_user_quests(user_id, guild_id, quest_ids, assigned_date_str):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("DELETE FROM user_quests WHERE user_id = ? AND guild_id = ?", (user_id, guild_id))
-        tasks = [(user_id, guild_id, q_id, assigned_date_str)
-                 for q_id in quest_ids]
-        await db.executemany("INSERT INTO user_quests (user_id, guild_id, quest_id, assigned_date) VALUES (?, ?, ?, ?)", tasks)
-        await db.commit()
-
-
-async def get_user_quests(user_id, guild_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("""
-            SELECT uq.*, q.name, q.description, q.quest_type, q.target_value, q.reward_coin, q.reward_xp
-            FROM user_quests uq
-            JOIN quests q ON uq.quest_id = q.quest_id
-            WHERE uq.user_id = ? AND uq.guild_id = ?
-        """, (user_id, guild_id)) as cursor:
-            quests = await cursor.fetchall()
-        return [dict(row) for row in quests]
+async def get_overdue_loans(now_str, *, tx=None):
+    """Các khoản nợ có hạn trả không muộn hơn `now_str` (chuỗi ISO cùng định dạng với due_date)."""
+    async with _reading(tx) as db:
+        async with db.execute("SELECT user_id, guild_id FROM loans WHERE due_date <= ?", (now_str,)) as cursor:
+            return await cursor.fetchall()
 
 
-async def update_quest_progress(user_id, guild_id, quest_type, value_to_add=1):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("""
-            SELECT uq.quest_id, uq.progress, q.target_value
-            FROM user_quests uq
-            JOIN quests q ON uq.quest_id = q.quest_id
-            WHERE uq.user_id = ? AND uq.guild_id = ? AND q.quest_type = ? AND uq.is_completed = 0
-        """, (user_id, guild_id, quest_type)) as cursor:
-            user_quests_to_update = await cursor.fetchall()
-
-        for quest in user_quests_to_update:
-            new_progress = quest['progress'] + value_to_add
-            await db.execute("UPDATE user_quests SET progress = ? WHERE user_id = ? AND guild_id = ? AND quest_id = ?", (new_progress, user_id, guild_id, quest['quest_id']))
-            if new_progress >= quest['target_value']:
-                await db.execute("UPDATE user_quests SET is_completed = 1 WHERE user_id = ? AND guild_id = ? AND quest_id = ?", (user_id, guild_id, quest['quest_id']))
-        await db.commit()
-
-
-async def claim_quest_reward(user_id, guild_id, quest_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("DELETE FROM user_quests WHERE user_id = ? AND guild_id = ? AND quest_id = ?", (user_id, guild_id, quest_id))
-        await db.commit()
-
-
-async def assign_all_achievements_to_user(user_id, guild_id):
-    """Gán tất cả các thành tựu mặc định cho người dùng khi họ được tạo."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT achievement_id FROM achievements") as cursor:
-            all_achievement_ids = [row['achievement_id'] for row in await cursor.fetchall()]
-
-        user_ach_data = [(user_id, guild_id, ach_id)
-                         for ach_id in all_achievement_ids]
-        await db.executemany("INSERT OR IGNORE INTO user_achievements (user_id, guild_id, achievement_id) VALUES (?, ?, ?)", user_ach_data)
-        await db.commit()
-
-
-async def update_achievement_progress(user_id, guild_id, achievement_type, value_to_add=1):
-    """Cập nhật tiến trình cho một loại thành tựu."""
-    async with aiosqlite.connect(DB_NAME) as db:  # Mở một kết nối duy nhất
-        db.row_factory = aiosqlite.Row
+async def delete_loan(user_id, guild_id, *, tx=None):
+    async with _writing(tx) as db:
+        await db.execute("DELETE FROM loans WHERE user_id = ? AND guild_id = ?", (user_id, guild_id))
+        _get_pool().on_commit(lambda: scheduler.cancel('loan', (user_id, guild_id)))
+
+
+def quest_day(now=None):
+    """Ngày nhiệm vụ (datetime.date) chứa thời điểm `now`; mỗi ngày bắt đầu lúc QUEST_DAY_START_HOUR_UTC giờ UTC."""
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    return (now.astimezone(datetime.timezone.utc) - datetime.timedelta(hours=QUEST_DAY_START_HOUR_UTC)).date()
+
+
+def daily_quest_ids(user_id, guild_id, day=None):
+    """Các nhiệm vụ hằng ngày của một người trong ngày `day`, chọn ngẫu nhiên với seed (user, guild, ngày).
+
+    Kết quả luôn giống nhau với cùng tham số nên không cần giao trước hay lưu lại."""
+    day = day or quest_day()
+    rng = random.Random(f"{user_id}:{guild_id}:{day.isoformat()}")
+    return rng.sample(_daily_quest_ids, min(DAILY_QUEST_COUNT, len(_daily_quest_ids)))
+
+
+async def get_user_quests(user_id, guild_id, *, tx=None):
+    """Nhiệm vụ hôm nay của người dùng (chưa nhận thưởng), kèm thông tin từ danh mục.
+    Nhiệm vụ chưa có tiến trình thì chưa có dòng trong DB và được hiển thị với tiến trình 0."""
+    day_str = quest_day().isoformat()
+    async with _reading(tx) as db:
+        async with db.execute("SELECT * FROM user_quests WHERE user_id = ? AND guild_id = ? AND assigned_date = ?",
+                              (user_id, guild_id, day_str)) as cursor:
+            rows = {row['quest_id']: dict(row) for row in await cursor.fetchall()}
+
+    quests = []
+    for quest_id in daily_quest_ids(user_id, guild_id):
+        row = rows.get(quest_id) or {'user_id': user_id, 'guild_id': guild_id, 'quest_id': quest_id, 'progress': 0,
+                                     'is_completed': 0, 'assigned_date': day_str, 'is_claimed': 0}
+        if not row['is_claimed']:
+            quest = _quest_catalog[quest_id]
+            quests.append({**row, **{key: quest[key] for key in ('name', 'description', 'quest_type', 'target_value', 'reward_coin', 'reward_xp')}})
+    return quests
+
+
+async def update_quest_progress(user_id, guild_id, quest_type, value_to_add=1, *, tx=None):
+    """Cộng tiến trình cho các nhiệm vụ hôm nay thuộc một loại, bằng MỘT câu UPSERT.
+
+    Dòng user_quests được tạo ở lần có tiến trình đầu tiên trong ngày; dòng của ngày cũ (cùng quest_id)
+    được ghi đè như mới. Trả về danh sách các nhiệm vụ vừa hoàn thành sau lần cập nhật này."""
+    quest_ids = [quest_id for quest_id in daily_quest_ids(user_id, guild_id)
+                 if _quest_catalog[quest_id]['quest_type'] == quest_type]
+    if not quest_ids or value_to_add <= 0:
+        return []
+    id_placeholders = ', '.join('?' * len(quest_ids))
+    async with _writing(tx) as db:
+        async with db.execute(f"""
+            INSERT INTO user_quests (user_id, guild_id, quest_id, progress, is_completed, assigned_date)
+            SELECT ?, ?, q.quest_id, ?, ? >= q.target_value, ?
+            FROM quests q WHERE q.quest_id IN ({id_placeholders})
+            ON CONFLICT(user_id, guild_id, quest_id) DO UPDATE SET
+                progress = CASE WHEN user_quests.assigned_date = excluded.assigned_date
+                                THEN user_quests.progress + excluded.progress ELSE excluded.progress END,
+                is_completed = (CASE WHEN user_quests.assigned_date = excluded.assigned_date
+                                     THEN user_quests.progress + excluded.progress ELSE excluded.progress END)
+                               >= (SELECT target_value FROM quests WHERE quest_id = excluded.quest_id),
+                is_claimed = CASE WHEN user_quests.assigned_date = excluded.assigned_date THEN user_quests.is_claimed ELSE 0 END,
+                assigned_date = excluded.assigned_date
+            WHERE user_quests.assigned_date <> excluded.assigned_date OR user_quests.is_completed = 0
+            RETURNING quest_id, progress, is_completed
+        """, (user_id, guild_id, value_to_add, value_to_add, quest_day().isoformat(), *quest_ids)) as cursor:
+            updated_quests = await cursor.fetchall()
+    return [dict(row) for row in updated_quests if row['is_completed']]
+
+
+async def claim_quest_reward(user_id, guild_id, quest_id, *, tx=None):
+    """Đánh dấu đã nhận thưởng một nhiệm vụ hôm nay đã hoàn thành. Trả về False nếu không có gì để nhận
+    (chưa hoàn thành hoặc đã nhận rồi), để người gọi chỉ trao thưởng đúng một lần."""
+    async with _writing(tx) as db:
+        cursor = await db.execute("""
+            UPDATE user_quests SET is_claimed = 1
+            WHERE user_id = ? AND guild_id = ? AND quest_id = ? AND assigned_date = ? AND is_completed = 1 AND is_claimed = 0
+        """, (user_id, guild_id, quest_id, quest_day().isoformat()))
+        return cursor.rowcount > 0
+
+
+async def delete_stale_user_quests(*, tx=None):
+    """Xóa tiến trình nhiệm vụ của các ngày trước. Trả về số dòng đã xóa."""
+    async with _writing(tx) as db:
+        cursor = await db.execute("DELETE FROM user_quests WHERE assigned_date < ?", (quest_day().isoformat(),))
+        return cursor.rowcount
+
+
+async def update_achievement_progress(user_id, guild_id, achievement_type, value_to_add=1, *, tx=None):
+    """Cập nhật tiến trình cho một loại thành tựu bằng MỘT câu UPSERT ... RETURNING.
+
+    Dòng thành tựu được tạo lười khi có tiến trình đầu tiên. Với 'REACH_LEVEL', tiến trình được
+    đặt bằng value_to_add (level hiện tại) thay vì cộng dồn. Trả về danh sách các thành tựu vừa
+    mở khóa kèm thông tin hiển thị và phần thưởng; phần thưởng được cộng trong cùng giao dịch."""
+    if value_to_add <= 0:
+        # Không có tiến trình thì không tạo dòng nào
+        return []
+    now_str = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    async with _writing(tx) as db:  # Dùng chung một kết nối ghi duy nhất
         async with db.execute("""
-            SELECT ua.achievement_id, ua.progress, a.target_value, a.name, a.reward_coin, a.reward_xp
-            FROM user_achievements ua
-            JOIN achievements a ON ua.achievement_id = a.achievement_id
-            WHERE ua.user_id = ? AND ua.guild_id = ? AND a.achievement_type = ? AND ua.unlocked_timestamp IS NULL
-        """, (user_id, guild_id, achievement_type)) as cursor:
-            achievements_to_update = await cursor.fetchall()
-
-        unlocked_achievements = []
-        for ach in achievements_to_update:
-            if achievement_type == 'REACH_LEVEL':
-                new_progress = value_to_add
-            else:
-                new_progress = ach['progress'] + value_to_add
-
-            await db.execute("UPDATE user_achievements SET progress = ? WHERE user_id = ? AND guild_id = ? AND achievement_id = ?", (new_progress, user_id, guild_id, ach['achievement_id']))
-
-            if new_progress >= ach['target_value']:
-                now_str = datetime.datetime.now(
-                    datetime.timezone.utc).isoformat()
-                await db.execute("UPDATE user_achievements SET unlocked_timestamp = ? WHERE user_id = ? AND guild_id = ? AND achievement_id = ?", (now_str, user_id, guild_id, ach['achievement_id']))
-
-                if ach['reward_coin'] > 0:
-                    # Truyền kết nối 'db' hiện tại vào hàm con
-                    await update_coins(user_id, guild_id, ach['reward_coin'], db_conn=db)
-                if ach['reward_xp'] > 0:
-                    # Truyền kết nối 'db' hiện tại vào hàm con
-                    await update_user_xp(user_id, guild_id, ach['reward_xp'], db_conn=db)
-
-                unlocked_achievements.append(dict(ach))
-
-        await db.commit()  # Commit tất cả thay đổi (cả achievement và rewards) cùng lúc
+            INSERT INTO user_achievements (user_id, guild_id, achievement_id, progress, unlocked_timestamp)
+            SELECT :user_id, :guild_id, a.achievement_id, :value, CASE WHEN :value >= a.target_value THEN :now END
+            FROM achievements a WHERE a.achievement_type = :achievement_type
+            ON CONFLICT(user_id, guild_id, achievement_id) DO UPDATE SET
+                progress = CASE WHEN :absolute THEN excluded.progress ELSE user_achievements.progress + excluded.progress END,
+                unlocked_timestamp = CASE
+                    WHEN (CASE WHEN :absolute THEN excluded.progress ELSE user_achievements.progress + excluded.progress END)
+                         >= (SELECT target_value FROM achievements WHERE achievement_id = excluded.achievement_id)
+                    THEN :now END
+            WHERE user_achievements.unlocked_timestamp IS NULL
+            RETURNING achievement_id, progress, unlocked_timestamp
+        """, {'user_id': user_id, 'guild_id': guild_id, 'achievement_type': achievement_type, 'value': value_to_add,
+              'absolute': achievement_type == 'REACH_LEVEL', 'now': now_str}) as cursor:
+            updated_rows = await cursor.fetchall()
+
+        # Ghép thông tin hiển thị/phần thưởng từ danh mục thành tựu trong bộ nhớ, không cần truy vấn thêm
+        unlocked_achievements = [{**_achievement_catalog[row['achievement_id']], **dict(row)}
+                                 for row in updated_rows if row['unlocked_timestamp']]
+        reward_coin = sum(ach['reward_coin'] for ach in unlocked_achievements)
+        reward_xp = sum(ach['reward_xp'] for ach in unlocked_achievements)
+        # Truyền kết nối 'db' hiện tại vào hàm con để phần thưởng nằm chung giao dịch
+        if reward_coin > 0:
+            await update_coins(user_id, guild_id, reward_coin, tx=db)
+        if reward_xp > 0:
+            await update_user_xp(user_id, guild_id, reward_xp, tx=db)
+        # Tất cả thay đổi (cả achievement và rewards) được commit cùng lúc với giao dịch bao ngoài
         return unlocked_achievements
 
 
-async def get_user_achievements(user_id, guild_id):
-    """Lấy danh sách tất cả thành tựu (đã hoàn thành và chưa) của người dùng."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+async def get_user_achievements(user_id, guild_id, *, tx=None):
+    """Lấy danh sách tất cả thành tựu (đã hoàn thành và chưa) của người dùng.
+    Thành tựu chưa có dòng tiến trình nào được trả về với progress = 0."""
+    async with _reading(tx) as db:
         async with db.execute("""
-            SELECT ua.*, a.name, a.description, a.target_value, a.reward_coin, a.reward_xp, a.badge_emoji
-            FROM user_achievements ua
-            JOIN achievements a ON ua.achievement_id = a.achievement_id
-            WHERE ua.user_id = ? AND ua.guild_id = ?
+            SELECT a.achievement_id, ? AS user_id, ? AS guild_id,
+                   COALESCE(ua.progress, 0) AS progress, ua.unlocked_timestamp,
+                   a.name, a.description, a.target_value, a.reward_coin, a.reward_xp, a.badge_emoji
+            FROM achievements a
+            LEFT JOIN user_achievements ua
+                ON ua.achievement_id = a.achievement_id AND ua.user_id = ? AND ua.guild_id = ?
             ORDER BY ua.unlocked_timestamp DESC, a.name ASC
-        """, (user_id, guild_id)) as cursor:
+        """, (user_id, guild_id, user_id, guild_id)) as cursor:
             achievements = await cursor.fetchall()
         return [dict(row) for row in achievements]
 
 
-async def get_user_completed_achievements(user_id, guild_id):
+async def get_user_completed_achievements(user_id, guild_id, *, tx=None):
     """Lấy danh sách emoji và tên của các thành tựu ĐÃ HOÀN THÀNH."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+    async with _reading(tx) as db:
         async with db.execute("""
             SELECT a.name, a.badge_emoji
             FROM user_achievements ua
@@ -751,195 +1353,211 @@ async def get_user_completed_achievements(user_id, guild_id):
         return [dict(row) for row in badges]
 
 
-async def set_coins(user_id, guild_id, amount):
+async def set_coins(user_id, guild_id, amount, *, tx=None):
     """Trực tiếp đặt số coin của người dùng thành một giá trị cụ thể."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute('''
+    async with _writing(tx) as db:
+        async with db.execute('''
             INSERT INTO users (user_id, guild_id, coins) VALUES (?, ?, ?)
             ON CONFLICT(user_id, guild_id) DO UPDATE SET coins = excluded.coins
-        ''', (user_id, guild_id, amount))
-        await db.commit()
+            RETURNING level, xp
+        ''', (user_id, guild_id, amount)) as cursor:
+            user = await cursor.fetchone()
+
+        def after_commit():
+            # Coin chat còn trong bộ đệm bị giá trị mới thay thế, nhưng chỉ bỏ khi lần đặt này thực sự commit
+            _chat_rewards.discard(user_id, guild_id, coins=True)
+            # Người dùng vừa được tạo bởi lần đặt này cũng phải có mặt trên bảng xếp hạng
+            if user_id not in (index := _rank_index(guild_id)):
+                index.update(user_id, user['level'], user['xp'])
+        _get_pool().on_commit(after_commit)
 
 
-async def remove_item_from_all_inventories(guild_id, item_id):
+async def remove_item_from_all_inventories(guild_id, item_id, *, tx=None):
     """Xóa một loại vật phẩm nhất định khỏi kho đồ của tất cả mọi người trong server."""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _writing(tx) as db:
         await db.execute("DELETE FROM inventory WHERE guild_id = ? AND item_id = ?", (guild_id, item_id))
-        await db.commit()
 
 
-async def get_partner(guild_id, user_id):
+async def get_partner(guild_id, user_id, *, tx=None):
     """Tìm bạn đời của một người dùng trong một server cụ thể."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
-        # Sửa lỗi: Thêm guild_id vào câu truy vấn và truyền đủ 3 tham số
-        query = "SELECT user1_id, user2_id FROM relationships WHERE guild_id = ? AND (user1_id = ? OR user2_id = ?)"
-        async with db.execute(query, (guild_id, user_id, user_id)) as cursor:
+    async with _reading(tx) as db:
+        # Tách OR thành 2 nhánh để mỗi nhánh dùng được index riêng (khóa chính và idx_relationships_user2)
+        query = """
+            SELECT user2_id AS partner_id FROM relationships WHERE guild_id = ? AND user1_id = ?
+            UNION ALL
+            SELECT user1_id AS partner_id FROM relationships WHERE guild_id = ? AND user2_id = ?
+            LIMIT 1
+        """
+        async with db.execute(query, (guild_id, user_id, guild_id, user_id)) as cursor:
             relationship = await cursor.fetchone()
 
-        if not relationship:
-            return None
-
         # Trả về ID của người còn lại
-        partner_id = relationship['user2_id'] if relationship['user1_id'] == user_id else relationship['user1_id']
-        return partner_id
+        return relationship['partner_id'] if relationship else None
 
 
-async def create_marriage(guild_id, user1_id, user2_id):
+async def create_marriage(guild_id, user1_id, user2_id, *, tx=None):
     """Tạo một mối quan hệ hôn nhân."""
     # Sắp xếp để ID nhỏ hơn luôn nằm ở user1_id
     if user1_id > user2_id:
         user1_id, user2_id = user2_id, user1_id
 
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _writing(tx) as db:
         now_str = datetime.datetime.now(datetime.timezone.utc).isoformat()
         await db.execute(
             "INSERT INTO relationships (guild_id, user1_id, user2_id, relationship_type, timestamp) VALUES (?, ?, ?, ?, ?)",
             (guild_id, user1_id, user2_id, 'MARRIED', now_str)
         )
-        await db.commit()
 
 
-async def delete_marriage(guild_id, user1_id, user2_id):
+async def delete_marriage(guild_id, user1_id, user2_id, *, tx=None):
     """Xóa một mối quan hệ hôn nhân."""
     # Sắp xếp để ID nhỏ hơn luôn nằm ở user1_id
     if user1_id > user2_id:
         user1_id, user2_id = user2_id, user1_id
 
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _writing(tx) as db:
         await db.execute(
             "DELETE FROM relationships WHERE guild_id = ? AND user1_id = ? AND user2_id = ?",
             (guild_id, user1_id, user2_id)
         )
-        await db.commit()
 
 
-async def get_boss(guild_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+async def get_boss(guild_id, *, tx=None):
+    async with _reading(tx) as db:
         async with db.execute("SELECT * FROM world_boss WHERE guild_id = ?", (guild_id,)) as cursor:
             return await cursor.fetchone()
 
 
-async def create_boss(guild_id, name, hp, msg_id, chan_id, spawned_by):
-    async with aiosqlite.connect(DB_NAME) as db:
+async def create_boss(guild_id, name, hp, msg_id, chan_id, spawned_by, *, tx=None):
+    async with _writing(tx) as db:
         await db.execute(
             "INSERT INTO world_boss (guild_id, boss_name, current_hp, max_hp, message_id, channel_id, spawned_by_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
             (guild_id, name, hp, hp, msg_id, chan_id, spawned_by)
         )
-        await db.commit()
 
 
-async def update_boss_hp(guild_id, damage):
-    async with aiosqlite.connect(DB_NAME) as db:
+async def update_boss_hp(guild_id, damage, *, tx=None):
+    async with _writing(tx) as db:
         await db.execute("UPDATE world_boss SET current_hp = current_hp - ? WHERE guild_id = ?", (damage, guild_id))
-        await db.commit()
 
 
-async def delete_boss(guild_id):
-    async with aiosqlite.connect(DB_NAME) as db:
+async def delete_boss(guild_id, *, tx=None):
+    async with _writing(tx) as db:
         await db.execute("DELETE FROM world_boss WHERE guild_id = ?", (guild_id,))
-        await db.commit()
 
 
-async def get_attacker(guild_id, user_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+async def get_attacker(guild_id, user_id, *, tx=None):
+    async with _reading(tx) as db:
         async with db.execute("SELECT * FROM boss_attackers WHERE guild_id = ? AND user_id = ?", (guild_id, user_id)) as cursor:
             return await cursor.fetchone()
 
 
-async def log_attack(guild_id, user_id, damage):
-    async with aiosqlite.connect(DB_NAME) as db:
+async def log_attack(guild_id, user_id, damage, *, tx=None):
+    async with _writing(tx) as db:
         now_str = datetime.datetime.now(datetime.timezone.utc).isoformat()
         await db.execute(
             "INSERT INTO boss_attackers (guild_id, user_id, total_damage, last_attack_timestamp) VALUES (?, ?, ?, ?) ON CONFLICT(guild_id, user_id) DO UPDATE SET total_damage = total_damage + excluded.total_damage, last_attack_timestamp = excluded.last_attack_timestamp",
             (guild_id, user_id, damage, now_str)
         )
-        await db.commit()
 
 
-async def get_all_attackers(guild_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+async def get_all_attackers(guild_id, *, tx=None):
+    async with _reading(tx) as db:
         async with db.execute("SELECT * FROM boss_attackers WHERE guild_id = ? ORDER BY total_damage DESC", (guild_id,)) as cursor:
             return await cursor.fetchall()
 
 
-async def clear_attackers(guild_id):
-    async with aiosqlite.connect(DB_NAME) as db:
+async def clear_attackers(guild_id, *, tx=None):
+    async with _writing(tx) as db:
         await db.execute("DELETE FROM boss_attackers WHERE guild_id = ?", (guild_id,))
-        await db.commit()
 
 
-async def add_pinned_message(guild_id, channel_id, author_id, content, embed, last_message_id):
-    async with aiosqlite.connect(DB_NAME) as db:
+async def add_pinned_message(guild_id, channel_id, author_id, content, embed, last_message_id, *, tx=None):
+    async with _writing(tx) as db:
         embed_json = json.dumps(embed.to_dict()) if embed else None
         cursor = await db.execute(
             "INSERT INTO pinned_messages (guild_id, channel_id, author_id, message_content, embed_data, last_message_id) VALUES (?, ?, ?, ?, ?, ?)",
             (guild_id, channel_id, author_id, content, embed_json, last_message_id)
         )
-        await db.commit()
-        return cursor.lastrowid  # Trả về ID của pin mới
+        pin_id = cursor.lastrowid
+        pin = {'pin_id': pin_id, 'guild_id': guild_id, 'channel_id': channel_id, 'author_id': author_id,
+               'message_content': content, 'embed_data': embed_json, 'last_message_id': last_message_id}
+        _get_pool().on_commit(lambda: _remember_pin(pin))
+        return pin_id  # Trả về ID của pin mới
 
 
-async def get_pinned_message(pin_id, guild_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+async def get_pinned_message(pin_id, guild_id, *, tx=None):
+    async with _reading(tx) as db:
         async with db.execute("SELECT * FROM pinned_messages WHERE pin_id = ? AND guild_id = ?", (pin_id, guild_id)) as cursor:
             return await cursor.fetchone()
 
 
-async def get_pinned_messages_for_channel(channel_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT * FROM pinned_messages WHERE channel_id = ?", (channel_id,)) as cursor:
-            return await cursor.fetchall()
+def has_pinned_messages(channel_id):
+    """Kênh có tin nhắn ghim tự động hay không. Đọc từ bộ nhớ, dùng được trong on_message."""
+    return channel_id in _pins_by_channel
+
 
+async def get_pinned_messages_for_channel(channel_id, *, tx=None):
+    """Các ghim của kênh theo thứ tự tạo. Đọc từ bộ nhớ (không I/O), trả về bản sao."""
+    pins = _pins_by_channel.get(channel_id, {})
+    return [dict(pins[pin_id]) for pin_id in sorted(pins)]
 
-async def remove_pinned_message(pin_id):
-    async with aiosqlite.connect(DB_NAME) as db:
+
+def _remember_pin(pin):
+    _pins_by_channel.setdefault(pin['channel_id'], {})[pin['pin_id']] = pin
+
+
+def _forget_pin(pin_id):
+    for channel_id, pins in list(_pins_by_channel.items()):
+        if pins.pop(pin_id, None) is not None and not pins:
+            del _pins_by_channel[channel_id]
+
+
+def _set_pin_message_id(pin_id, new_message_id):
+    for pins in _pins_by_channel.values():
+        if (pin := pins.get(pin_id)) is not None:
+            pin['last_message_id'] = new_message_id
+
+
+async def remove_pinned_message(pin_id, *, tx=None):
+    async with _writing(tx) as db:
         await db.execute("DELETE FROM pinned_messages WHERE pin_id = ?", (pin_id,))
-        await db.commit()
+        _get_pool().on_commit(lambda: _forget_pin(pin_id))
 
 
-async def update_last_message_id(pin_id, new_message_id):
-    async with aiosqlite.connect(DB_NAME) as db:
+async def update_last_message_id(pin_id, new_message_id, *, tx=None):
+    async with _writing(tx) as db:
         await db.execute("UPDATE pinned_messages SET last_message_id = ? WHERE pin_id = ?", (new_message_id, pin_id))
-        await db.commit()
+        _get_pool().on_commit(lambda: _set_pin_message_id(pin_id, new_message_id))
 
 
-async def get_all_pinned_messages(guild_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+async def get_all_pinned_messages(guild_id, *, tx=None):
+    async with _reading(tx) as db:
         async with db.execute("SELECT * FROM pinned_messages WHERE guild_id = ?", (guild_id,)) as cursor:
             return await cursor.fetchall()
 
 
-async def add_temp_vc(guild_id, creator_id, channel_id):
-    async with aiosqlite.connect(DB_NAME) as db:
+async def add_temp_vc(guild_id, creator_id, channel_id, *, tx=None):
+    async with _writing(tx) as db:
         await db.execute(
             "INSERT INTO temp_voice_channels (guild_id, creator_id, channel_id) VALUES (?, ?, ?)",
             (guild_id, creator_id, channel_id)
         )
-        await db.commit()
 
 
-async def get_temp_vc_by_channel(channel_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+async def get_temp_vc_by_channel(channel_id, *, tx=None):
+    async with _reading(tx) as db:
         async with db.execute("SELECT * FROM temp_voice_channels WHERE channel_id = ?", (channel_id,)) as cursor:
             return await cursor.fetchone()
 
 
-async def remove_temp_vc(channel_id):
-    async with aiosqlite.connect(DB_NAME) as db:
+async def remove_temp_vc(channel_id, *, tx=None):
+    async with _writing(tx) as db:
         await db.execute("DELETE FROM temp_voice_channels WHERE channel_id = ?", (channel_id,))
-        await db.commit()
 
 
-async def update_perm_damage_bonus(user_id, guild_id, bonus_to_add):
+async def update_perm_damage_bonus(user_id, guild_id, bonus_to_add, *, tx=None):
     """Cộng thêm bonus sát thương vĩnh viễn cho người dùng."""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _writing(tx) as db:
         await db.execute("UPDATE users SET perm_damage_bonus = perm_damage_bonus + ? WHERE user_id = ? AND guild_id = ?", (bonus_to_add, user_id, guild_id))
-        await db.commit()
+
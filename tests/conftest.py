@@ -0,0 +1,18 @@
+# tests/conftest.py
+import pathlib
+import sys
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import database as db  # noqa: E402
+
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """DB tạm đã chạy đủ migration; bot_data.db thật không bị động tới."""
+    monkeypatch.setattr(db, 'DB_NAME', str(tmp_path / 'test.db'))
+    db.init_db()
+    return db
@@ -0,0 +1,123 @@
+# tests/test_audit_log.py
+import asyncio
+import datetime
+import types
+
+import discord
+
+from cogs.utils.audit_log import AuditLogAttributor
+
+DELETE = discord.AuditLogAction.message_delete
+
+
+class FakeGuild:
+    """Guild giả: audit_logs() trả về các mục đã đặt sẵn, hoặc ném lỗi `error`."""
+
+    def __init__(self, entries=(), error=None):
+        self.id = 1
+        self.entries = list(entries)
+        self.error = error
+        self.fetches = 0
+
+    async def audit_logs(self, limit, action):
+        self.fetches += 1
+        if self.error is not None:
+            raise self.error
+        for entry in self.entries:
+            yield entry
+
+
+def _entry(entry_id, channel_id, target_id, deleter, count=1):
+    return types.SimpleNamespace(
+        id=entry_id, user=deleter, target=types.SimpleNamespace(id=target_id),
+        extra=types.SimpleNamespace(channel=types.SimpleNamespace(id=channel_id), count=count),
+        created_at=datetime.datetime.now(datetime.timezone.utc))
+
+
+def _run(scenario):
+    return asyncio.run(asyncio.wait_for(scenario(), 5))
+
+
+def test_deletes_in_one_window_share_one_fetch():
+    moderator = object()
+    guild = FakeGuild([_entry(100, 10, 20, moderator, count=2)])
+    attributor = AuditLogAttributor(window=0.01)
+
+    async def scenario():
+        return await asyncio.gather(
+            attributor.message_deleter(guild, 10, 20),
+            attributor.message_deleter(guild, 10, 20),
+            attributor.message_deleter(guild, 10, 20),  # Không có mục thứ ba: người gửi tự xóa
+            attributor.message_deleter(guild, 11, 20))
+    assert _run(scenario) == [moderator, moderator, None, None]
+    assert guild.fetches == 1
+    assert attributor.requests == 4
+
+
+def test_count_delta_credits_only_new_deletions():
+    moderator = object()
+    entry = _entry(100, 10, 20, moderator, count=1)
+    guild = FakeGuild([entry])
+    attributor = AuditLogAttributor(window=0.01)
+
+    async def scenario():
+        first = await attributor.message_deleter(guild, 10, 20)
+        # Discord gộp lần xóa thứ hai vào cùng mục và chỉ tăng count
+        entry.extra.count = 2
+        second = await attributor.message_deleter(guild, 10, 20)
+        # Count không đổi: lần xóa này không phải do moderator
+        third = await attributor.message_deleter(guild, 10, 20)
+        return first, second, third
+    assert _run(scenario) == (moderator, moderator, None)
+
+
+def test_fetch_error_resolves_every_request():
+    attributor = AuditLogAttributor(window=0.01)
+
+    async def scenario():
+        results = []
+        for error in (RuntimeError("mất kết nối"),
+                      discord.Forbidden(types.SimpleNamespace(status=403, reason="Forbidden"), "thiếu quyền")):
+            guild = FakeGuild(error=error)
+            results.append(await asyncio.gather(attributor.message_deleter(guild, 10, 20),
+                                                attributor.bulk_deleter(guild, 10)))
+            attributor.drop_guild(guild.id)
+        return results
+    assert _run(scenario) == [[None, None], [None, None]]
+
+
+def test_drop_guild_resolves_waiting_requests():
+    guild = FakeGuild([_entry(100, 10, 20, object())])
+    attributor = AuditLogAttributor(window=3600)
+
+    async def scenario():
+        request = asyncio.ensure_future(attributor.message_deleter(guild, 10, 20))
+        await asyncio.sleep(0)
+        attributor.drop_guild(guild.id)
+        return await request
+    assert _run(scenario) is None
+    assert guild.fetches == 0
+
+
+def test_requests_during_fetch_get_a_new_round():
+    moderator = object()
+    attributor = AuditLogAttributor(window=0.01)
+    late = []
+
+    class SlowGuild(FakeGuild):
+        async def audit_logs(self, limit, action):
+            first = self.fetches == 0
+            async for entry in super().audit_logs(limit, action):
+                yield entry
+            if first:
+                # Một lần xóa mới tới trong lúc đang lấy audit log; mục của nó chỉ có ở lần lấy sau
+                late.append(asyncio.ensure_future(attributor.message_deleter(self, 10, 30)))
+                self.entries.append(_entry(101, 10, 30, moderator))
+
+    guild = SlowGuild([_entry(100, 10, 20, moderator)])
+
+    async def scenario():
+        first = await attributor.message_deleter(guild, 10, 20)
+        return first, await late[0]
+    assert _run(scenario) == (moderator, moderator)
+    assert guild.fetches == 2
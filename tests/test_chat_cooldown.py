@@ -0,0 +1,53 @@
+# tests/test_chat_cooldown.py
+from cogs.utils.chat_cooldown import ChatCooldown
+
+
+def test_burst_then_refill():
+    cooldown = ChatCooldown()
+    # Đầy 3 lượt: dùng hết ngay, lượt thứ 4 bị từ chối
+    assert [cooldown.try_acquire(1, 1, 3, 10, now=0) for _ in range(4)] == [True, True, True, False]
+    # Chưa đủ một lượt hồi
+    assert not cooldown.try_acquire(1, 1, 3, 10, now=9.9)
+    # Lần bị từ chối không làm mất phần đã hồi: đủ 10 giây tính từ lúc hết lượt là có lại một lượt
+    assert cooldown.try_acquire(1, 1, 3, 10, now=10)
+    assert not cooldown.try_acquire(1, 1, 3, 10, now=10)
+
+
+def test_refill_is_capped_at_capacity():
+    cooldown = ChatCooldown()
+    assert cooldown.try_acquire(1, 1, 2, 10, now=0)
+    # Nghỉ rất lâu cũng chỉ hồi tối đa `capacity` lượt
+    assert [cooldown.try_acquire(1, 1, 2, 10, now=1000) for _ in range(3)] == [True, True, False]
+
+
+def test_buckets_are_per_user_and_guild():
+    cooldown = ChatCooldown()
+    assert cooldown.try_acquire(1, 1, 1, 10, now=0)
+    assert not cooldown.try_acquire(1, 1, 1, 10, now=0)
+    assert cooldown.try_acquire(1, 2, 1, 10, now=0)
+    assert cooldown.try_acquire(2, 1, 1, 10, now=0)
+
+
+def test_disabled_limit_always_allows():
+    cooldown = ChatCooldown()
+    assert all(cooldown.try_acquire(1, 1, 1, 0, now=0) for _ in range(10))
+
+
+def test_prune_drops_only_full_buckets():
+    cooldown = ChatCooldown()
+    cooldown.try_acquire(1, 1, 2, 10, now=0)  # Đầy lại lúc 10
+    cooldown.try_acquire(1, 2, 2, 10, now=0)
+    cooldown.try_acquire(1, 2, 2, 10, now=0)  # Đầy lại lúc 20
+    assert cooldown.prune(now=15) == 1
+    assert cooldown.prune(now=20) == 1
+    # Bucket đã bỏ được coi như chưa chat: lại đủ lượt
+    assert [cooldown.try_acquire(1, 2, 2, 10, now=20) for _ in range(3)] == [True, True, False]
+
+
+def test_reset_guild():
+    cooldown = ChatCooldown()
+    cooldown.try_acquire(1, 1, 1, 10, now=0)
+    cooldown.try_acquire(2, 1, 1, 10, now=0)
+    cooldown.reset_guild(1)
+    assert cooldown.try_acquire(1, 1, 1, 10, now=0)
+    assert not cooldown.try_acquire(2, 1, 1, 10, now=0)
@@ -0,0 +1,60 @@
+# tests/test_chat_rewards.py
+# Bộ đệm XP/coin từ chat: lần ghi bị hủy giữa chừng không được làm mất phần thưởng nào.
+import asyncio
+import sqlite3
+
+
+def _balances(db):
+    conn = sqlite3.connect(db.DB_NAME)
+    try:
+        return dict(((user_id, guild_id), (xp, coins)) for user_id, guild_id, xp, coins
+                    in conn.execute("SELECT user_id, guild_id, xp, coins FROM users"))
+    finally:
+        conn.close()
+
+
+def test_cancelled_flush_keeps_rewards(temp_db):
+    db = temp_db
+    conn = sqlite3.connect(db.DB_NAME)
+    conn.executemany("INSERT INTO users (user_id, guild_id, xp, coins) VALUES (?, 1, 0, 0)", [(1,), (2,)])
+    conn.commit()
+    conn.close()
+
+    async def scenario():
+        await db.init_pool(size=1)
+        try:
+            buffer = db.ChatRewardBuffer()
+            buffer.add(1, 1, xp=10, coins=5)
+            buffer.add(2, 1, xp=3, coins=1)
+
+            writer = db._get_pool()._writer
+            executemany = writer.executemany
+            started = asyncio.Event()
+
+            async def slow_executemany(*args):
+                await executemany(*args)
+                started.set()
+                await asyncio.sleep(3600)
+
+            writer.executemany = slow_executemany
+            flush = asyncio.create_task(buffer.flush())
+            await started.wait()
+            flush.cancel()
+            try:
+                await flush
+            except asyncio.CancelledError:
+                pass
+            del writer.executemany
+
+            # Giao dịch bị rollback, phần thưởng quay lại bộ đệm
+            assert buffer.peek(1, 1) == (10, 5)
+            assert buffer.peek(2, 1) == (3, 1)
+            assert _balances(db) == {(1, 1): (0, 0), (2, 1): (0, 0)}
+
+            assert await buffer.flush() == 2
+            assert buffer.peek(1, 1) == (0.0, 0)
+        finally:
+            await db.close_pool()
+        assert _balances(db) == {(1, 1): (10, 5), (2, 1): (3, 1)}
+
+    asyncio.run(scenario())
@@ -0,0 +1,43 @@
+# tests/test_message_cache.py
+from cogs.utils.message_cache import CachedMessage, GuildMessageCache, MessageCache
+
+
+def _record(message_id, content="hello"):
+    return CachedMessage(message_id, 10, 20, content, None, ())
+
+
+def test_evicts_least_recently_put():
+    cache = GuildMessageCache(capacity=2)
+    assert cache.put(_record(1)) == 0
+    assert cache.put(_record(2)) == 0
+    assert cache.put(_record(1, "edited")) == 0  # Sửa tin nhắn đưa nó lên mới nhất
+    assert cache.put(_record(3)) == 1
+    assert cache.get(2) is None
+    assert cache.get(1).content == "edited"
+    assert len(cache) == 2
+
+
+def test_nbytes_tracks_puts_pops_and_evictions():
+    cache = GuildMessageCache(capacity=3)
+    records = [_record(message_id, "x" * message_id * 10) for message_id in range(1, 5)]
+    for record in records:
+        cache.put(record)
+    assert cache.nbytes == sum(record.nbytes for record in records[1:])
+    cache.pop(3)
+    assert cache.nbytes == records[1].nbytes + records[3].nbytes
+    assert cache.resize(1) == 1
+    assert cache.nbytes == records[3].nbytes
+
+
+def test_hit_rate_and_per_guild_isolation():
+    cache = MessageCache()
+    cache.put(1, _record(100), capacity=1)
+    cache.put(2, _record(200), capacity=1)
+    cache.put(1, _record(101), capacity=1)
+    assert cache.evictions == 1
+    assert cache.pop(1, 100) is None
+    assert cache.pop(1, 101).message_id == 101
+    assert cache.pop(2, 200).message_id == 200
+    assert cache.pop(3, 300) is None
+    assert cache.hit_rate == 0.5
+    assert len(cache) == 0
@@ -0,0 +1,105 @@
+# tests/test_query_plans.py
+# Kiểm tra mọi câu SQL trong database.py đều dùng index: chạy EXPLAIN QUERY PLAN trên một DB
+# trong bộ nhớ đã chạy đủ MIGRATIONS.
+import ast
+import itertools
+import pathlib
+import re
+import sqlite3
+import sys
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import database as db  # noqa: E402
+
+# Giá trị mẫu cho các biến được ghép vào f-string SQL
+SQL_TEMPLATE_SAMPLES = {
+    'key': ('log_channel_id',),
+    'id_placeholders': ('?, ?, ?',),
+}
+
+
+def _render_sql_templates(node):
+    """Trả về các câu SQL cụ thể từ một chuỗi/f-string trong mã nguồn."""
+    if isinstance(node, ast.Constant):
+        return [node.value] if isinstance(node.value, str) else []
+    parts = []
+    for value in node.values:
+        if isinstance(value, ast.Constant):
+            parts.append((value.value,))
+        elif isinstance(value.value, ast.Name) and value.value.id in SQL_TEMPLATE_SAMPLES:
+            parts.append(SQL_TEMPLATE_SAMPLES[value.value.id])
+        else:
+            return []
+    return [''.join(combo) for combo in itertools.product(*parts)]
+
+
+def _collect_statements():
+    """(tên hàm, câu SQL) cho mọi câu SQL trong các hàm async của database.py."""
+    tree = ast.parse((ROOT / 'database.py').read_text(encoding='utf-8'))
+    statements = []
+    for func in ast.walk(tree):
+        if not isinstance(func, ast.AsyncFunctionDef):
+            continue
+        # Phần hằng bên trong f-string chỉ là mảnh của câu SQL, đã được ghép lại khi xét cả f-string
+        fstring_parts = {id(part) for node in ast.walk(func) if isinstance(node, ast.JoinedStr) for part in node.values}
+        for node in ast.walk(func):
+            if not isinstance(node, (ast.Constant, ast.JoinedStr)) or id(node) in fstring_parts:
+                continue
+            for sql in _render_sql_templates(node):
+                statement = ' '.join(sql.split())
+                if statement.split(' ', 1)[0].upper() in ('SELECT', 'UPDATE', 'DELETE', 'INSERT'):
+                    statements.append((func.name, statement))
+    return statements
+
+
+STATEMENTS = _collect_statements()
+
+
+@pytest.fixture(scope='module')
+def cursor():
+    conn = sqlite3.connect(":memory:")
+    cursor = conn.cursor()
+    for _, _, migrate in db.MIGRATIONS:
+        migrate(cursor)
+    yield cursor
+    conn.close()
+
+
+@pytest.fixture(scope='module')
+def partial_indexes(cursor):
+    return [row[0] for row in cursor.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND sql LIKE '% WHERE %'")]
+
+
+def _plan_steps(cursor, statement):
+    named_params = re.findall(r':(\w+)', statement)
+    params = dict.fromkeys(named_params) if named_params else (None,) * statement.count('?')
+    plan = cursor.execute(f"EXPLAIN QUERY PLAN {statement}", params).fetchall()
+    # Chỉ giữ các bước đọc bảng, bỏ các bước như USE TEMP B-TREE FOR ORDER BY
+    return [row[3] for row in plan if row[3].startswith(('SCAN', 'SEARCH'))]
+
+
+def test_statements_found():
+    assert any(' JOIN ' in statement.upper() for _, statement in STATEMENTS)
+    assert len(STATEMENTS) > 50
+
+
+@pytest.mark.parametrize('func_name, statement', STATEMENTS, ids=[func_name for func_name, _ in STATEMENTS])
+def test_query_uses_index(cursor, partial_indexes, func_name, statement):
+    """Câu lệnh có WHERE không được quét toàn bảng. Với JOIN, mọi bảng sau bảng dẫn đầu phải được tra
+    bằng index; bảng dẫn đầu chỉ được quét khi câu lệnh không có WHERE (cố ý đọc cả bảng, vd: danh mục).
+    Quét một partial index (chỉ chứa đúng các dòng thỏa điều kiện) không bị tính là quét toàn bảng."""
+    steps = _plan_steps(cursor, statement)
+    # AUTOMATIC INDEX là index tạm SQLite dựng lại mỗi lần chạy câu lệnh, tốn như quét toàn bảng
+    full_scans = [step for step in steps
+                  if (step.startswith('SCAN') or 'AUTOMATIC' in step)
+                  and not any(f"INDEX {name}" in step for name in partial_indexes)]
+    upper = statement.upper()
+    if ' JOIN ' in upper:
+        assert not [step for step in full_scans if step != steps[0]], f"{func_name}: bảng được JOIN bị quét toàn bảng {steps}"
+    if ' WHERE ' in upper:
+        assert not full_scans, f"{func_name}: quét toàn bảng {full_scans}"
@@ -0,0 +1,109 @@
+# tests/test_rank_index.py
+# Bảng xếp hạng trong bộ nhớ (RankIndex) phải luôn khớp với bảng users.
+import asyncio
+import random
+
+import pytest
+
+import database as db
+
+
+def test_set_coins_registers_new_user(temp_db):
+    db = temp_db
+
+    async def scenario():
+        await db.init_pool(size=1)
+        try:
+            await db.get_or_create_user(1, 10)
+            await db.set_coins(2, 10, 1000)
+            await db.set_coins(1, 10, 50)
+            assert await db.get_user_rank(10, 1) == 1
+            assert await db.get_user_rank(10, 2) == 2
+
+            # Giao dịch bị rollback thì người dùng không được thêm vào bảng xếp hạng
+            with pytest.raises(RuntimeError):
+                async with db.transaction() as tx:
+                    await db.set_coins(3, 10, 1000, tx=tx)
+                    raise RuntimeError
+            assert await db.get_user_rank(10, 3) is None
+        finally:
+            await db.close_pool()
+
+    asyncio.run(scenario())
+
+
+def _sorted_ids(scores):
+    return [user_id for user_id, (level, xp) in sorted(scores.items(), key=lambda item: (-item[1][0], -item[1][1], item[0]))]
+
+
+@pytest.fixture
+def index():
+    index = db.RankIndex()
+    index.BUCKET_SIZE = 2  # Khối nhỏ để các lần tách/xóa khối đều được chạy tới
+    return index
+
+
+def test_rank_after_update(index):
+    rng = random.Random(1)
+    scores = {}
+    for _ in range(300):
+        user_id = rng.randrange(40)
+        scores[user_id] = (rng.randrange(1, 5), float(rng.randrange(100)))
+        index.update(user_id, *scores[user_id])
+    assert len(index) == len(scores)
+    for rank, user_id in enumerate(_sorted_ids(scores), start=1):
+        assert index.rank(user_id) == rank
+    assert index.rank(999) is None
+
+
+def test_add_xp_moves_user_up(index):
+    index.update(1, 2, 10.0)
+    index.update(2, 2, 20.0)
+    index.update(3, 1, 0.0)
+    assert [index.rank(user_id) for user_id in (2, 1, 3)] == [1, 2, 3]
+    index.add_xp(1, 15)
+    assert [index.rank(user_id) for user_id in (1, 2, 3)] == [1, 2, 3]
+    # Người chưa có trong bảng bắt đầu từ level 1
+    index.add_xp(4, 5)
+    assert index.rank(4) == 3
+
+
+def test_page_after_walks_every_key_once(index):
+    for user_id in range(25):
+        index.update(user_id, user_id % 3 + 1, float(user_id))
+    expected = _sorted_ids({user_id: index._scores[user_id] for user_id in range(25)})
+
+    pages, cursor = [], None
+    while True:
+        keys, has_more = index.page_after(cursor, 7)
+        pages.append([key[2] for key in keys])
+        if not has_more:
+            break
+        cursor = keys[-1]
+    assert [len(page) for page in pages] == [7, 7, 7, 4]
+    assert sum(pages, []) == expected
+    assert index.user_ids(7, 14) == pages[1]
+
+
+def test_page_after_cursor_survives_updates(index):
+    for user_id in range(10):
+        index.update(user_id, 1, float(user_id))
+    keys, _ = index.page_after(None, 3)
+    assert [key[2] for key in keys] == [9, 8, 7]
+    # Người ở trang đầu tụt hạng sau khi trang đã hiện: trang sau vẫn tiếp tục đúng từ khóa cuối
+    index.update(8, 1, 0.5)
+    keys, has_more = index.page_after(keys[-1], 3)
+    assert [key[2] for key in keys] == [6, 5, 4]
+    assert has_more
+
+
+def test_page_after_keep_filter(index):
+    for user_id in range(10):
+        index.update(user_id, 1, float(user_id))
+    keys, has_more = index.page_after(None, 3, keep=lambda user_id: user_id % 2 == 0)
+    assert [key[2] for key in keys] == [8, 6, 4]
+    assert has_more
+    keys, has_more = index.page_after(keys[-1], 3, keep=lambda user_id: user_id % 2 == 0)
+    assert [key[2] for key in keys] == [2, 0]
+    assert not has_more
+    assert db.RankIndex().page_after(None, 3) == ([], False)
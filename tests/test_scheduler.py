@@ -0,0 +1,126 @@
+# tests/test_scheduler.py
+import asyncio
+import time
+
+from cogs.utils import scheduler as scheduler_module
+from cogs.utils.scheduler import TimerScheduler
+
+
+def _run(scenario):
+    asyncio.run(asyncio.wait_for(scenario(), 5))
+
+
+def test_fires_in_due_order():
+    async def scenario():
+        scheduler, fired = TimerScheduler(), []
+
+        async def handler(key):
+            fired.append(key)
+        scheduler.add_handler('job', handler)
+        now = time.time()
+        scheduler.schedule('job', 'b', now + 0.1)
+        scheduler.schedule('job', 'a', now + 0.05)
+        scheduler.schedule('job', 'late', now - 60)  # Quá hạn lúc bot tắt: chạy bù ngay
+        scheduler.start()
+        await asyncio.sleep(0.2)
+        scheduler.stop()
+        assert fired == ['late', 'a', 'b']
+        assert len(scheduler) == 0
+    _run(scenario)
+
+
+def test_reschedule_and_cancel():
+    async def scenario():
+        scheduler, fired = TimerScheduler(), []
+
+        async def handler(key):
+            fired.append((key, time.time()))
+        scheduler.add_handler('job', handler)
+        start = time.time()
+        scheduler.schedule('job', 'moved', start + 0.05)
+        scheduler.schedule('job', 'cancelled', start + 0.05)
+        scheduler.start()
+        # Dời hạn: mục cũ trong heap bị bỏ qua, việc chỉ chạy một lần ở hạn mới
+        scheduler.schedule('job', 'moved', start + 0.15)
+        scheduler.cancel('job', 'cancelled')
+        await asyncio.sleep(0.1)
+        assert fired == []
+        await asyncio.sleep(0.15)
+        scheduler.stop()
+        assert [key for key, _ in fired] == ['moved']
+        assert fired[0][1] >= start + 0.15
+    _run(scenario)
+
+
+def test_earlier_job_wakes_sleeping_runner():
+    async def scenario():
+        scheduler, fired = TimerScheduler(), []
+
+        async def handler(key):
+            fired.append(key)
+        scheduler.add_handler('job', handler)
+        scheduler.schedule('job', 'far', time.time() + 3600)
+        scheduler.start()
+        await asyncio.sleep(0.01)
+        scheduler.schedule('job', 'soon', time.time() + 0.05)
+        await asyncio.sleep(0.1)
+        scheduler.stop()
+        assert fired == ['soon']
+    _run(scenario)
+
+
+def test_parked_until_handler_added():
+    async def scenario():
+        scheduler, fired = TimerScheduler(), []
+
+        async def handler(key):
+            fired.append(key)
+        scheduler.schedule('job', 'waiting', time.time() - 1)
+        scheduler.start()
+        await asyncio.sleep(0.05)
+        assert len(scheduler) == 1
+        scheduler.add_handler('job', handler)
+        await asyncio.sleep(0.05)
+        scheduler.stop()
+        assert fired == ['waiting']
+    _run(scenario)
+
+
+def test_failed_handler_is_retried(monkeypatch):
+    monkeypatch.setattr(scheduler_module, 'TIMER_RETRY_SECONDS', 0.05)
+
+    async def scenario():
+        scheduler, attempts = TimerScheduler(), []
+
+        async def handler(key):
+            attempts.append(key)
+            if len(attempts) == 1:
+                raise RuntimeError("lỗi tạm thời")
+        scheduler.add_handler('job', handler)
+        scheduler.schedule('job', 'flaky', time.time())
+        scheduler.start()
+        await asyncio.sleep(0.2)
+        scheduler.stop()
+        assert attempts == ['flaky', 'flaky']
+        assert len(scheduler) == 0
+    _run(scenario)
+
+
+def test_batch_handler_gets_all_due_keys_and_retries_failed(monkeypatch):
+    monkeypatch.setattr(scheduler_module, 'TIMER_RETRY_SECONDS', 0.05)
+
+    async def scenario():
+        scheduler, batches = TimerScheduler(), []
+
+        async def handler(keys):
+            batches.append(keys)
+            return [key for key in keys if key == 2 and len(batches) == 1]
+        scheduler.add_handler('job', handler, batch=True)
+        now = time.time()
+        for key in (1, 2, 3):
+            scheduler.schedule('job', key, now)
+        scheduler.start()
+        await asyncio.sleep(0.2)
+        scheduler.stop()
+        assert batches == [[1, 2, 3], [2]]
+    _run(scenario)
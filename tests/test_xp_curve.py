@@ -0,0 +1,40 @@
+# tests/test_xp_curve.py
+from cogs.utils import xp_curve
+
+
+def test_no_level_up_below_threshold():
+    assert xp_curve.resolve_level(1, xp_curve.xp_needed(1) - 1) == (1, xp_curve.xp_needed(1) - 1)
+
+
+def test_exact_threshold_levels_up():
+    assert xp_curve.resolve_level(1, xp_curve.xp_needed(1)) == (2, 0)
+
+
+def test_multi_level_jump_carries_remainder():
+    xp = xp_curve.xp_needed(3) + xp_curve.xp_needed(4) + xp_curve.xp_needed(5) + 7
+    assert xp_curve.resolve_level(3, xp) == (6, 7)
+
+
+def test_negative_xp_never_levels_down():
+    assert xp_curve.resolve_level(5, -10) == (5, -10)
+
+
+def test_max_level_keeps_accumulating():
+    top = xp_curve.MAX_LEVEL
+    assert xp_curve.resolve_level(top, 10 ** 9) == (top, 10 ** 9)
+    level, xp = xp_curve.resolve_level(top - 1, xp_curve.xp_needed(top - 1) * 3)
+    assert level == top
+    assert xp == xp_curve.xp_needed(top - 1) * 2
+
+
+def test_matches_step_by_step_loop():
+    # Cách tính cũ: trừ dần XP của từng cấp
+    def step_by_step(level, xp):
+        while xp >= xp_curve.xp_needed(level) and level < xp_curve.MAX_LEVEL:
+            xp -= xp_curve.xp_needed(level)
+            level += 1
+        return level, xp
+
+    for level in (1, 2, 17, 250, 998):
+        for xp in (0, 99, 100, 12345, 10 ** 6, 10 ** 8):
+            assert xp_curve.resolve_level(level, xp) == step_by_step(level, xp)